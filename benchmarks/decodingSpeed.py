@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+"""
+Decoding-speed benchmark for the arc-eager parser.
+
+Compares action selection by sorting all labeled transitions per step against a
+masked argmax over the score vector, on synthetic scores (no model needed), and
+optionally prints a speed/accuracy table of greedy and beam decoding of a CoNLL
+treebank with a trained model:
+
+    python3 -m benchmarks.decodingSpeed --labels 40 --steps 100000
+    python3 -m benchmarks.decodingSpeed --model models/parser/clearnlp-parser --treebank dev.conll --beams 1,4,8
+"""
+
+import sys
+import random
+import timeit
+import argparse
+import numpy as np
+
+from utils.arcEager import ArcEager
+
+
+def synthetic_steps(n_labels, n_steps):
+    transitions = {'SHIFT':0,'LEFTARC':1,'RIGHTARC':2,'REDUCE':3}
+    tdlabels = [('SHIFT', None), ('REDUCE', None)]
+    tdlabels += [(t, 'l%d' %l) for t in ('LEFTARC', 'RIGHTARC') for l in range(n_labels)]
+    i2td = dict(enumerate(tdlabels))
+    steps = []
+    for _ in range(n_steps):
+        valid = dict.fromkeys(random.sample(range(4), random.randint(1, 4)))
+        steps.append((np.random.randn(len(i2td)).astype(np.float32), valid))
+    return i2td, transitions, steps
+
+def sorted_selection(steps, i2td, transitions):
+    actions = []
+    for scores, valid in steps:
+        for score, action in sorted(zip(scores, range(len(scores))), reverse=True):
+            if transitions[i2td[action][0]] in valid:
+                actions.append(action)
+                break
+    return actions
+
+def masked_selection(steps, system, masks):
+    return [system.best_action(scores, system.valid_mask(masks, valid)) for scores, valid in steps]
+
+def bench_selection(n_labels, n_steps, repeat):
+    i2td, transitions, steps = synthetic_steps(n_labels, n_steps)
+    system = ArcEager()
+    masks = system.build_transition_masks(i2td, transitions)
+    assert sorted_selection(steps, i2td, transitions) == masked_selection(steps, system, masks)
+    old = min(timeit.repeat(lambda: sorted_selection(steps, i2td, transitions), number=1, repeat=repeat))
+    new = min(timeit.repeat(lambda: masked_selection(steps, system, masks), number=1, repeat=repeat))
+    sys.stdout.write("Labeled transitions: %d, steps: %d\n" % (len(i2td), n_steps))
+    sys.stdout.write("sorted walk   : %8.1f steps/sec\n" % (n_steps/old))
+    sys.stdout.write("masked argmax : %8.1f steps/sec (x%.1f)\n" % (n_steps/new, old/new))
+
+def bench_decoding(model, treebank, beams):
+    """Speed/accuracy table of greedy (K=1) and beam decoding on a treebank."""
+    from tools import parser as dparser
+    dparser.args.isDaemon = False
+    dparser.args.outfile = None
+    dparser.args.lang = 'eng'
+    with open(treebank) as fp:
+        n_sents = fp.read().count('\n\n')
+    parsermodel = dparser.Parser(model=model)
+    sys.stdout.write("\n%6s %10s %8s %8s\n" % ('beam', 'sents/sec', 'UAS', 'LAS'))
+    for beam in beams:
+        dparser.args.beam = beam
+        start = timeit.default_timer()
+        POS, UAS, LS, LAS = dparser.Test(parsermodel, treebank)
+        elapsed = timeit.default_timer() - start
+        sys.stdout.write("%6d %10.1f %8.2f %8.2f\n" % (beam, n_sents/elapsed, UAS, LAS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parser decoding-speed benchmark")
+    parser.add_argument('--labels', type=int, default=39, help='Dependency labels (2*labels+2 transitions)')
+    parser.add_argument('--steps', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model', help='Trained parser model prefix')
+    parser.add_argument('--treebank', help='CONLL file to decode with --model')
+    parser.add_argument('--beams', default='1,4,8', help='Comma separated beam sizes for --treebank')
+    args = parser.parse_args()
+    random.seed(37)
+    np.random.seed(37)
+
+    bench_selection(args.labels, args.steps, args.repeat)
+    if args.model and args.treebank:
+        bench_decoding(args.model, args.treebank, [int(k) for k in args.beams.split(',')])
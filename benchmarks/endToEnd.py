@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+
+"""
+End-to-end benchmark of every pipeline stage on randomly initialized models.
+
+The tagger, parser and relation classifier are built from their `Meta` defaults with
+random embeddings over the vocabulary of the input text (text.txt unless --text is
+given), so no trained model is needed; the tree transformations run on synthetic
+trees. Throughput and per-item latency of each stage are written as JSON, and two
+runs can be compared for regressions:
+
+    python3 -m benchmarks.endToEnd --save bench.json
+    python3 -m benchmarks.endToEnd --baseline bench.json --tolerance 0.1
+    python3 -m benchmarks.endToEnd --compare before.json after.json
+"""
+
+import io
+import re
+import sys
+import json
+import random
+import timeit
+import argparse
+import platform
+import traceback
+from collections import namedtuple, Counter
+
+import numpy as np
+
+from utils.dependencyGraph import DependencyGraph, StringTable
+from utils.pseudoProjectivity import projectivize, deprojectivize
+
+_TAGS_ = ['NN', 'NNS', 'NNP', 'VB', 'VBD', 'VBZ', 'JJ', 'RB', 'IN', 'DT', 'CC', 'PRP', 'CD', 'TO', 'MD', 'PUNCT']
+_LABELS_ = ['nsubj', 'obj', 'amod', 'det', 'case', 'nmod', 'advmod', 'conj', 'cc', 'punct', 'root']
+_STAGES_ = ['tag_sent', 'parse', 'projectivize', 'deprojectivize', 'extractKeyphrases', 'get_npmi',
+            'generatePairs', 'predict_hyp']
+
+vocab_entry = namedtuple('vocab_entry', ['index'])
+
+
+class RandomEmbeddings(object):
+    """word2vec-like `vocab`/`syn0` of random vectors, in place of the pretrained `wvm`."""
+
+    def __init__(self, words, dim=64):
+        self.vocab = dict((w, vocab_entry(i)) for i, w in enumerate(sorted(words)))
+        self.syn0 = np.random.uniform(-0.1, 0.1, (len(self.vocab), dim)).astype(np.float32)
+
+
+def read_sentences(fname, scale=1):
+    """Tokenized sentences of a plain text file, repeated `scale` times."""
+    with io.open(fname, encoding='utf-8') as fp:
+        text = fp.read()
+    sentences = [re.findall(r"\w+(?:-\w+)*|[^\w\s]", s) for s in re.split(r"(?<=[.!?])\s+", text)]
+    return [s for s in sentences if s] * scale
+
+def char_vocabulary(meta, sentences):
+    meta.cc = Counter(c for words in sentences for w in words for c in w)
+    meta.cc.update(['bos', 'eos', 'unk'])
+    meta.c2i = dict((c, i) for i, c in enumerate(meta.cc))
+    meta.n_chars = len(meta.c2i)
+
+def word_vocabulary(meta, wvm):
+    meta.w_dim = wvm.syn0.shape[1]
+    meta.n_words = wvm.syn0.shape[0]+meta.add_words
+    meta.w2i = dict((w, V.index+meta.add_words) for w, V in wvm.vocab.items())
+
+def build_tagger(sentences, wvm):
+    from tools import tagger
+    meta = tagger.Meta()
+    word_vocabulary(meta, wvm)
+    char_vocabulary(meta, sentences)
+    meta.i2t = dict(enumerate(_TAGS_))
+    meta.t2i = dict((t, i) for i, t in meta.i2t.items())
+    meta.n_tags = len(_TAGS_)
+    tagger.wvm = wvm
+    return tagger.Tagger(meta=meta)
+
+def build_parser(sentences, wvm):
+    from tools import parser
+    meta = parser.Meta()
+    word_vocabulary(meta, wvm)
+    char_vocabulary(meta, sentences)
+    meta.i2p = dict(enumerate(_TAGS_))
+    meta.p2i = dict((t, i) for i, t in meta.i2p.items())
+    meta.n_tags = len(_TAGS_)
+    tdlabels = [('SHIFT', None), ('REDUCE', None)] + [(t, l) for t in ('LEFTARC', 'RIGHTARC') for l in _LABELS_]
+    meta.i2td = dict(enumerate(tdlabels))
+    meta.td2i = dict((v, k) for k, v in meta.i2td.items())
+    meta.n_outs = len(tdlabels)
+    parser.wvm = wvm
+    parser.args.isDaemon = True
+    return parser, parser.Parser(meta=meta)
+
+def build_relation_model(wvm):
+    from tools import subsumptionExtractor as onto
+    meta = onto.Meta()
+    meta.w_dim = meta.lstm_word_dim = wvm.syn0.shape[1]
+    meta.n_words = wvm.syn0.shape[0]
+    meta.n_chars = 2
+    meta.n_out = len(meta.tdmaps)
+    meta.rmaps = dict((v, k) for k, v in meta.tdmaps.items())
+    meta.w2i = dict((w, V.index) for w, V in wvm.vocab.items())
+    onto.wvm = wvm
+    return onto.SubsumptionLearning(meta=meta)
+
+def attach(heads, lo, hi, head):
+    """Random projective subtree over tokens lo..hi under `head`."""
+    if lo > hi:
+        return
+    r = random.randint(lo, hi)
+    heads[r] = head
+    attach(heads, lo, r-1, r)
+    attach(heads, r+1, hi, r)
+
+def synthetic_graphs(n_sents, nonprojective=0.2, min_len=3, max_len=40):
+    """Random projective trees; a `nonprojective` share get one arc moved to a random non-descendant."""
+    strings = StringTable()
+    graphs = []
+    for _ in range(n_sents):
+        n = random.randint(min_len, max_len)
+        heads = [0]*(n+1)
+        attach(heads, 1, n, 0)
+        if random.random() < nonprojective:
+            d = random.randint(1, n)
+            descendants, stack = set([d]), [d]
+            while stack:
+                h = stack.pop()
+                kids = [i for i in range(1, n+1) if heads[i] == h]
+                descendants.update(kids)
+                stack.extend(kids)
+            candidates = [i for i in range(1, n+1) if i not in descendants]
+            if candidates:
+                heads[d] = random.choice(candidates)
+        rows = [(i, 'w%d' % random.randint(0, 5000), '_', random.choice(_TAGS_), '_', '_', heads[i],
+                 'root' if heads[i] == 0 else random.choice(_LABELS_[:-1]), '_') for i in range(1, n+1)]
+        graphs.append(DependencyGraph.from_rows(strings, rows))
+    return graphs
+
+def deprojectivizable(graph):
+    """False for the label patterns deprojectivize can not undo (see utils.pseudoProjectivity)."""
+    try:
+        deprojectivize(graph.copy(deep=True))
+    except ValueError:
+        return False
+    return True
+
+def decoded(graph):
+    """A projectivized graph as the parser would leave it after a perfect decode."""
+    graph.pheads[:] = graph.heads
+    graph.plabels[:] = graph.labels
+    return graph
+
+
+def stage_setup(name, sentences, args):
+    """(items, function, tokens per item) of a stage; built lazily so that a missing dependency only skips its stage."""
+    texts = [' '.join(words) for words in sentences]
+    if name == 'tag_sent':
+        tagger = build_tagger(sentences, RandomEmbeddings(set(w for s in sentences for w in s), args.dim))
+        return sentences, tagger.tag_sent, len
+    if name == 'parse':
+        parser, model = build_parser(sentences, RandomEmbeddings(set(w for s in sentences for w in s), args.dim))
+        return sentences, lambda words: parser.parse_batch(model, [words]), len
+    if name in ('projectivize', 'deprojectivize'):
+        graphs = synthetic_graphs(args.trees)
+        if name == 'projectivize':
+            return graphs, lambda graph: projectivize(graph.copy(deep=True)), lambda graph: graph.n
+        graphs = list(filter(deprojectivizable, [decoded(projectivize(graph.copy(deep=True))) for graph in graphs]))
+        return graphs, lambda graph: deprojectivize(graph.copy(deep=True)), lambda graph: graph.n
+    if name == 'extractKeyphrases':
+        from utils.keyPhraseExtraction import extractKeyphrases
+        return [texts], extractKeyphrases, lambda text: sum(len(s.split()) for s in text)
+    if name == 'get_npmi':
+        from utils.wordAssociationScore import get_npmi
+        return [sentences], get_npmi, lambda text: sum(len(s) for s in text)
+    if name == 'generatePairs':
+        from utils.keyPhraseExtraction import generatePairs
+        return [texts], lambda text: list(generatePairs(text)), lambda text: sum(len(s.split()) for s in text)
+    if name == 'predict_hyp':
+        words = set(w.lower() for s in sentences for w in s)
+        model = build_relation_model(RandomEmbeddings(words, args.dim))
+        vocab = sorted(words)
+        rng = random.Random(37)
+        pairs = [(' '.join(rng.sample(vocab, rng.randint(1, 3))), ' '.join(rng.sample(vocab, rng.randint(1, 3))))
+                 for _ in range(args.pairs)]
+        return pairs, lambda pair: model.predict_hyp(*pair), lambda pair: 1
+    raise ValueError('unknown stage %s' % name)
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+def measure(items, function, size, repeat):
+    """Throughput and per-item latency of the fastest of `repeat` passes over the items."""
+    function(items[0])  # warm up (lazy imports, first graph)
+    best = None
+    for _ in range(repeat):
+        latencies = []
+        for item in items:
+            start = timeit.default_timer()
+            function(item)
+            latencies.append(timeit.default_timer() - start)
+        if best is None or sum(latencies) < sum(best):
+            best = latencies
+    seconds = sum(best)
+    tokens = sum(size(item) for item in items)
+    return {'items': len(items),
+            'tokens': tokens,
+            'seconds': seconds,
+            'items_per_sec': len(items)/seconds if seconds else 0.0,
+            'tokens_per_sec': tokens/seconds if seconds else 0.0,
+            'latency_ms': {'mean': 1e3*seconds/len(items),
+                           'p50': 1e3*percentile(best, 50),
+                           'p95': 1e3*percentile(best, 95),
+                           'max': 1e3*max(best)}}
+
+def run(stages, sentences, args):
+    results = {}
+    for name in stages:
+        sys.stderr.write("%s ...\n" % name)
+        try:
+            items, function, size = stage_setup(name, sentences, args)
+            results[name] = measure(items, function, size, args.repeat)
+        except Exception as e:
+            # e.g. dynet or NLTK data not installed: skip the stage, keep the others
+            message = [line for line in str(e).splitlines() if line.strip(' *')]
+            results[name] = {'error': '%s: %s' % (type(e).__name__, message[0] if message else '')}
+            if args.verbose:
+                traceback.print_exc()
+    return results
+
+def compare(baseline, results, tolerance):
+    """Regressions of `results` against `baseline`: throughput down or p95 latency up by more than `tolerance`."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if not before or 'error' in before or 'error' in result:
+            continue
+        if result['items_per_sec'] < before['items_per_sec']*(1-tolerance):
+            regressions.append((name, 'throughput', before['items_per_sec'], result['items_per_sec']))
+        if result['latency_ms']['p95'] > before['latency_ms']['p95']*(1+tolerance):
+            regressions.append((name, 'p95 latency', before['latency_ms']['p95'], result['latency_ms']['p95']))
+    return regressions
+
+def report(results, baseline=None):
+    sys.stdout.write("%-18s %8s %12s %12s %10s %10s\n" % ('stage', 'items', 'items/sec', 'tokens/sec', 'p50 ms', 'p95 ms'))
+    for name in _STAGES_:
+        result = results.get(name)
+        if result is None:
+            continue
+        if 'error' in result:
+            sys.stdout.write("%-18s skipped (%s)\n" % (name, result['error']))
+            continue
+        line = "%-18s %8d %12.1f %12.1f %10.2f %10.2f" % (name, result['items'], result['items_per_sec'],
+               result['tokens_per_sec'], result['latency_ms']['p50'], result['latency_ms']['p95'])
+        before = (baseline or {}).get(name)
+        if before and 'error' not in before and before['items_per_sec']:
+            line += " (%+.0f%%)" % (100.*(result['items_per_sec']-before['items_per_sec'])/before['items_per_sec'])
+        sys.stdout.write(line+'\n')
+
+def report_regressions(regressions, tolerance):
+    for name, metric, before, after in regressions:
+        sys.stdout.write("REGRESSION %s %s: %.2f -> %.2f (tolerance %.0f%%)\n" % (name, metric, before, after, 100*tolerance))
+    return len(regressions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark")
+    parser.add_argument('--text', default='text.txt', help='Plain text input (sentences are split and tokenized)')
+    parser.add_argument('--scale', type=int, default=4, help='Times the text is repeated')
+    parser.add_argument('--trees', type=int, default=2000, help='Synthetic trees for (de)projectivization')
+    parser.add_argument('--pairs', type=int, default=2000, help='Random phrase pairs for predict_hyp')
+    parser.add_argument('--dim', type=int, default=64, help='Random embedding dimension')
+    parser.add_argument('--stages', default=','.join(_STAGES_), help='Comma separated stages to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Passes per stage, the fastest is kept')
+    parser.add_argument('--save', help='Write the results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Only compare two saved runs')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed relative slowdown')
+    parser.add_argument('--verbose', action='store_true', help='Print tracebacks of skipped stages')
+    args = parser.parse_args()
+
+    if args.compare:
+        before, after = [json.load(open(fname))['stages'] for fname in args.compare]
+        report(after, before)
+        sys.exit(1 if report_regressions(compare(before, after, args.tolerance), args.tolerance) else 0)
+
+    random.seed(37)
+    np.random.seed(37)
+    sentences = read_sentences(args.text, args.scale)
+    results = run(args.stages.split(','), sentences, args)
+    baseline = json.load(open(args.baseline))['stages'] if args.baseline else None
+    report(results, baseline)
+    regressions = report_regressions(compare(baseline, results, args.tolerance), args.tolerance) if baseline else 0
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                       'args': vars(args), 'stages': results}, fp, indent=1)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+"""
+Cold-start benchmark of model loading: pickled meta + DyNet populate against the
+binary bundles written by `python -m utils.modelBundle models/`. Every load runs in a
+fresh interpreter so that time and peak RSS are not shared between formats:
+
+    python3 -m benchmarks.modelLoading models/
+    python3 -m benchmarks.modelLoading models/parser/clearnlp-parser --repeat 5
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from utils.modelBundle import find_models, has_bundle
+
+_LOADER_ = """
+import sys, json, timeit, resource
+from utils import modelBundle
+modelBundle.ENABLED = %(bundle)r
+start = timeit.default_timer()
+tool = modelBundle.model_class(%(model)r)(model=%(model)r)
+elapsed = timeit.default_timer() - start
+json.dump({'seconds': elapsed, 'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}, sys.stdout)
+"""
+
+def load_once(model, bundle):
+    """Seconds to construct the tool and peak RSS (kB on Linux) of a fresh interpreter."""
+    code = _LOADER_ % {'model': model, 'bundle': bundle}
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=os.getcwd())
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+def bench_model(model, repeat):
+    sys.stdout.write("%s\n" % model)
+    formats = [('pickle+dy', False)] + ([('bundle', True)] if has_bundle(model) else [])
+    for name, bundle in formats:
+        runs = [load_once(model, bundle) for _ in range(repeat)]
+        seconds = min(run['seconds'] for run in runs)
+        maxrss = max(run['maxrss'] for run in runs)
+        sys.stdout.write("  %-10s %8.2f sec %10.1f MB peak RSS\n" % (name, seconds, maxrss/1024.))
+    if len(formats) == 1:
+        sys.stdout.write("  no bundle, convert with: python3 -m utils.modelBundle %s\n" % model)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model load-time benchmark")
+    parser.add_argument('paths', nargs='+', help='Model prefixes or directories to search for models')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for path in args.paths:
+        for model in (find_models(path) if os.path.isdir(path) else [path]):
+            bench_model(model, args.repeat)
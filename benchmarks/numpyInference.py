@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+"""
+DyNet parser against the NumPy engine (tools.numpyParser) on the sentences of a CoNLL
+file: sentences/sec of each and the tokens whose head, label or POS tag differ. Exports
+the model for NumPy inference first if needed:
+
+    python3 -m benchmarks.numpyInference --model models/parser/clearnlp-parser --treebank dev.conll
+"""
+
+import os
+import sys
+import timeit
+import argparse
+
+from tools.numpyParser import NumpyParser, numpy_path
+
+
+def read_words(treebank):
+    with open(treebank) as fp:
+        blocks = fp.read().split('\n\n')
+    return [[line.split('\t')[1] for line in block.split('\n') if line and not line.startswith('#')]
+            for block in blocks if block.strip()]
+
+def batched(decode, sentences, batch_size):
+    parsed = []
+    for start in range(0, len(sentences), batch_size):
+        parsed.extend(decode(sentences[start:start+batch_size]))
+    return parsed
+
+def analyses(parsed):
+    """(head, label, POS) of every token."""
+    return [(int(n.pparent), n.pdrel, tag) for nodes, pos, ner in parsed for n, tag in zip(nodes, pos)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DyNet vs NumPy parser inference")
+    parser.add_argument('--model', required=True, help='Trained parser model prefix')
+    parser.add_argument('--treebank', required=True, help='CONLL file whose sentences are parsed')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=64)
+    args = parser.parse_args()
+
+    from tools import parser as dparser
+    sentences = read_words(args.treebank)
+    dynetparser = dparser.Parser(model=args.model)
+    if not os.path.exists(numpy_path(args.model)):
+        dynetparser.export_numpy(args.model)
+    numpyparser = NumpyParser(args.model)
+
+    results = {}
+    sys.stdout.write("%-8s %10s\n" % ('engine', 'sents/sec'))
+    for name, decode in [('dynet', lambda batch: dparser.decode_batch(dynetparser, batch)),
+                         ('numpy', numpyparser.decode_batch)]:
+        start = timeit.default_timer()
+        results[name] = analyses(batched(decode, sentences, args.batch_size))
+        sys.stdout.write("%-8s %10.1f\n" % (name, len(sentences)/(timeit.default_timer()-start)))
+    for k, name in enumerate(('head', 'label', 'POS')):
+        n_diff = sum(d[k] != n[k] for d, n in zip(results['dynet'], results['numpy']))
+        sys.stdout.write("%-6s differs on %d of %d tokens\n" % (name, n_diff, len(results['dynet'])))
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+"""
+Startup regression benchmark based on `python -X importtime`.
+
+Every module is imported in a fresh interpreter; the cumulative import time of the
+module itself and its heaviest dependencies are reported, and heavy packages that the
+GUI must only load on first use (dynet, gensim, scipy, nltk, networkx) are flagged if
+the GUI module pulls them in at startup:
+
+    python3 -m benchmarks.startupTime --save startup.json
+    python3 -m benchmarks.startupTime --baseline startup.json --tolerance 0.25
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+
+_MODULES_ = ['clearEarthNLP', 'tools.tagger', 'tools.parser', 'tools.subsumptionExtractor']
+_LAZY_ = {'clearEarthNLP': ['dynet', 'gensim', 'scipy', 'nltk', 'networkx', 'pydot']}
+
+
+def import_times(module):
+    """[(package, cumulative microseconds, nesting depth)] of one cold `import module`, or None if it fails."""
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import %s' %module],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    if proc.returncode != 0:
+        return None
+    entries = []
+    for line in err.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[1].strip().isdigit():
+            continue  # header
+        name = fields[2].rstrip()
+        entries.append((name.strip(), int(fields[1]), (len(name)-len(name.lstrip()))//2))
+    return entries
+
+def measure(module, repeat):
+    """Cumulative import time of `module` and of the direct imports it triggered (fastest run)."""
+    best = None
+    for _ in range(repeat):
+        entries = import_times(module)
+        if not entries:
+            continue
+        # nested imports are printed before their importer, one indent level deeper
+        end = max(i for i, (name, us, depth) in enumerate(entries) if name == module)
+        start = end
+        while start > 0 and entries[start-1][2] > entries[end][2]:
+            start -= 1
+        if best is None or entries[end][1] < best[0][1]:
+            best = (entries[end], entries[start:end])
+    if best is None:
+        return None
+    (name, us, depth), nested = best
+    top = sorted([(t, n) for n, t, d in nested if d == depth+1], reverse=True)[:5]
+    loaded = set(n.split('.')[0] for n, t, d in nested)
+    eager = [name for name in _LAZY_.get(module, []) if name in loaded]
+    return {'seconds': us/1e6, 'top': [[n, t/1e6] for t, n in top], 'eager': eager}
+
+def report(results, baseline, tolerance):
+    regressions = 0
+    for module in _MODULES_:
+        result = results.get(module)
+        if result is None:
+            sys.stdout.write("%-28s import failed\n" % module)
+            continue
+        line = "%-28s %7.3f sec" % (module, result['seconds'])
+        if baseline and baseline.get(module):
+            before = baseline[module]['seconds']
+            line += " (baseline %7.3f, %+.0f%%)" % (before, 100.*(result['seconds']-before)/before)
+            if result['seconds'] > before*(1+tolerance):
+                line += " REGRESSION"
+                regressions += 1
+        sys.stdout.write(line+'\n')
+        for name, seconds in result['top']:
+            sys.stdout.write("    %-24s %7.3f sec\n" % (name, seconds))
+        if result['eager']:
+            sys.stdout.write("    loaded at startup: %s\n" % ', '.join(result['eager']))
+            regressions += 1
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time startup benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help='Cold imports per module, the fastest is kept')
+    parser.add_argument('--save', help='Write the results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown')
+    args = parser.parse_args()
+
+    results = dict((module, measure(module, args.repeat)) for module in _MODULES_)
+    baseline = json.load(open(args.baseline)) if args.baseline else None
+    regressions = report(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(results, fp, indent=1)
+    sys.exit(1 if regressions else 0)
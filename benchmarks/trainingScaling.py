@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+"""
+Scaling of data-parallel tagger training (utils.parallelTraining) with the worker count.
+
+A tagger with random embeddings is trained for a few epochs on the sentences of the
+input text, tagged with a deterministic word -> tag mapping so that there is something
+to learn, at each worker count; training throughput and dev accuracy are reported:
+
+    python3 -m benchmarks.trainingScaling --workers 1,4,8,16 --epochs 3 --save scaling.json
+"""
+
+import sys
+import json
+import zlib
+import random
+import timeit
+import argparse
+import platform
+
+import numpy as np
+
+from benchmarks.endToEnd import RandomEmbeddings, read_sentences, build_tagger, _TAGS_
+
+
+def tagged(sentences):
+    """(word, tag) sentences, the tag being a hash of the word's lowercased suffix."""
+    return [[(w, _TAGS_[zlib.crc32(w[-3:].lower().encode('utf-8')) % len(_TAGS_)]) for w in words]
+            for words in sentences]
+
+def train_once(train, dev, workers, args):
+    import dynet as dy
+    from tools import tagger
+    from utils.parallelTraining import DataParallel
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    sentences = [[w for w, t in sent] for sent in train + dev]
+    tagger.tagger = build_tagger(sentences, RandomEmbeddings(set(w for s in sentences for w in s), args.dim))
+    tagger.trainer = dy.MomentumSGDTrainer(tagger.tagger.model)
+    tagger.args = argparse.Namespace(iter=args.epochs, batch_size=args.batch_size, eval_batch_size=64,
+                                     save_model=None, eval_every=0, eval_interval=0., eval_sample=0, patience=0,
+                                     workers=workers, sync_every=args.sync_every, seed=args.seed)
+    tagger.dev = tagger.encode(dev)
+    data = tagger.encode(train)
+    start = timeit.default_timer()
+    if workers > 1:
+        DataParallel(tagger.tagger.model, workers, args.sync_every, args.seed).run(lambda par: tagger.train_tagger(data, par))
+    else:
+        tagger.train_tagger(data)
+    seconds = timeit.default_timer() - start
+    # the sharded epochs leave out up to workers-1 sentences each
+    tokens = args.epochs * sum(len(golds) for ids, golds in data[:len(data)//workers*workers])
+    return {'workers': workers,
+            'seconds': seconds,
+            'tokens_per_sec': tokens/seconds,
+            'dev_accuracy': tagger.evaluate(tagger.dev)}
+
+def report(results):
+    base = results[0]['tokens_per_sec']
+    sys.stdout.write("\n%8s %10s %12s %8s %10s\n" % ('workers', 'seconds', 'tokens/sec', 'speedup', 'dev acc'))
+    for r in results:
+        sys.stdout.write("%8d %10.1f %12.1f %7.2fx %10.4f\n" % (r['workers'], r['seconds'], r['tokens_per_sec'],
+                         r['tokens_per_sec']/base, r['dev_accuracy']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-parallel training scaling benchmark")
+    parser.add_argument('--text', default='text.txt', help='Plain text input (sentences are split and tokenized)')
+    parser.add_argument('--scale', type=int, default=4, help='Times the text is repeated')
+    parser.add_argument('--workers', default='1,4,8,16', help='Comma separated worker counts')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=1)
+    parser.add_argument('--sync-every', dest='sync_every', type=int, default=100, help='Updates between parameter averaging')
+    parser.add_argument('--dim', type=int, default=64, help='Random embedding dimension')
+    parser.add_argument('--seed', type=int, default=37)
+    parser.add_argument('--save', help='Write the results as JSON')
+    args = parser.parse_args()
+
+    sentences = tagged(read_sentences(args.text, args.scale))
+    random.Random(args.seed).shuffle(sentences)
+    n_dev = max(1, len(sentences)//10)
+    dev, train = sentences[:n_dev], sentences[n_dev:]
+    results = [train_once(train, dev, int(n), args) for n in args.workers.split(',')]
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                       'args': vars(args), 'results': results}, fp, indent=1)
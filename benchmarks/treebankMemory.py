@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+"""
+Memory of a treebank held as lists of per-token `leaf` namedtuples (the parser's old
+representation) against the columnar utils.dependencyGraph.Treebank. A synthetic
+treebank is generated unless a CoNLL file is given:
+
+    python3 -m benchmarks.treebankMemory --sentences 40000
+    python3 -m benchmarks.treebankMemory --treebank train.conll
+"""
+
+import io
+import re
+import sys
+import random
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+from utils.dependencyGraph import DependencyGraph, Treebank, leaf
+
+
+def synthetic_treebank(n_sents, min_len=3, max_len=60, vocab=20000):
+    sentences = []
+    for _ in range(n_sents):
+        n = random.randint(min_len, max_len)
+        rows = []
+        for i in range(1, n+1):
+            head = 0 if i == 1 else random.randint(1, i-1)
+            rows.append('\t'.join([str(i), 'w%d' %random.randint(0, vocab), 'l%d' %random.randint(0, vocab),
+                                   'T%d' %random.randint(0, 16), 'C%d' %random.randint(0, 16), '_',
+                                   str(head), 'r%d' %random.randint(0, 40), '_', '_']))
+        sentences.append('\n'.join(rows))
+    return sentences
+
+def read_sentences(fname):
+    with io.open(fname, encoding='utf-8') as fp:
+        return [match.group(1) for match in re.finditer("(.*?)\n\n", fp.read(), re.S)]
+
+def token_rows(sentence):
+    for node in sentence.split("\n"):
+        id_,form,lemma,tag,ctag,features,parent,drel = node.split("\t")[:8]
+        yield int(id_),form,lemma,tag,ctag,features,int(parent),drel,'_'
+
+def namedtuple_treebank(sentences):
+    """The list-of-leaf graphs the parser's reader used to build."""
+    data = []
+    for sentence in sentences:
+        PAD = leaf._make([-1,'__PAD__','__PAD__','__PAD__','__PAD__',defaultdict(lambda:'__PAD__'),-1,-1,'__PAD__','__PAD__',[None],[None], False, '__PAD__'])
+        graph = [leaf._make([0, 'ROOT_F', 'ROOT_L', 'ROOT_P', 'ROOT_C', defaultdict(str), -1, -1, '__ROOT__', '__ROOT__', PAD, [None], False, '_'])]
+        for id_,form,lemma,tag,ctag,features,parent,drel,ner in token_rows(sentence):
+            graph.append(leaf._make([id_,form,lemma,tag,ctag,features,parent,-1,drel,drel,[None],[None], False, ner]))
+        graph.append(leaf._make([0, 'ROOT_F', 'ROOT_L', 'ROOT_P', 'ROOT_C', defaultdict(str), -1, -1, '__ROOT__', '__ROOT__', [None], [None], False, '_']))
+        data.append(graph)
+    return data
+
+def columnar_treebank(sentences):
+    data = Treebank()
+    for sentence in sentences:
+        data.append(DependencyGraph.from_rows(data.strings, list(token_rows(sentence))))
+    data.freeze()
+    return data
+
+def measure(build, sentences):
+    """(retained, peak) bytes allocated while building the treebank."""
+    tracemalloc.start()
+    data = build(sentences)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return retained, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Treebank memory benchmark")
+    parser.add_argument('--treebank', help='CONLL file (default: synthetic)')
+    parser.add_argument('--sentences', type=int, default=40000, help='Synthetic treebank size')
+    args = parser.parse_args()
+    random.seed(37)
+
+    sentences = read_sentences(args.treebank) if args.treebank else synthetic_treebank(args.sentences)
+    n_tokens = sum(sentence.count('\n')+1 for sentence in sentences)
+    sys.stdout.write("Sentences: %d Tokens: %d\n" % (len(sentences), n_tokens))
+    for name, build in [('namedtuples', namedtuple_treebank), ('columnar', columnar_treebank)]:
+        retained, peak = measure(build, sentences)
+        sys.stdout.write("%-12s retained %8.1f MB (%6.1f bytes/token) peak %8.1f MB\n"
+                         % (name, retained/2.**20, float(retained)/n_tokens, peak/2.**20))
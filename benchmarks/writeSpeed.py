@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+"""
+Output throughput (MB/s of uncompressed text) of CoNLL writing: one `write` per token
+as the tools used to do, against utils.bulkWriters.ConllWriter, plain and compressed:
+
+    python3 -m benchmarks.writeSpeed --sentences 100000
+"""
+
+import io
+import os
+import sys
+import random
+import shutil
+import timeit
+import argparse
+import tempfile
+import importlib.util
+
+from utils.bulkWriters import ConllWriter
+
+_TAGS_ = ['NN', 'NNS', 'NNP', 'VB', 'VBD', 'JJ', 'RB', 'IN', 'DT', 'CC', 'PRP', 'CD']
+_LABELS_ = ['nsubj', 'obj', 'amod', 'det', 'case', 'nmod', 'advmod', 'conj', 'cc', 'punct']
+
+
+def synthetic_sentences(n_sents, min_len=3, max_len=40, vocab=20000):
+    sentences = []
+    for _ in range(n_sents):
+        n = random.randint(min_len, max_len)
+        sentences.append((['w%d' % random.randint(0, vocab) for _ in range(n)],
+                          [random.choice(_TAGS_) for _ in range(n)],
+                          [random.randint(0, n) for _ in range(n)],
+                          [random.choice(_LABELS_) for _ in range(n)]))
+    return sentences
+
+def per_token(sentences, fname):
+    with io.open(fname, 'w', encoding='utf-8') as ofile:
+        for forms, tags, heads, labels in sentences:
+            for i, (form, tag, head, label) in enumerate(zip(forms, tags, heads, labels), 1):
+                ofile.write('\t'.join([str(i), form, u'_', tag, u'_', u'_', str(head), label, u'_', u'_'])+'\n')
+            ofile.write(u'\n')
+
+def bulk(sentences, fname):
+    with ConllWriter(fname) as writer:
+        for forms, tags, heads, labels in sentences:
+            writer.write_sentence(forms, tags, heads, labels)
+
+def optional(compress):
+    return compress != 'zstd' or importlib.util.find_spec('zstandard') is not None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoNLL output throughput")
+    parser.add_argument('--sentences', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per writer, the fastest is kept')
+    args = parser.parse_args()
+
+    random.seed(37)
+    sentences = synthetic_sentences(args.sentences)
+    tmp = tempfile.mkdtemp()
+    try:
+        plain = os.path.join(tmp, 'out.conll')
+        per_token(sentences, plain)
+        size = os.path.getsize(plain)
+        sys.stdout.write("%d sentences, %.1f MB of CoNLL\n\n%-18s %8s %10s %10s\n" %
+                         (len(sentences), size/1e6, 'writer', 'seconds', 'MB/s', 'file MB'))
+        for name, write, suffix in [('per-token write', per_token, ''), ('bulk', bulk, ''),
+                                    ('bulk gzip', bulk, '.gz'), ('bulk zstd', bulk, '.zst')]:
+            if not optional('zstd' if suffix == '.zst' else None):
+                sys.stdout.write("%-18s skipped (zstandard not installed)\n" % name)
+                continue
+            fname = plain + suffix
+            best = min(timeit.repeat(lambda: write(sentences, fname), number=1, repeat=args.repeat))
+            sys.stdout.write("%-18s %8.2f %10.1f %10.1f\n" % (name, best, size/1e6/best, os.path.getsize(fname)/1e6))
+    finally:
+        shutil.rmtree(tmp)
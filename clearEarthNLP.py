@@ -16,19 +16,49 @@ from tkinter.messagebox import showinfo, askokcancel, askyesno
 
 from irtokz import RomanTokenizer
 
-from utils import plotTree
 from widgets.toolsWidget import ToolsWidget
+from utils.sentenceScheduler import BucketScheduler
+from utils.profiling import timer
+from utils.bulkWriters import ConllWriter, TaggedWriter, TsvWriter
 
-from tools import parser
-from tools.tagger import *
-from tools.parser import *
-from utils.keyPhraseExtraction import *
-from tools.subsumptionExtractor import *
+#NOTE the NLP stages (dynet, nltk, networkx, pydot) are imported on first use in runApplication
 
 
 def printHelp():
    print ("No help yet!")
 
+def plotParse(graph, ppos, Roott):
+    """Writes the parse image of a decoded sentence; returns [image-file, nodes]."""
+    from utils import plotTree
+    for node in range(len(graph)):
+        graph[node] = graph[node]._replace(tag=ppos[node],
+                                            parent=graph[node].pparent,
+                                            drel=graph[node].pdrel.strip('%')
+                                           )
+    nodes = [Roott]+graph+[Roott]
+    with timer('gui.render'):
+        dp_graph = plotTree.adjacencyMatrixplot(nodes)
+        graph = plotTree.BFSPlot(nodes, dp_graph, 0)
+        img_file = tempfile.NamedTemporaryFile(mode="wb", suffix=".png", delete=False)
+        graph.write_png(img_file.name)
+    return [img_file.name, nodes[1:-1]]
+
+def runScheduled(process_batch, lboxContent):
+    """Runs `process_batch` over the non-empty sentences in length buckets; returns {sid: result}."""
+    sids = [sid for sid, sentence in enumerate(lboxContent) if sentence.strip()]
+    scheduler = BucketScheduler(process_batch)
+    return dict(zip(sids, scheduler.run(lboxContent[sid].split() for sid in sids)))
+
+def loadParser(model):
+    """Parser of `model` and its batch parse function, DyNet-free if the model was exported with --export-numpy."""
+    from tools.numpyParser import NumpyParser, numpy_path
+    if os.path.exists(numpy_path(model)):
+        parsermodel = NumpyParser(model)
+        return parsermodel, parsermodel.parse_batch
+    from tools import parser
+    parsermodel = parser.Parser(model=model)
+    return parsermodel, partial(parser.parse_batch, parsermodel)
+
 def runApplication():
     selectedTask = system_outputs.get()
     lbox.task = selectedTask
@@ -37,25 +67,43 @@ def runApplication():
     if (not selectedTask.strip()) or (not lboxContent):return
     if selectedTask == "parsing":
         if lbox.nlpprocesses['parsing']:return
-        parsermodel = Parser(model='models/parser/clearnlp-parser')
+        parsermodel, parse_batch = loadParser('models/parser/clearnlp-parser')
+        parsed = runScheduled(parse_batch, lboxContent)
         for sid, sentence in enumerate(lboxContent):
-            if not sentence.strip():
+            if sid not in parsed:
                 lbox.nlpprocesses['parsing'][sid] = list()
                 continue
-            graph, ppos, Roott = parser.Test(parsermodel, sentence.strip().split())
-            for node in xrange(len(graph)):
-                graph[node] = graph[node]._replace(tag=ppos[node],
-                                                    parent=graph[node].pparent,
-                                                    drel=graph[node].pdrel.strip('%')
-                                                       )
-            nodes = [Roott]+graph+[Roott]
-            dp_graph = plotTree.adjacencyMatrixplot(nodes)
-            graph = plotTree.BFSPlot(nodes, dp_graph, 0)
-            img_file = tempfile.NamedTemporaryFile(mode="wb", suffix=".png", delete=False)
-            graph.write_png(img_file.name)
-            lbox.nlpprocesses['parsing'][sid] = [img_file.name, nodes[1:-1]]
+            graph, ppos, pner, Roott = parsed[sid]
+            lbox.nlpprocesses['parsing'][sid] = plotParse(graph, ppos, Roott)
         del parsermodel
         lbox.nlpprocesses['stash'] = True
+    elif selectedTask == "joint":
+        #NOTE one parser encoder pass fills parsing, POS (ps_* layers) and NER (shared-encoder head)
+        if lbox.nlpprocesses['parsing'] and lbox.nlpprocesses['nentity']:return
+        from tools.tagger import Tagger
+        parsermodel, parse_batch = loadParser('models/parser/clearnlp-parser')
+        nertagger = None
+        if not getattr(parsermodel.meta, 'n_ner', 0):
+            # parser model without NER head, fall back to the NER tagger
+            nertagger = Tagger(model='models/ner/clearnlp-ner')
+        parsed = runScheduled(parse_batch, lboxContent)
+        if nertagger:
+            nertagged = runScheduled(nertagger.tag_batch, lboxContent)
+        for sid, sentence in enumerate(lboxContent):
+            if sid not in parsed:
+                for task in ['parsing', 'tagging', 'nentity']:
+                    lbox.nlpprocesses[task][sid] = list()
+                continue
+            words = sentence.split()
+            graph, ppos, pner, Roott = parsed[sid]
+            lbox.nlpprocesses['parsing'][sid] = plotParse(graph, ppos, Roott)
+            lbox.nlpprocesses['tagging'][sid] = list(zip(words, ppos))
+            if nertagger:
+                lbox.nlpprocesses['nentity'][sid] = nertagged[sid]
+            else:
+                lbox.nlpprocesses['nentity'][sid] = list(zip(words, pner))
+        del parsermodel, nertagger
+        lbox.nlpprocesses['stash'] = True
     elif selectedTask == "tagging":
         if lbox.nlpprocesses['tagging']:return
         if lbox.nlpprocesses['parsing']:
@@ -63,34 +111,44 @@ def runApplication():
                 tags = [(node.form, node.tag) for node in lbox.nlpprocesses['parsing'][sent_id][1]]
                 lbox.nlpprocesses['tagging'][sent_id] = tags
         else:
+            from tools.tagger import Tagger
             tagger = Tagger(model='models/tagger/clearnlp-tagger')
+            tagged = runScheduled(tagger.tag_batch, lboxContent)
             for sid, sentence in enumerate(lboxContent):
-                if not sentence.strip():lbox.nlpprocesses['tagging'][sid] = list()
-                tags =  tagger.tag_sent(sentence.split())
-                lbox.nlpprocesses['tagging'][sid] = list(tags)
+                lbox.nlpprocesses['tagging'][sid] = tagged.get(sid, list())
             del tagger
         lbox.nlpprocesses['stash'] = True
     elif selectedTask == "nentity":
         if lbox.nlpprocesses['nentity']:return
+        from tools.tagger import Tagger
         tagger = Tagger(model='models/ner/clearnlp-ner')
+        tagged = runScheduled(tagger.tag_batch, lboxContent)
         for sid, sentence in enumerate(lboxContent):
-            if not sentence.strip():lbox.nlpprocesses['nentity'][sid] = list()
-            tags =  tagger.tag_sent(sentence.split())
-            lbox.nlpprocesses['nentity'][sid] = list(tags)
+            lbox.nlpprocesses['nentity'][sid] = tagged.get(sid, list())
         del tagger
         lbox.nlpprocesses['stash'] = True
     elif selectedTask == "ontorels":
         if lbox.nlpprocesses['ontorels']:return
-        ontoextractor = SubsumptionLearning(model='models/onto/clearnlp-onto')
+        from utils.keyPhraseExtraction import generatePairs
         pairs = list(generatePairs(lboxContent))
+        service = os.environ.get('CLEARNLP_ONTO_SERVICE')  # host:port of a running subsumption daemon
+        if service:
+            from utils.serviceClient import ServiceClient
+            host, port = service.rsplit(':', 1)
+            with ServiceClient(host, int(port)) as client:
+                outputs = [o[2:] if o else None for o in client.score_pairs(pairs, op='hyp')]
+        else:
+            from tools.subsumptionExtractor import SubsumptionLearning
+            ontomodel = 'models/onto/clearnlp-onto'
+            ontoextractor = SubsumptionLearning(model=ontomodel, mmap=os.path.exists('%s.embd.npy' %ontomodel))
+            outputs = [ontoextractor.predict_hyp(firstword, secondword) for firstword, secondword in pairs]
+            del ontoextractor
         subsumptionRelations = list()
-        for oid, (firstword, secondword) in enumerate(pairs,1):
-            ooutput = ontoextractor.predict_hyp(firstword, secondword)
+        for (firstword, secondword), ooutput in zip(pairs, outputs):
             if ooutput:
-                reltype, confidence, distance = ontoextractor.predict_hyp(firstword, secondword)
+                reltype, confidence, distance = ooutput
                 if (reltype == "Hypernym") and (distance >= 0.4):
                     subsumptionRelations.append([firstword, secondword, distance, confidence, 'positive'])
-        del ontoextractor
         lbox.nlpprocesses['ontorels'] = subsumptionRelations
         lbox.nlpprocesses['stash'] = True
             
@@ -106,42 +164,58 @@ def contentReader(ifile):
 
     lbox.delete(0, END)
     for idx, line in enumerate(ifile):
-        text = tok.tokenize(line)
+        with timer('gui.tokenize'):
+            text = tok.tokenize(line)
         for tline in text.split("\n"):
             lbox.insert(tk.END, tline)
 
+def columnarWriter(base, format):
+    """Writes tagging, NER and parsing outputs into one columnar file (see utils.columnarOutput)."""
+    from utils.columnarOutput import open_writer
+    outputs = lbox.nlpprocesses
+    sids = sorted(set(outputs['tagging']) | set(outputs['nentity']) | set(outputs['parsing']))
+    with open_writer(base, format=format) as writer:
+        for sid in sids:
+            tags, ners = outputs['tagging'].get(sid), outputs['nentity'].get(sid)
+            parse = outputs['parsing'].get(sid)
+            nodes = parse[1] if parse else None
+            forms = [n.form for n in nodes] if nodes else [w for w, t in (tags or ners or [])]
+            writer.write(form=forms,
+                         pos=[t for w, t in tags] if tags else [n.tag for n in nodes] if nodes else None,
+                         ner=[t for w, t in ners] if ners else None,
+                         head=[int(n.parent) for n in nodes] if nodes else None,
+                         rel=[n.drel for n in nodes] if nodes else None)
+
 def contentWriter():
     lbox.nlpprocesses['stash'] = False
     base = lbox.file.split(".")[0]
-    
+    columnar = os.environ.get('CLEARNLP_OUTPUT_FORMAT')  # arrow, numpy or auto instead of .pos/.ner/.parse
+    if columnar:
+        columnarWriter(base, columnar)
+
     for nlproc, output in lbox.nlpprocesses.items():
         if (nlproc == 'stash') or (not output):continue
+        if columnar and nlproc in ('tagging', 'parsing', 'nentity'):continue
         if nlproc == "tagging":
-            with open("%s.pos"%base, "w") as tfp:
+            with TaggedWriter("%s.pos"%base) as tfp:
                 for sent_id, sentence in output.items():
-                    for tid, tnode in enumerate(sentence, 1):
-                        tfp.write("%s\t%s\t%s\n" % (tid, tnode[0], tnode[1]))
-                    tfp.write("\n")
+                    tfp.write_sentence(sentence)
         elif nlproc == "parsing":
-            with open("%s.parse"%base, "w") as pfp:
+            with ConllWriter("%s.parse"%base) as pfp:
                 for sent_id, sentence in output.items():
                     #NOTE sentence[0] = parse tree image, sentence[1] = conll namedtuple
-                    for pnode in sentence[1]:
-                        pN = pnode
-                        pfp.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t_\t_\n" % \
-                                    (str(pN.id), pN.form, pN.lemma, pN.ctag, pN.tag, pN.features, str(pN.parent), pN.drel))
-                    pfp.write("\n")
+                    nodes = sentence[1] if sentence else []
+                    pfp.write_sentence([pN.form for pN in nodes], [pN.tag for pN in nodes], [pN.parent for pN in nodes],
+                                       [pN.drel for pN in nodes], lemmas=[pN.lemma for pN in nodes],
+                                       ctags=[pN.ctag for pN in nodes], feats=[pN.features for pN in nodes])
         elif nlproc == "nentity":
-            with open("%s.ner"%base, "w") as nfp:
+            with TaggedWriter("%s.ner"%base) as nfp:
                 for sent_id, sentence in output.items():
-                    for nid, nnode in enumerate(sentence, 1):
-                        nfp.write("%s\t%s\t%s\n" % (nid, nnode[0], nnode[1]))
-                    nfp.write("\n")
+                    nfp.write_sentence(sentence)
         else:
-            with open("%s.onto"%base, "w") as ofp:
-                for oid, relation_info in enumerate(output,1):
-                    first, second, confidence, distance, relation = relation_info
-                    ofp.write("%s\t%s\t%s\t%s\t%s\t%s\n" % (oid, first, second, relation, confidence, distance))
+            with TsvWriter("%s.onto"%base) as ofp:
+                ofp.write_rows((oid, first, second, relation, confidence, distance)
+                               for oid, (first, second, confidence, distance, relation) in enumerate(output,1))
 
 def openFile():
     if lbox.nlpprocesses.get('stash', False) is True:
@@ -215,11 +289,11 @@ if __name__ == "__main__":
     lbox = ToolsWidget(frame, height=10, width=40, font=("MS Serif", 12))
     vsb = ttk.Scrollbar(orient="vertical", command=lbox.yview)
     hsb = ttk.Scrollbar(orient="horizontal", command=lbox.xview)
-    vsb.grid(column=2, row=0, rowspan=7, sticky=(N,S,E,W), in_=frame)
-    hsb.grid(column=0, row=7, sticky=(N,S,E,W), in_=frame)
+    vsb.grid(column=2, row=0, rowspan=8, sticky=(N,S,E,W), in_=frame)
+    hsb.grid(column=0, row=8, sticky=(N,S,E,W), in_=frame)
     lbox.config(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
     lbox.nlpprocesses = dict()
-    lbox.grid(column=0, row=0, rowspan=7,sticky=(N,S,E,W))
+    lbox.grid(column=0, row=0, rowspan=8,sticky=(N,S,E,W))
 
     label = ttk.Label(frame, text="NLP Tools:")
     
@@ -228,6 +302,7 @@ if __name__ == "__main__":
     dparsing = ttk.Radiobutton(frame, text='Dependency Parsing', variable=system_outputs, value='parsing')
     semroles = ttk.Radiobutton(frame, text='Semantic Role Labelling', variable=system_outputs, value='sroles')
     hhrelations = ttk.Radiobutton(frame, text='Relation Extraction', variable=system_outputs, value='ontorels')
+    jointtools = ttk.Radiobutton(frame, text='POS + NER + Parsing', variable=system_outputs, value='joint')
     run = ttk.Button(frame, text='Run', command=runApplication, default='active')
     
     menubar=Menu(root)
@@ -245,16 +320,17 @@ if __name__ == "__main__":
     root.config(menu=menubar)
     
     # Grid all the widgets
-    lbox.grid(column=0, row=0, rowspan=7, sticky=(N,S,E,W))
+    lbox.grid(column=0, row=0, rowspan=8, sticky=(N,S,E,W))
     label.grid(column=3, row=0, padx=10, pady=5)
     ptagging.grid(column=3, row=1, sticky=W, padx=20)
     nentity.grid(column=3, row=2, sticky=W, padx=20)
     dparsing.grid(column=3, row=3, sticky=W, padx=20)
     semroles.grid(column=3, row=4, sticky=W, padx=20)
     hhrelations.grid(column=3, row=5, sticky=W, padx=20)
-    run.grid(column=3, row=6, sticky=(N,W), padx=20,pady=10)
+    jointtools.grid(column=3, row=6, sticky=W, padx=20)
+    run.grid(column=3, row=7, sticky=(N,W), padx=20,pady=10)
     frame.grid_columnconfigure(0, weight=1)
-    frame.grid_rowconfigure(6, weight=1)
+    frame.grid_rowconfigure(7, weight=1)
     
     lbox.selection_set(0)
     ttk.Sizegrip(root).grid(column=999, row=999, sticky=(S,E))
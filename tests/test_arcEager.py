@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from utils.arcEager import ArcEager
+
+TRANSITIONS = {'SHIFT': 0, 'LEFTARC': 1, 'RIGHTARC': 2, 'REDUCE': 3}
+I2TD = dict(enumerate([('SHIFT', None), ('REDUCE', None), ('LEFTARC', 'nsubj'), ('LEFTARC', 'amod'),
+                       ('RIGHTARC', 'obj'), ('RIGHTARC', 'amod')]))
+
+
+def test_best_action_is_the_best_allowed():
+    system = ArcEager()
+    masks = system.build_transition_masks(I2TD, TRANSITIONS)
+    scores = np.array([0.1, 0.9, 0.3, 0.2, 0.8, 0.4])
+    assert system.best_action(scores, system.valid_mask(masks, [0, 1, 2, 3])) == 1
+    assert system.best_action(scores, system.valid_mask(masks, [0, 2])) == 4
+    assert system.best_action(scores, system.valid_mask(masks, [1])) == 2
+    assert system.best_action(np.full(6, -np.inf), system.valid_mask(masks, [0])) == 0
+
+
+def test_best_action_without_allowed_transitions():
+    system = ArcEager()
+    with pytest.raises(ValueError):
+        system.best_action(np.arange(6.), np.zeros(6, dtype=bool))
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from utils.arcEagerDecoding import ArcEagerDecoder
+from utils.beamSearch import BeamState, SHIFT, LEFTARC, RIGHTARC, REDUCE
+from utils.dependencyGraph import DependencyGraph, StringTable
+
+TRANSITIONS = {'SHIFT': 0, 'LEFTARC': 1, 'RIGHTARC': 2, 'REDUCE': 3}
+LABELS = ['nsubj', 'obj', 'amod', 'root']
+
+
+class RandomDecoder(ArcEagerDecoder):
+    """Decoder over random projected features, in place of a trained parser."""
+
+    def __init__(self, n, rng, hidden=6):
+        i2td = dict(enumerate([('SHIFT', None), ('REDUCE', None)] +
+                              [(t, label) for t in ('LEFTARC', 'RIGHTARC') for label in LABELS]))
+        self.meta = SimpleNamespace(i2td=i2td, transitions=TRANSITIONS)
+        self.masks = self.build_transition_masks(i2td, TRANSITIONS)
+        self.pr_np = [rng.randn(n+1, hidden), rng.randn(n+1, hidden), rng.randn(hidden),
+                      rng.randn(len(i2td), hidden), rng.randn(len(i2td))]
+
+
+def arcs(graph):
+    return [(int(graph.pheads[i]), graph.plabel(i)) for i in range(1, graph.n+1)]
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_beam_of_one_is_greedy(seed):
+    rng = np.random.RandomState(seed)
+    n = rng.randint(1, 15)
+    decoder = RandomDecoder(n, rng)
+    greedy = DependencyGraph.from_words(StringTable(), ['w%d' % i for i in range(n)])
+    beam = greedy.copy(deep=True)
+    decoder.greedy_decode(greedy)
+    decoder.beam_decode(beam, 1)
+    assert arcs(beam) == arcs(greedy)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_wider_beams_give_trees(seed):
+    rng = np.random.RandomState(seed)
+    n = rng.randint(1, 15)
+    decoder = RandomDecoder(n, rng)
+    for width in (2, 8):
+        graph = DependencyGraph.from_words(StringTable(), ['w%d' % i for i in range(n)])
+        decoder.beam_decode(graph, width)
+        heads = [int(h) for h in graph.pheads]
+        assert all(0 <= heads[i] <= n and heads[i] != i for i in range(1, n+1))
+        for i in range(1, n+1):  # every token reaches the root
+            seen = set()
+            while i:
+                assert i not in seen
+                seen.add(i)
+                i = heads[i]
+        assert all(graph.plabel(i) in LABELS for i in range(1, n+1))
+
+
+def test_states_share_their_tails():
+    state = BeamState().apply(SHIFT, None, 3, 0.)
+    left = state.apply(RIGHTARC, 'obj', 3, -1.)
+    right = left.apply(REDUCE, None, 3, -2.)
+    assert right.arcs is left.arcs
+    assert right.stack is state.stack
+    assert left.heads() == {2: (1, 'obj')}
+    assert right.valid_transitions(3) == set([SHIFT, LEFTARC, RIGHTARC])
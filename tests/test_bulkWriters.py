@@ -0,0 +1,82 @@
+import io
+import gzip
+
+import pytest
+
+from utils.bulkWriters import ConllWriter, TaggedWriter, TsvWriter
+
+SENTENCES = [(['Sea', 'ice', 'melts', '.'], ['NN', 'NN', 'VBZ', '.'], [2, 3, 0, 3], ['compound', 'nsubj', 'root', 'punct']),
+             ([u'Névé', 'forms'], ['NN', 'VBZ'], [2, 0], ['nsubj', 'root'])]
+
+
+def read_conll(text):
+    """(forms, tags, heads, labels) per sentence and the comment lines."""
+    sentences, comments = [], []
+    for block in text.split('\n\n'):
+        rows = []
+        for line in block.split('\n'):
+            if line.startswith('#'):
+                comments.append(line)
+            elif line:
+                rows.append(line.split('\t'))
+        if rows:
+            assert all(len(row) == 10 for row in rows)
+            assert [row[0] for row in rows] == [str(i) for i in range(1, len(rows)+1)]
+            sentences.append(([r[1] for r in rows], [r[3] for r in rows], [int(r[6]) for r in rows], [r[7] for r in rows]))
+    return sentences, comments
+
+
+@pytest.mark.parametrize('name', ['out.conll', 'out.conll.gz'])
+def test_conll_round_trip(tmp_path, name):
+    path = str(tmp_path / name)
+    with ConllWriter(path, buffer_size=16) as writer:
+        for sentence in SENTENCES:
+            writer.write_sentence(*sentence)
+    opener = gzip.open if name.endswith('.gz') else io.open
+    with opener(path, 'rt', encoding='utf-8') as fp:
+        text = fp.read()
+    sentences, comments = read_conll(text)
+    assert sentences == [tuple(map(list, s)) for s in SENTENCES]
+    assert comments == []
+
+
+def test_conllu_comments(tmp_path):
+    path = str(tmp_path / 'out.conllu')
+    with ConllWriter(path, dialect='u') as writer:
+        for sentence in SENTENCES:
+            writer.write_sentence(*sentence)
+    with io.open(path, encoding='utf-8') as fp:
+        sentences, comments = read_conll(fp.read())
+    assert sentences == [tuple(map(list, s)) for s in SENTENCES]
+    assert comments == ['# sent_id = 1', '# text = Sea ice melts .', '# sent_id = 2', u'# text = Névé forms']
+
+
+def test_parser_reads_the_output_back(tmp_path, monkeypatch):
+    parser = pytest.importorskip('tools.parser')  # needs dynet
+    monkeypatch.setattr(parser.args, 'isDaemon', False)
+    path = str(tmp_path / 'out.conll')
+    with ConllWriter(path) as writer:
+        for sentence in SENTENCES:
+            writer.write_sentence(*sentence)
+    for (forms, tags, heads, labels), block in zip(SENTENCES, parser.read_sentences(path)):
+        graph = parser.depenencyGraph(block)
+        assert graph.words() == forms
+        assert graph.token_strings('tags') == tags
+        assert graph.heads[1:-1].tolist() == heads
+        assert graph.token_strings('labels') == labels
+
+
+def test_unknown_dialect(tmp_path):
+    with pytest.raises(ValueError):
+        ConllWriter(str(tmp_path / 'out.conll'), dialect='y')
+
+
+def test_tagged_and_tsv(tmp_path):
+    with TaggedWriter(str(tmp_path / 'text.pos')) as writer:
+        writer.write_sentence(zip(['Sea', 'ice'], ['NN', 'NN']))
+    with TsvWriter(str(tmp_path / 'onto.tsv'), compress='gzip') as writer:
+        writer.write_rows([(1, 'sea ice', 'ice', 'Hypernym', 0.9)])
+    with io.open(str(tmp_path / 'text.pos'), encoding='utf-8') as fp:
+        assert fp.read() == '1\tSea\tNN\n2\tice\tNN\n\n'
+    with gzip.open(str(tmp_path / 'onto.tsv'), 'rt') as fp:
+        assert fp.read() == '1\tsea ice\tice\tHypernym\t0.9\n'
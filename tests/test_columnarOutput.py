@@ -0,0 +1,57 @@
+import pytest
+
+from utils.columnarOutput import open_writer, open_reader
+
+SENTENCES = [dict(form=['Sea', 'ice', 'melts', '.'], pos=['NN', 'NN', 'VBZ', '.'], ner=['O']*4,
+                  head=[2, 3, 0, 3], rel=['compound', 'nsubj', 'root', 'punct']),
+             dict(form=[u'Névé', 'forms'], pos=['NN', 'VBZ'], head=[2, 0], rel=['nsubj', 'root']),
+             dict(form=[], pos=[], ner=[], head=[], rel=[]),
+             dict(form=['Ice'], pos=['NN'], ner=['B-MAT'], head=[0], rel=['root'])]
+
+
+def expected(sentence):
+    n = len(sentence['form'])
+    return dict(sentence, ner=sentence.get('ner', ['_']*n))
+
+
+@pytest.mark.parametrize('buffer_tokens', [1, 3, 1 << 16])
+def test_numpy_round_trip(tmp_path, buffer_tokens):
+    with open_writer(str(tmp_path / 'corpus'), format='numpy', buffer_tokens=buffer_tokens) as writer:
+        for sentence in SENTENCES:
+            writer.write(**sentence)
+    reader = open_reader(str(tmp_path / 'corpus.cols'))
+    assert len(reader) == len(SENTENCES)
+    assert reader.slice(0, len(SENTENCES)) == [expected(s) for s in SENTENCES]
+    assert reader.sentence(3) == expected(SENTENCES[3])
+    assert reader.slice(1, 2, columns=['form', 'head']) == [{'form': [u'Névé', 'forms'], 'head': [2, 0]}]
+    assert reader.slice(3, 10) == [expected(SENTENCES[3])]
+    assert reader.column('head', 2, 2) == []
+
+
+def test_empty_output(tmp_path):
+    with open_writer(str(tmp_path / 'empty'), format='numpy'):
+        pass
+    reader = open_reader(str(tmp_path / 'empty.cols'))
+    assert len(reader) == 0
+    assert reader.slice(0, 10) == []
+
+
+def test_arrow_round_trip(tmp_path):
+    pytest.importorskip('pyarrow')
+    with open_writer(str(tmp_path / 'corpus'), format='arrow', buffer_tokens=3) as writer:
+        for sentence in SENTENCES:
+            writer.write(**sentence)
+    reader = open_reader(str(tmp_path / 'corpus.arrow'))
+    assert len(reader) == len(SENTENCES)
+    assert reader.slice(0, len(SENTENCES)) == [expected(s) for s in SENTENCES]
+
+
+def test_mismatched_column(tmp_path):
+    with open_writer(str(tmp_path / 'bad'), format='numpy') as writer:
+        with pytest.raises(ValueError):
+            writer.write(form=['a', 'b'], pos=['DT'])
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        open_writer(str(tmp_path / 'corpus'), format='csv')
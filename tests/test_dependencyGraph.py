@@ -0,0 +1,49 @@
+from utils.dependencyGraph import DependencyGraph, StringTable, Treebank, csr_children
+
+ROWS = [(1, 'Sea', '_', 'NN', 'NN', '_', 2, 'compound', 'O'),
+        (2, 'ice', '_', 'NN', 'NN', '_', 3, 'nsubj', 'O'),
+        (3, 'melts', '_', 'VBZ', 'VB', '_', 0, 'root', 'O'),
+        (4, '.', '_', '.', '.', '_', 3, 'punct', 'O')]
+
+
+def test_csr_children():
+    indptr, indices = csr_children([-1, 2, 0, 2, 2, -1])
+    children = [indices[indptr[k]:indptr[k+1]].tolist() for k in range(6)]
+    assert children == [[2], [], [1, 3, 4], [], [], []]
+
+
+def test_columns_and_nodes():
+    graph = DependencyGraph.from_rows(StringTable(), ROWS)
+    assert graph.n == 4 and len(graph) == 6
+    assert graph.words() == ['Sea', 'ice', 'melts', '.']
+    assert graph.heads.tolist() == [-1, 2, 3, 0, 3, -1]
+    assert graph.form(0) == 'ROOT_F' and graph.ids[-1] == 0
+    graph.set_head(1, 2, 'compound')
+    graph.set_head(2, 3, 'nsubj')
+    graph.set_head(3, 0, 'root')
+    graph.set_head(4, 3, 'punct')
+    nodes = graph.nodes()
+    assert [(n.id, n.form, n.parent, n.pparent, n.pdrel) for n in nodes] == \
+           [(1, 'Sea', 2, 2, 'compound'), (2, 'ice', 3, 3, 'nsubj'), (3, 'melts', 0, 0, 'root'), (4, '.', 3, 3, 'punct')]
+    assert nodes[2].left == [2] and nodes[2].right == [4] and nodes[0].left == [None]
+
+
+def test_copy_keeps_the_gold_columns():
+    graph = DependencyGraph.from_words(StringTable(), ['Sea', 'ice'])
+    copy = graph.copy()
+    copy.set_head(1, 2, 'compound')
+    assert copy.heads is graph.heads
+    assert graph.pheads[1] == -1 and copy.pheads[1] == 2
+
+
+def test_treebank_views():
+    strings = StringTable()
+    treebank = Treebank(strings)
+    treebank.append(DependencyGraph.from_rows(strings, ROWS))
+    treebank.append(DependencyGraph.from_words(strings, ['Ice']))
+    assert len(treebank) == 2
+    assert [graph.words() for graph in treebank] == [['Sea', 'ice', 'melts', '.'], ['Ice']]
+    assert treebank[0].heads.base is treebank[1].heads.base  # views of one column
+    treebank.append(DependencyGraph.from_words(strings, ['Snow', 'falls']))
+    assert treebank[2].words() == ['Snow', 'falls'] and treebank[0].heads.tolist() == [-1, 2, 3, 0, 3, -1]
+    assert treebank.nbytes() > 0
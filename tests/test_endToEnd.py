@@ -0,0 +1,58 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.endToEnd import compare, measure, run, synthetic_graphs, report_regressions
+from utils.pseudoProjectivity import non_projectivity
+
+
+def result(items_per_sec, p95):
+    return {'items_per_sec': items_per_sec, 'latency_ms': {'p95': p95}}
+
+
+def test_compare_flags_slowdowns_beyond_the_tolerance():
+    baseline = {'parse': result(100., 10.), 'tag_sent': result(100., 10.), 'projectivize': result(100., 10.),
+                'get_npmi': {'error': 'LookupError: nltk data'}}
+    results = {'parse': result(85., 10.), 'tag_sent': result(95., 10.5), 'projectivize': result(100., 12.),
+               'get_npmi': result(1., 100.), 'generatePairs': result(1., 100.)}
+    assert compare(baseline, results, 0.1) == [('parse', 'throughput', 100., 85.),
+                                               ('projectivize', 'p95 latency', 10., 12.)]
+    assert compare(baseline, results, 0.25) == []
+
+
+def test_report_regressions_counts(capsys):
+    assert report_regressions([('parse', 'throughput', 100., 85.)], 0.1) == 1
+    assert 'REGRESSION parse throughput: 100.00 -> 85.00' in capsys.readouterr().out
+
+
+def test_measure():
+    stats = measure([[1, 2], [3]], sum, len, repeat=2)
+    assert (stats['items'], stats['tokens']) == (2, 3)
+    assert stats['tokens_per_sec'] == pytest.approx(1.5 * stats['items_per_sec'])
+    assert stats['latency_ms']['p50'] <= stats['latency_ms']['p95'] <= stats['latency_ms']['max']
+
+
+def test_synthetic_graphs_are_trees():
+    random.seed(37)
+    graphs = synthetic_graphs(200, nonprojective=0.5, max_len=15)
+    for graph in graphs:
+        heads = [int(h) for h in graph.heads[1:-1]]
+        assert heads.count(0) >= 1
+        for i in range(1, graph.n+1):  # every token reaches the root
+            seen = set()
+            while i:
+                assert i not in seen
+                seen.add(i)
+                i = heads[i-1]
+    assert sum(bool(non_projectivity(graph)) for graph in graphs) > 20
+    assert not any(non_projectivity(graph) for graph in synthetic_graphs(50, nonprojective=0.))
+
+
+def test_run_skips_stages_that_fail():
+    random.seed(37)
+    args = SimpleNamespace(trees=20, repeat=1, verbose=False, dim=8, pairs=10)
+    results = run(['projectivize', 'deprojectivize', 'bogus'], [['Sea', 'ice']], args)
+    assert results['projectivize']['items'] == 20
+    assert 0 < results['deprojectivize']['items'] <= 20
+    assert results['bogus'] == {'error': 'ValueError: unknown stage bogus'}
@@ -0,0 +1,60 @@
+import threading
+
+from utils.metrics import Counter, Gauge, Histogram, counter, format_value, render
+
+
+def test_counter_sums_the_thread_shards():
+    requests = Counter('test_requests_total', 'Requests')
+    def work():
+        for _ in range(1000):
+            requests.inc()
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests.inc(5)
+    assert requests.value() == 8005
+    assert requests.render() == '# HELP test_requests_total Requests\n# TYPE test_requests_total counter\ntest_requests_total 8005'
+
+
+def test_gauge():
+    level = Gauge('test_in_flight', 'In flight')
+    level.inc(3)
+    level.dec()
+    assert level.value() == 2
+    assert Gauge('test_computed', 'Computed', lambda: 1.5).value() == 1.5
+    assert format_value(Gauge('test_broken', 'Broken', lambda: 1/0).value()) == 'nan'
+
+
+def test_histogram_buckets():
+    latency = Histogram('test_seconds', 'Latency', buckets=(0.1, 1.))
+    for value in (0.05, 0.1, 0.5, 2.):
+        latency.observe(value)
+    assert latency.samples() == [('_bucket', '{le="0.1"}', 2), ('_bucket', '{le="1.0"}', 3),
+                                 ('_bucket', '{le="+Inf"}', 4), ('_sum', '', 2.65), ('_count', '', 4)]
+
+
+def test_registry():
+    first = counter('test_registered_total', 'Registered')
+    assert counter('test_registered_total', 'Registered') is first
+    first.inc(2)
+    text = render()
+    assert 'test_registered_total 2\n' in text
+    assert '# TYPE process_resident_memory_bytes gauge' in text
+
+
+def test_shards_of_exited_threads_are_folded():
+    requests = Counter('test_short_threads_total', 'Requests')
+    latency = Histogram('test_short_seconds', 'Latency', buckets=(1.,))
+    def work():
+        requests.inc()
+        latency.observe(0.5)
+    for _ in range(2000):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    requests.inc()
+    assert len(requests.shards) <= 2 and len(latency.shards) <= 1
+    assert requests.value() == 2001
+    assert latency.samples()[-1] == ('_count', '', 2000)
@@ -0,0 +1,116 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from utils.parallelTraining import DataParallel
+
+
+class FakeParameter(object):
+    """as_array/set_value/init_from_array of a DyNet (lookup) parameter."""
+
+    def __init__(self, shape):
+        self.value = np.zeros(shape, dtype=np.float32)
+
+    def as_array(self):
+        return self.value.copy()
+
+    def set_value(self, value):
+        self.value[:] = value
+
+    init_from_array = set_value
+
+
+class FakeParams(object):
+    def __init__(self):
+        self.params = [FakeParameter((2, 3)), FakeParameter((4,))]
+        self.lookups = [FakeParameter((5, 2))]
+
+    def parameters_list(self):
+        return self.params
+
+    def lookup_parameters_list(self):
+        return self.lookups
+
+    def add(self, x):
+        for p in self.params + self.lookups:
+            p.value += x
+
+
+class FakeSchedule(object):
+    """Stops once `limit` items were trained over all workers; counts its calls in shared memory."""
+
+    def __init__(self, limit, calls):
+        self.limit = limit
+        self.items = 0
+        self.calls = calls  # steps, epoch ends, closes
+
+    def step(self, n):
+        self.calls[0] += 1
+        self.items += n
+        return self.items >= self.limit
+
+    def epoch_end(self):
+        self.calls[1] += 1
+        return False
+
+    def close(self):
+        self.calls[2] += 1
+        return 'best'
+
+
+def test_shards_are_disjoint_and_equal():
+    items = list(range(23))
+    par = DataParallel(FakeParams(), 4, seed=7)
+    shards = []
+    for rank in range(4):
+        par.rank = rank
+        shards.append(par.shard(items, epoch=0))
+    assert [len(shard) for shard in shards] == [5]*4
+    assert len(set(sum(shards, []))) == 20
+    par.rank = 0
+    assert par.shard(items, epoch=0) == shards[0]
+    assert par.shard(items, epoch=1) != shards[0]
+
+
+def test_workers_average_and_stop_together():
+    ctx = multiprocessing.get_context('fork')
+    steps = ctx.Array('i', 3)
+    calls = ctx.Array('i', 3)
+    params = FakeParams()
+    par = DataParallel(params, 3, sync_every=2, seed=1)
+
+    def train(par):
+        schedule = par.schedule(lambda: FakeSchedule(12, calls))
+        for epoch in range(5):
+            stop = False
+            for _ in range(3):
+                par.params.add(par.rank + 1)
+                steps[par.rank] += 1
+                if schedule.step(1):
+                    stop = True
+                    break
+            if stop or schedule.stopped or schedule.epoch_end():
+                break
+        assert (schedule.close() == 'best') == (par.rank == 0)
+
+    par.run(train)
+    # syncs after steps 2 and 3 (end of the first epoch) see 6 and 3 items; the one
+    # after step 4 sees 3 more, reaching the limit of 12 in every worker at once
+    assert list(steps) == [4, 4, 4]
+    assert list(calls) == [3, 1, 1]
+    # every replica added 1, 2 or 3 per step and was averaged: 4 steps of 2
+    for p in params.params + params.lookups:
+        assert np.allclose(p.value, 8.)
+
+
+def test_failing_worker_stops_the_run():
+    par = DataParallel(FakeParams(), 2, sync_every=1)
+
+    def train(par):
+        if par.rank == 1:
+            raise ValueError('broken shard')
+        par.average()  # would wait for worker 1 forever
+
+    with pytest.raises(RuntimeError):
+        par.run(train)
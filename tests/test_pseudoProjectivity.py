@@ -0,0 +1,152 @@
+"""The columnar projectivizer against the list-of-leaf implementation it replaced."""
+
+import re
+import random
+
+import numpy as np
+import pytest
+
+from utils.dependencyGraph import DependencyGraph, StringTable, leaf
+from utils.pseudoProjectivity import projectivize, deprojectivize, non_projectivity
+
+LABELS = ['nsubj', 'obj', 'amod', 'advmod', 'conj']
+
+
+# the implementation before the columnar graphs, on lists of `leaf` tokens
+def old_get_projection(node, adMat):
+    children = list()
+    for c in np.nonzero(adMat[node])[0]:
+        children += old_get_projection(c, adMat)
+        children.append(c+1)
+    return children
+
+def old_adjacency_matrix(nodes, training=True):
+    adMat = np.zeros((len(nodes), len(nodes)), int)
+    for node in nodes:
+        parent = node.parent if training else node.pparent
+        if parent == 0: continue
+        adMat[parent-1, node.id-1] = 1
+    return adMat
+
+def old_non_projectivity(nodes, tree):
+    np_arcs = set()
+    for leaf_ in sorted(nodes):
+        if leaf_.parent == 0: continue
+        head, dependent = leaf_.parent, leaf_.id
+        projection = set(old_get_projection(head-1, tree))
+        for inter in range(head+1, dependent) if head < dependent else range(dependent+1, head):
+            if inter not in projection:
+                np_arcs.add((dependent, head, abs(dependent-head)))
+    return np_arcs
+
+def old_projectivize(nodes):
+    tree = old_adjacency_matrix(nodes, True)
+    non_projective_arcs = sorted(old_non_projectivity(nodes, tree), key=lambda x: x[-1])
+    while non_projective_arcs:
+        dependent, head, distance = non_projective_arcs.pop(0)
+        npDepNode, npHeadNode = nodes[dependent-1], nodes[head-1]
+        modifieddrel = npDepNode.drel if npDepNode.visit else re.sub(r"(%|$)", r'|%s\1' % (npHeadNode.pdrel), npDepNode.drel)
+        nodes[dependent-1] = npDepNode._replace(drel=modifieddrel, parent=npHeadNode.parent, visit=True)
+        nodes[head-1] = nodes[head-1]._replace(drel=re.sub(r"[%]*$", r'%', npHeadNode.drel))
+        tree = old_adjacency_matrix(nodes, True)
+        non_projective_arcs = sorted(old_non_projectivity(nodes, tree), key=lambda x: x[-1])
+    return [node._replace(pparent=-1, pdrel='__PAD__') for node in nodes]
+
+def old_ulParent(nodes, stack, linearHeadLabel):
+    while stack:
+        imdParent = stack.pop()
+        if linearHeadLabel.strip("%") == nodes[imdParent].pdrel.split("|")[0].strip("%"):
+            return imdParent
+    return 0
+
+def old_BSF(nodes, tree, linearHead, linearHeadLabel, node):
+    marked = lambda j: "%" in nodes[j].pdrel
+    syntacticHead = linearHead
+    queue = [j for j in np.nonzero(tree[linearHead])[0] if marked(j) and node != j]
+    stack = []
+    while queue:
+        queueNode = queue.pop(0)
+        if queueNode == node: continue
+        below = [j for j in np.nonzero(tree[queueNode])[0] if marked(j)]
+        if linearHeadLabel.strip("%") == nodes[queueNode].pdrel.split("|")[0].strip("%"):
+            if below == []:
+                syntacticHead = queueNode
+                break
+        elif queue == [] and below == []:
+            _head = old_ulParent(nodes, stack, linearHeadLabel)
+            if _head: syntacticHead = _head
+        queue.extend(below)
+        stack.append(queueNode)
+    return syntacticHead
+
+def old_deprojectivize(nodes):
+    tree = old_adjacency_matrix(nodes, training=False)
+    for nC in range(len(nodes)):
+        node = nodes[nC]
+        parent, drel = node.pparent, node.pdrel
+        if "|" in drel:
+            syntacticLabel, linearHeadLabel, linearHead = drel.split("|") + [parent-1]
+            syntacticLabel = syntacticLabel + "%" if "%" in drel else syntacticLabel
+            syntacticHead = old_BSF(nodes, tree, linearHead, linearHeadLabel, node.id-1)
+            if syntacticHead == linearHead and nodes[linearHead].pparent:
+                syntacticHead = old_BSF(nodes, tree, nodes[linearHead].pparent-1, linearHeadLabel, linearHead)
+            nodes[nC] = node._replace(pparent=syntacticHead + 1, pdrel=syntacticLabel)
+            tree = old_adjacency_matrix(nodes, training=False)
+    return nodes
+
+
+def random_tree(rng, n):
+    """(head, label) of tokens 1..n: a random tree under the root."""
+    order = list(range(1, n+1))
+    rng.shuffle(order)
+    heads = {order[0]: 0}
+    for i in order[1:]:
+        heads[i] = rng.choice(list(heads)) if rng.random() > 0.1 else 0
+    return [(heads[i], rng.choice(LABELS)) for i in range(1, n+1)]
+
+def graph_of(rows):
+    return DependencyGraph.from_rows(StringTable(), [(i, 'w%d' % i, '_', 'NN', 'NN', '_', head, label, '_')
+                                                     for i, (head, label) in enumerate(rows, 1)])
+
+def leaves_of(rows):
+    return [leaf._make([i, 'w%d' % i, '_', 'NN', 'NN', '_', head, -1, label, label, [None], [None], False, '_'])
+            for i, (head, label) in enumerate(rows, 1)]
+
+def outcome(decode):
+    # lifting a head that was lifted itself gives labels like 'obj|amod%|amod' that
+    # deprojectivize cannot split, in both implementations
+    try:
+        return decode()
+    except ValueError as e:
+        return repr(e)
+
+TREES = [random_tree(random.Random(seed), random.Random(seed).randint(2, 14)) for seed in range(300)]
+
+
+def test_random_trees_are_often_non_projective():
+    assert sum(bool(non_projectivity(graph_of(rows))) for rows in TREES) > 50
+
+
+@pytest.mark.parametrize('rows', TREES)
+def test_same_as_the_leaf_implementation(rows):
+    graph, nodes = projectivize(graph_of(rows)), old_projectivize(leaves_of(rows))
+    lifted = [(int(graph.heads[i]), graph.label(i), bool(graph.visit[i])) for i in range(1, graph.n+1)]
+    assert lifted == [(node.parent, node.drel, node.visit) for node in nodes]
+    assert not non_projectivity(graph)
+    assert all(graph.plabel(i) == '__PAD__' for i in range(1, graph.n+1))
+
+    # decode the lifted tree as a parser prediction
+    graph.pheads[:] = graph.heads
+    graph.plabels[:] = graph.labels
+    nodes = [node._replace(pparent=node.parent, pdrel=node.drel) for node in nodes]
+    new = outcome(lambda: [(int(g.pheads[i]), g.plabel(i)) for g in [deprojectivize(graph)] for i in range(1, g.n+1)])
+    old = outcome(lambda: [(node.pparent, node.pdrel) for node in old_deprojectivize(nodes)])
+    assert new == old
+
+
+@pytest.mark.parametrize('rows', TREES[:100])
+def test_projective_trees_are_unchanged(rows):
+    graph = projectivize(graph_of(rows))
+    if any(graph.visit[1:-1]):
+        return
+    assert [(int(graph.heads[i]), graph.label(i)) for i in range(1, graph.n+1)] == rows
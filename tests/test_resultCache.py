@@ -0,0 +1,53 @@
+from utils.resultCache import ResultCache, model_fingerprint, result_key
+
+
+def test_keys():
+    assert result_key('m', 'parse/beam1/lc0', ['Sea', 'ice']) == result_key('m', 'parse/beam1/lc0', ('Sea', 'ice'))
+    assert result_key('m', 'parse/beam1/lc0', ['Sea', 'ice']) != result_key('m', 'parse/beam1/lc1', ['Sea', 'ice'])
+    assert result_key('m', 'tag', ['Sea', 'ice']) != result_key('n', 'tag', ['Sea', 'ice'])
+
+
+def test_fingerprint_follows_the_model_files(tmp_path):
+    (tmp_path / 'model.meta').write_text('a')
+    before = model_fingerprint(str(tmp_path / 'model'))
+    assert model_fingerprint(str(tmp_path / 'model')) == before
+    (tmp_path / 'model.params').write_text('b')
+    assert model_fingerprint(str(tmp_path / 'model')) != before
+
+
+def test_memory_tier_evicts():
+    cache = ResultCache(maxsize=2)
+    for key in 'abc':
+        cache.put(key, key.upper())
+    assert cache.get('a') is None
+    assert cache.get('c') == 'C'
+    assert cache.stats()['memory']['size'] == 2
+
+
+def test_map_computes_distinct_misses_once():
+    cache = ResultCache()
+    cache.put('k1', 'cached')
+    calls = []
+    def compute(items):
+        calls.append(items)
+        return [item.upper() for item in items]
+    assert cache.map(['k1', 'k2', 'k3', 'k2'], ['x', 'b', 'c', 'b'], compute) == ['cached', 'B', 'C', 'B']
+    assert calls == [['b', 'c']]
+    assert cache.map(['k2', 'k3'], ['b', 'c'], compute) == ['B', 'C']
+    assert len(calls) == 1
+
+
+def test_disk_tier_survives_restarts(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    cache = ResultCache(path=path)
+    cache.map(['k1', 'k2'], [('Sea', 'ice'), ('ice',)], lambda items: [list(item) for item in items])
+    cache.close()
+    cache = ResultCache(maxsize=1, path=path)
+    assert cache.get('k1') == ['Sea', 'ice']
+    assert cache.get('k2') == ['ice']
+    assert cache.get('k3') is None
+    stats = cache.stats()['disk']
+    assert (stats['size'], stats['hits'], stats['misses']) == (2, 2, 1)
+    cache.clear()
+    assert cache.get('k1') is None
+    cache.close()
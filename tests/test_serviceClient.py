@@ -0,0 +1,139 @@
+import socket
+import asyncio
+import threading
+
+import pytest
+
+from utils.serviceProtocol import StandInServer
+from utils.serviceClient import Connection, ServiceClient, AsyncServiceClient, ServiceError
+
+PAIRS = [('sea ice', 'ice'), ('ice', 'sea ice'), ('rock', 'water'), ('', 'ice')] * 300
+EXPECTED = [('sea ice', 'ice', 'Hypernym', 0.9, 0.5), ('sea ice', 'ice', 'Hypernym', 0.9, 0.5),
+            ('rock', 'water', 'Unrelated', 0.6, 0.1), None] * 300
+
+
+@pytest.fixture
+def server():
+    with StandInServer() as srv:
+        yield srv
+
+
+def test_pipelined_requests_share_one_connection(server):
+    conn = Connection(('127.0.0.1', server.port), 5.)
+    try:
+        requests = [{'op': 'pairs', 'pairs': [list(PAIRS[k])]} for k in range(20)]
+        responses = conn.exchange(requests, window=20)
+        assert [r['id'] for r in responses] == [r['id'] for r in requests]
+        assert [tuple(r['results'][0]) if r['results'][0] else None for r in responses] == EXPECTED[:20]
+        # the connection stays open for the next requests
+        assert conn.exchange([{'op': 'ping'}])[0]['id'] == 20
+    finally:
+        conn.close()
+
+
+def test_score_pairs_in_batches(server):
+    with ServiceClient(port=server.port, batch_size=100) as client:
+        assert client.score_pairs(PAIRS) == EXPECTED
+        assert server.requests == 12
+        assert client.score_pairs(PAIRS[:3], op='hyp')[1] == ('ice', 'sea ice', 'Unrelated', 0.6, 0.1)
+
+
+def test_single_scores_are_batched(server):
+    results = [None]*40
+    with ServiceClient(port=server.port, max_delay=0.05) as client:
+        def score(i):
+            results[i] = client.score('sea ice', 'ice')
+        threads = [threading.Thread(target=score, args=(i,)) for i in range(40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert results == [EXPECTED[0]]*40
+    assert server.requests < 40
+
+
+def test_retry_resends_only_unanswered_requests():
+    with StandInServer(drop_every=5) as server:
+        with ServiceClient(port=server.port, batch_size=100, pool_size=1, window=1) as client:
+            assert client.score_pairs(PAIRS) == EXPECTED
+        # 12 batches and one dropped request per 4 answered ones (with a window, responses
+        # in flight when the server drops the connection may be lost and resent too)
+        assert server.requests == 12 + 2
+
+
+def test_retry_over_pooled_connections():
+    with StandInServer(drop_every=5) as server:
+        # drops are counted over all connections, so one of them may lose a few in a row
+        with ServiceClient(port=server.port, batch_size=50, pool_size=4, retries=5) as client:
+            assert client.score_pairs(PAIRS) == EXPECTED
+
+
+def test_timeout():
+    with StandInServer(delay=0.5) as server:
+        with ServiceClient(port=server.port, timeout=0.1, retries=1) as client:
+            with pytest.raises(socket.timeout):
+                client.ping()
+
+
+def test_server_errors_are_not_retried(server):
+    with ServiceClient(port=server.port) as client:
+        with pytest.raises(ServiceError):
+            client.score_pairs(PAIRS[:2], op='bogus')
+    assert server.requests == 1
+
+
+def test_stats(server):
+    with ServiceClient(port=server.port) as client:
+        assert client.stats().startswith('standin_requests')
+
+
+def test_legacy_tsv_exchange(server):
+    sock = socket.create_connection(('127.0.0.1', server.port), 5.)
+    sock.sendall(u'sea ice\tice\nrock\twater\n'.encode('utf-8'))
+    data = b''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    assert data.decode('utf-8') == u'sea ice\tice\tHypernym\t0.9\t0.5\nrock\twater\tUnrelated\t0.6\t0.1\n'
+
+
+def test_legacy_client_starting_like_magic(server):
+    # a TSV request starting like MAGIC is still a legacy request
+    sock = socket.create_connection(('127.0.0.1', server.port), 5.)
+    sock.sendall(u'CL\tCL\n'.encode('utf-8'))
+    sock.shutdown(socket.SHUT_WR)
+    assert sock.recv(4096) == u'CL\tCL\tUnrelated\t0.6\t0.1\n'.encode('utf-8')
+    sock.close()
+
+
+def test_idle_legacy_client_does_not_block_framed_requests(server):
+    idle = socket.create_connection(('127.0.0.1', server.port), 5.)
+    idle.sendall(b'sea ice')  # a legacy request whose line never ends
+    try:
+        with ServiceClient(port=server.port, timeout=2., retries=0) as client:
+            assert client.score_pairs(PAIRS[:2]) == EXPECTED[:2]
+    finally:
+        idle.close()
+
+
+def test_async_client():
+    async def run(port):
+        async with AsyncServiceClient(port=port, batch_size=100) as client:
+            assert await client.score_pairs(PAIRS) == EXPECTED
+            single = await asyncio.gather(*[client.score('sea ice', 'ice') for _ in range(50)])
+            assert single == [EXPECTED[0]]*50
+            assert (await client.stats()).startswith('standin_requests')
+    with StandInServer() as server:
+        asyncio.run(run(server.port))
+        assert server.requests < 12 + 50
+
+
+def test_async_retry():
+    async def run(port):
+        async with AsyncServiceClient(port=port, batch_size=100, retries=3) as client:
+            assert await client.score_pairs(PAIRS) == EXPECTED
+    with StandInServer(drop_every=5) as server:
+        asyncio.run(run(server.port))
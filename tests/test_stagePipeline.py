@@ -0,0 +1,82 @@
+import time
+import random
+
+import pytest
+
+from utils.stagePipeline import Pipeline, PipelineError, Reorder, Stage
+
+
+def jitter(x):
+    time.sleep(random.random() * 0.002)
+    return x
+
+
+def test_reorder():
+    reorder = Reorder()
+    assert reorder.push(1, 'b') == []
+    assert reorder.push(2, 'c') == []
+    assert reorder.push(0, 'a') == [(0, 'a'), (1, 'b'), (2, 'c')]
+
+
+def test_results_in_input_order():
+    pipeline = Pipeline([Stage('square', lambda x: jitter(x*x), workers=4),
+                         Stage('batch', lambda xs: [jitter(x+1) for x in xs], workers=3, batch_size=8),
+                         Stage('str', str)], queue_size=4)
+    assert list(pipeline.run(range(300))) == [str(x*x+1) for x in range(300)]
+    stats = pipeline.stats()
+    assert [stats[name]['items'] for name in ('square', 'batch', 'str')] == [300]*3
+
+
+def test_ordered_stage_sees_input_order():
+    seen = []
+    def record(x):
+        seen.append(x)
+        return x
+    pipeline = Pipeline([Stage('shuffle', jitter, workers=4), Stage('write', record, ordered=True)])
+    assert list(pipeline.run(range(100))) == list(range(100))
+    assert seen == list(range(100))
+
+
+def test_process_stage():
+    pipeline = Pipeline([Stage('double', lambda x: 2*x, workers=2, mode='process'), Stage('str', str)])
+    assert list(pipeline.run(range(50))) == [str(2*x) for x in range(50)]
+
+
+def test_stage_error_is_raised():
+    def fail(x):
+        if x == 37:
+            raise KeyError('bad item')
+        return x
+    pipeline = Pipeline([Stage('ok', jitter, workers=2), Stage('fail', fail, workers=2), Stage('last', str)])
+    with pytest.raises(PipelineError) as error:
+        list(pipeline.run(range(1000)))
+    assert error.value.stage == 'fail'
+    assert 'bad item' in error.value.trace
+
+
+def test_input_error_is_raised():
+    def items():
+        yield 1
+        raise ValueError('broken input')
+    with pytest.raises(PipelineError) as error:
+        list(Pipeline([Stage('id', jitter)]).run(items()))
+    assert error.value.stage == 'input'
+
+
+def test_early_close_stops_the_stages():
+    pipeline = Pipeline([Stage('id', jitter, workers=2)], queue_size=2)
+    results = pipeline.run(iter(range(10**6)))
+    assert [next(results) for _ in range(5)] == list(range(5))
+    started = time.time()
+    results.close()
+    assert time.time() - started < 5
+    assert pipeline.stats()['id']['items'] < 100
+
+
+def test_invalid_stages():
+    with pytest.raises(ValueError):
+        Stage('none')
+    with pytest.raises(ValueError):
+        Stage('write', str, workers=2, ordered=True)
+    with pytest.raises(ValueError):
+        Stage('gpu', str, mode='gpu')
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+"""
+Batch annotation of a text file: tokenizer -> POS tagger (-> NER tagger) -> parser -> writer.
+
+The stages run concurrently (utils.stagePipeline): tokenization and writing in threads,
+each model in its own process, connected by bounded queues, so I/O and bookkeeping
+overlap with the model compute.
+
+    python3 -m tools.batchPipeline --input text.txt --output text --format conll --ner --stats
+"""
+
+import io
+import os
+import sys
+import argparse
+from functools import partial
+
+from utils.stagePipeline import Pipeline, Stage
+from utils.bulkWriters import ConllWriter
+from utils.columnarOutput import open_writer
+from tools.numpyParser import NumpyParser, numpy_path
+
+
+def make_tokenizer():
+    from irtokz import RomanTokenizer
+    tok = RomanTokenizer(split_sen=True)
+    def tokenize(line):
+        return {'sentences': [s.split() for s in tok.tokenize(line).split('\n') if s.strip()]}
+    return tokenize
+
+def flat_sentences(docs):
+    return [words for doc in docs for words in doc['sentences']]
+
+def regroup(docs, key, results):
+    """Stores the per-sentence `results` of a batch of docs under `key`."""
+    results = iter(results)
+    for doc in docs:
+        doc[key] = [next(results) for _ in doc['sentences']]
+    return docs
+
+def make_tagger(model, key):
+    def load():
+        from tools.tagger import Tagger
+        tagger = Tagger(model=model)
+        def tag(docs):
+            return regroup(docs, key, [[t for w, t in tagged] for tagged in tagger.tag_batch(flat_sentences(docs))])
+        return tag
+    return load
+
+def make_parser(model, beam):
+    def load():
+        if os.path.exists(numpy_path(model)):  # exported with --export-numpy: parse without DyNet
+            parse_batch = partial(NumpyParser(model).parse_batch, beam=beam)
+        else:
+            from tools import parser
+            parser.args.beam = beam
+            parse_batch = partial(parser.parse_batch, parser.Parser(model=model))
+        def parse(docs):
+            parsed = parse_batch(flat_sentences(docs))
+            return regroup(docs, 'parse', [[(int(n.pparent), n.pdrel.strip('%')) for n in nodes] for nodes, pos, ner, root in parsed])
+        return parse
+    return load
+
+def make_writer(base, format):
+    """Ordered writer stage; returns (stage function, close)."""
+    columnar = format not in ('conll', 'conllu')
+    if columnar:
+        writer = open_writer(base, format=format)
+    else:
+        writer = ConllWriter('%s.%s' % (base, format), dialect='u' if format == 'conllu' else 'x')
+    def write(docs):
+        for doc in docs:
+            for i, words in enumerate(doc['sentences']):
+                heads, labels = zip(*doc['parse'][i]) if words else ((), ())
+                tags, ner = doc['pos'][i], doc['ner'][i] if 'ner' in doc else None
+                if columnar:
+                    writer.write(form=words, pos=tags, ner=ner, head=list(heads), rel=list(labels))
+                else:
+                    writer.write_sentence(words, tags, heads, labels)
+        return [len(doc['sentences']) for doc in docs]
+    return write, writer.close
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipelined batch annotation")
+    parser.add_argument('--input', required=True, help='Plain text file')
+    parser.add_argument('--output', required=True, help='Output base name (the extension follows --format)')
+    parser.add_argument('--format', default='conll', choices=['conll', 'conllu', 'auto', 'arrow', 'numpy'])
+    parser.add_argument('--tagger-model', dest='tagger_model', default='models/tagger/clearnlp-tagger')
+    parser.add_argument('--ner-model', dest='ner_model', default='models/ner/clearnlp-ner')
+    parser.add_argument('--parser-model', dest='parser_model', default='models/parser/clearnlp-parser')
+    parser.add_argument('--ner', action='store_true', help='Also run the NER tagger')
+    parser.add_argument('--beam', type=int, default=1, help='Parser beam size')
+    parser.add_argument('--tokenizers', type=int, default=2, help='Tokenizer threads')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=32, help='Lines per model batch')
+    parser.add_argument('--queue-size', dest='queue_size', type=int, default=64, help='Items buffered between stages')
+    parser.add_argument('--stats', action='store_true', help='Print per-stage utilization')
+    args = parser.parse_args()
+
+    write, close = make_writer(args.output, args.format)
+    stages = [Stage('tokenize', make=make_tokenizer, workers=args.tokenizers),
+              Stage('tag', make=make_tagger(args.tagger_model, 'pos'), batch_size=args.batch_size, mode='process')]
+    if args.ner:
+        stages.append(Stage('ner', make=make_tagger(args.ner_model, 'ner'), batch_size=args.batch_size, mode='process'))
+    stages += [Stage('parse', make=make_parser(args.parser_model, args.beam), batch_size=args.batch_size, mode='process'),
+               Stage('write', write, batch_size=args.batch_size, ordered=True)]
+
+    pipeline = Pipeline(stages, args.queue_size)
+    n_sents = 0
+    try:
+        with io.open(args.input, encoding='utf-8') as fp:
+            for n in pipeline.run(line for line in fp if line.strip()):
+                n_sents += n
+                sys.stderr.write("Annotated %d sentences\r" % n_sents)
+    finally:
+        close()
+    sys.stderr.write("Annotated %d sentences\n" % n_sents)
+    if args.stats:
+        pipeline.report()
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+
+"""
+DyNet-free inference for parser models.
+
+`python -m tools.parser --load-model M --export-numpy` writes the parameters of M as
+float32 arrays to `M.numpy.npz`. NumpyParser runs the char, base, POS and parse BiLSTMs
+as batched matrix products over the padded sentences of a batch (the input projections
+of all steps in one product, one (batch, hidden) product per step for the recurrence),
+then decodes with the parser's own arc-eager code (utils.arcEagerDecoding), so heads,
+labels and POS tags are those of tools.parser up to float rounding:
+
+    parser = NumpyParser('models/parser/clearnlp-parser')
+    for nodes, pos, ner, root in parser.parse_batch([['Sea', 'ice', 'melts', '.']]):
+        ...
+"""
+
+import io
+import sys
+import timeit
+import argparse
+import numpy as np
+from functools import partial
+
+from utils.arcEagerDecoding import ArcEagerDecoder
+from utils.dependencyGraph import DependencyGraph, StringTable
+from utils.modelBundle import load_meta
+from utils.pseudoProjectivity import deprojectivize
+from utils.vocabIds import VocabEncoder
+from utils.resultCache import model_fingerprint, result_key, shared_cache
+from utils.profiling import timed
+from utils.bulkWriters import ConllWriter
+
+NUMPY_ARRAYS = ('ps_pW1', 'ps_pb1', 'ps_pW2', 'ps_pb2', 'pr_pW1', 'pr_pb1', 'pr_pW2', 'pr_pb2',
+                'ner_pW1', 'ner_pb1', 'ner_pW2', 'ner_pb2', 'PAD', 'LOOKUP_WORD', 'LOOKUP_CHAR')
+NUMPY_RNNS = ('cfwdRNN', 'cbwdRNN', 'fwdRNN', 'bwdRNN', 'ps_fwdRNN', 'ps_bwdRNN', 'pr_fwdRNN', 'pr_bwdRNN')
+
+
+def numpy_path(model):
+    return '%s.numpy.npz' %model
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+class LSTM(object):
+    """
+    One layer of a DyNet LSTMBuilder from its get_parameters() arrays: VanillaLSTMBuilder
+    (x2i, h2i, bi; gates i, f, o, g with +1 on the forget gate) or the peephole
+    CoupledLSTMBuilder of DyNet 1.x (11 arrays, forget gate 1-i).
+    """
+
+    def __init__(self, arrays, forget_bias=1.):
+        self.coupled = len(arrays) == 11
+        if not self.coupled and len(arrays) != 3:
+            raise ValueError('unsupported LSTM with %d parameters' % len(arrays))
+        if self.coupled:
+            x2i, h2i, self.c2i, bi, x2o, h2o, self.c2o, bo, x2c, h2c, bc = arrays
+            # stacked like the vanilla gates: input, write, output
+            self.Wx = np.vstack([x2i, x2c, x2o]).T
+            self.Wh = np.vstack([h2i, h2c, h2o]).T
+            self.b = np.concatenate([bi, bc, bo])
+            self.hidden = len(bi)
+        else:
+            Wx, Wh, self.b = arrays
+            self.Wx, self.Wh = Wx.T, Wh.T
+            self.hidden = len(self.b) // 4
+            self.b = self.b.copy()
+            self.b[self.hidden:2*self.hidden] += forget_bias
+
+    def transduce(self, X):
+        """Hidden states (batch, steps, hidden) of right-padded inputs X (batch, steps, dim)."""
+        batch, steps = X.shape[:2]
+        d = self.hidden
+        XW = X.dot(self.Wx) + self.b
+        h = np.zeros((batch, d), dtype=X.dtype)
+        c = np.zeros((batch, d), dtype=X.dtype)
+        H = np.empty((batch, steps, d), dtype=X.dtype)
+        for t in range(steps):
+            gates = XW[:, t] + h.dot(self.Wh)
+            if self.coupled:
+                i = sigmoid(gates[:, :d] + c.dot(self.c2i.T))
+                c = (1. - i) * c + i * np.tanh(gates[:, d:2*d])
+                h = sigmoid(gates[:, 2*d:] + c.dot(self.c2o.T)) * np.tanh(c)
+            else:
+                g = sigmoid(gates[:, :3*d])
+                c = g[:, d:2*d] * c + g[:, :d] * np.tanh(gates[:, 3*d:])
+                h = g[:, 2*d:3*d] * np.tanh(c)
+            H[:, t] = h
+        return H
+
+
+def pad(sequences, lengths):
+    """(batch, max(lengths), dim) zero-padded stack of (length, dim) arrays."""
+    X = np.zeros((len(sequences), max(lengths), sequences[0].shape[1]), dtype=np.float32)
+    for k, seq in enumerate(sequences):
+        X[k, :len(seq)] = seq
+    return X
+
+def reverse_index(lengths, steps):
+    """Per row, the step order that reverses the first `length` steps and keeps the padding."""
+    index = np.tile(np.arange(steps), (len(lengths), 1))
+    for k, n in enumerate(lengths):
+        index[k, :n] = index[k, n-1::-1]
+    return index
+
+def bilstm(fwd, bwd, X, lengths):
+    """[forward; backward] states of padded X, as DyNet's f.transduce(x) / reversed(b.transduce(reversed(x)))."""
+    rows = np.arange(len(X))[:, None]
+    index = reverse_index(lengths, X.shape[1])
+    return np.concatenate([fwd.transduce(X), bwd.transduce(X[rows, index])[rows, index]], axis=2)
+
+
+class NumpyParser(ArcEagerDecoder):
+    def __init__(self, model, lang=None):
+        self.meta = load_meta(model)
+        with np.load(numpy_path(model)) as arrays:
+            for name in NUMPY_ARRAYS:
+                if name in arrays:
+                    setattr(self, name, arrays[name])
+            for name in NUMPY_RNNS:
+                layer = []
+                while '%s.%d' % (name, len(layer)) in arrays:
+                    layer.append(arrays['%s.%d' % (name, len(layer))])
+                setattr(self, name, LSTM(layer))
+        self.n_ner = getattr(self.meta, 'n_ner', 0)
+        self.masks = self.build_transition_masks(self.meta.i2td, self.meta.transitions)
+        self.encoder = VocabEncoder(self.meta.w2i, self.meta.c2i, self.meta.cc, lowercase=(lang == 'eng'))
+        self.fingerprint = model_fingerprint(model)
+
+    def char_features(self, encoded):
+        """[last forward; last backward] char-RNN states of every word of the batch, (words, 2*lstm_char_dim)."""
+        words = [ids.word_chars(i) for ids in encoded for i in range(len(ids.words))]
+        lengths = [len(chars) for chars in words]
+        X = pad([self.LOOKUP_CHAR[chars] for chars in words], lengths)
+        rows = np.arange(len(words))
+        index = reverse_index(lengths, X.shape[1])
+        forward = self.cfwdRNN.transduce(X)[rows, np.array(lengths)-1]
+        backward = self.cbwdRNN.transduce(X[rows[:, None], index])[rows, np.array(lengths)-1]
+        return np.hstack([forward, backward])
+
+    @timed('parser.forward')
+    def encode(self, sentences):
+        """Per sentence: parser-BiLSTM states (n, 2*lstm_wc_dim), POS scores and NER scores (or None)."""
+        encoded = [self.encoder.encode(words) for words in sentences]
+        lengths = [len(words) for words in sentences]
+        chars = self.char_features(encoded)
+        offsets = np.cumsum([0] + lengths)
+        X = pad([np.hstack([self.LOOKUP_WORD[ids.words], chars[offsets[k]:offsets[k+1]]])
+                 for k, ids in enumerate(encoded)], lengths)
+        bi = bilstm(self.fwdRNN, self.bwdRNN, X, lengths)
+        ps_bi = bilstm(self.ps_fwdRNN, self.ps_bwdRNN, bi, lengths)
+        pos_hidden = ps_bi.dot(self.ps_pW1.T)
+        pos = (np.maximum(pos_hidden, 0) + self.ps_pb1).dot(self.ps_pW2.T) + self.ps_pb2
+        ner = (np.maximum(bi.dot(self.ner_pW1.T), 0) + self.ner_pb1).dot(self.ner_pW2.T) + self.ner_pb2 if self.n_ner else None
+        pr_bi = bilstm(self.pr_fwdRNN, self.pr_bwdRNN, np.concatenate([bi, pos_hidden], axis=2), lengths)
+        return [(pr_bi[k, :n], pos[k, :n], ner[k, :n] if ner is not None else None) for k, n in enumerate(lengths)]
+
+    @timed('parser.project')
+    def project_array(self, H):
+        """Parser.project_array from the exported arrays."""
+        dims = self.meta.lstm_wc_dim*2
+        H = np.vstack([H, self.PAD])
+        W1 = self.pr_pW1
+        self.pr_np = [H.dot(W1[:,:dims].T), H.dot(W1[:,dims:].T), self.pr_pb1, self.pr_pW2, self.pr_pb2]
+
+    def parse_batch(self, sentences, beam=1):
+        """tools.parser.parse_batch: (nodes, POS, NER or None, root) per tokenized sentence."""
+        stage = 'parse/beam%d/lc%d' % (beam, self.encoder.lowercase)  # same keys as tools.parser
+        keys = [result_key(self.fingerprint, stage, words) for words in sentences]
+        parsed = shared_cache().map(keys, sentences, partial(self.decode_batch, beam=beam))
+        return [(list(nodes), list(pred_pos), list(pred_ner) if pred_ner is not None else None,
+                 DependencyGraph.root())
+                for nodes, pred_pos, pred_ner in parsed]
+
+    def decode_batch(self, sentences, beam=1):
+        parsed = []
+        for words, (H, pos, ner) in zip(sentences, self.encode(sentences)):
+            graph = DependencyGraph.from_words(StringTable(), words)
+            pred_pos = tuple(self.meta.i2p[np.argmax(xo)] for xo in pos)
+            pred_ner = tuple(self.meta.i2n[np.argmax(xo)] for xo in ner) if ner is not None else None
+            self.project_array(H)
+            if beam > 1:
+                self.beam_decode(graph, beam)
+            else:
+                self.greedy_decode(graph)
+            dgraph = deprojectivize(graph)
+            parsed.append((tuple(dgraph.nodes()), pred_pos, pred_ner))
+        return parsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse tokenized text (one sentence per line) without DyNet")
+    parser.add_argument('--load-model', dest='load_model', default='models/parser/clearnlp-parser')
+    parser.add_argument('--input', required=True, help='Tokenized text, one sentence per line')
+    parser.add_argument('--output-file', dest='outfile', default='-', help='CoNLL output (gzip/zstd by .gz/.zst name, - for stdout)')
+    parser.add_argument('--beam', type=int, default=1, help='Beam size for decoding (1 = greedy)')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=64)
+    parser.add_argument('--lang')
+    args = parser.parse_args()
+
+    numpyparser = NumpyParser(args.load_model, args.lang)
+    started, n_sents = timeit.default_timer(), 0
+    with io.open(args.input, encoding='utf-8') as fp, ConllWriter(args.outfile) as writer:
+        sentences = [line.split() for line in fp if line.strip()]
+        for start in range(0, len(sentences), args.batch_size):
+            for nodes, pos, ner, root in numpyparser.parse_batch(sentences[start:start+args.batch_size], args.beam):
+                writer.write_sentence([n.form for n in nodes], pos, [int(n.pparent) for n in nodes], [n.pdrel.strip('%') for n in nodes])
+                n_sents += 1
+    sys.stderr.write("Parsed %d sentences (%.1f sentences/sec)\n" % (n_sents, n_sents/(timeit.default_timer()-started)))
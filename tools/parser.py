@@ -4,7 +4,6 @@ import io
 import os
 import re
 import sys
-import copy
 import string
 import timeit
 import random
@@ -14,13 +13,27 @@ import threading
 
 import argparse
 import numpy as np
-from collections import Counter, namedtuple, defaultdict
+from functools import partial
+from collections import Counter, defaultdict
 
 import dynet as dy
-from gensim.models.word2vec import *
 
-from utils.arcEager import ArcEager
+from utils.arcEagerDecoding import ArcEagerDecoder, Configuration
+from utils.dependencyGraph import DependencyGraph, StringTable, Treebank
+from utils.modelBundle import load_meta, load_parameters
 from utils.pseudoProjectivity import *
+from utils.vocabIds import VocabEncoder
+from utils.resultCache import model_fingerprint, result_key, shared_cache
+from utils.profiling import timer, timed, count
+from utils.metrics import counter, histogram
+from utils.trainingSchedule import add_arguments, from_args
+from utils.columnarOutput import open_writer
+from utils.bulkWriters import ConllWriter
+from utils.parallelTraining import DataParallel, add_arguments as parallel_arguments
+from tools.numpyParser import NUMPY_ARRAYS, NUMPY_RNNS, numpy_path
+
+_sentences_ = counter('parser_sentences_total', 'Sentences parsed (cache misses)')
+_batch_seconds_ = histogram('parser_batch_seconds', 'Time to parse one batch')
 
 random.seed(37)
 np.random.seed(37)
@@ -37,16 +50,10 @@ class Meta:
         self.lstm_char_dim = 32  # char-LSTM output dimension
         self.transitions = {'SHIFT':0,'LEFTARC':1,'RIGHTARC':2,'REDUCE':3}  # parser transitions
 
-class Configuration(object):
-    def __init__(self, nodes=[]):
-        self.stack = list()
-        self.b0 = 1
-        self.nodes = nodes
-
-class Parser(ArcEager):
+class Parser(ArcEagerDecoder):
     def __init__(self, model=None, meta=None):
         self.model = dy.Model()
-        self.meta = pickle.load(open('%s.meta' %model, 'rb')) if model else meta
+        self.meta = load_meta(model) if model else meta
 
         # define pos-mlp
         self.ps_pW1 = self.model.add_parameters((self.meta.p_hidden, self.meta.lstm_wc_dim*2))
@@ -76,6 +83,13 @@ class Parser(ArcEager):
         self.pr_fwdRNN = dy.LSTMBuilder(1, self.meta.lstm_wc_dim*2+self.meta.p_hidden, self.meta.lstm_wc_dim, self.model)
         self.pr_bwdRNN = dy.LSTMBuilder(1, self.meta.lstm_wc_dim*2+self.meta.p_hidden, self.meta.lstm_wc_dim, self.model)
 
+        # optional NER-mlp on the shared base Bi-LSTM (models trained with --ner-column)
+        if getattr(self.meta, 'n_ner', 0):
+            self.ner_pW1 = self.model.add_parameters((self.meta.p_hidden, self.meta.lstm_wc_dim*2))
+            self.ner_pb1 = self.model.add_parameters(self.meta.p_hidden)
+            self.ner_pW2 = self.model.add_parameters((self.meta.n_ner, self.meta.p_hidden))
+            self.ner_pb2 = self.model.add_parameters(self.meta.n_ner)
+
         # pad-node for missing nodes in partial parse tree
         self.PAD = self.model.add_parameters(self.meta.lstm_wc_dim*2)
 
@@ -85,12 +99,26 @@ class Parser(ArcEager):
 
         # load pretrained embeddings
         if model is None:
-            for word, V in wvm.vocab.iteritems():
+            for word, V in wvm.vocab.items():
                 self.LOOKUP_WORD.init_row(V.index+self.meta.add_words, wvm.syn0[V.index])
 
         # load pretrained dynet model
         if model:
-            self.model.populate('%s.dy' %model)
+            load_parameters(self.model, model)
+
+        # labeled-transition masks per transition type (SHIFT, LEFTARC, RIGHTARC, REDUCE)
+        self.masks = self.build_transition_masks(self.meta.i2td, self.meta.transitions)
+        self.encoder = VocabEncoder(self.meta.w2i, self.meta.c2i, self.meta.cc, lowercase=(args.lang == 'eng'))
+        # results of a saved model are cached by content; a model being trained is not
+        self.fingerprint = model_fingerprint(model) if model else None
+
+    def export_numpy(self, model):
+        """Writes all parameters as float32 arrays for tools.numpyParser.NumpyParser."""
+        arrays = dict((name, getattr(self, name).as_array()) for name in NUMPY_ARRAYS if hasattr(self, name))
+        for name in NUMPY_RNNS:
+            layer, = getattr(self, name).get_parameters()
+            arrays.update(('%s.%d' % (name, k), p.as_array()) for k, p in enumerate(layer))
+        np.savez(numpy_path(model), **dict((name, np.asarray(a, dtype=np.float32)) for name, a in arrays.items()))
 
     def enable_dropout(self):
         self.fwdRNN.set_dropout(0.3)
@@ -128,6 +156,11 @@ class Parser(ArcEager):
         self.pr_b1 = dy.parameter(self.pr_pb1)
         self.pr_W2 = dy.parameter(self.pr_pW2)
         self.pr_b2 = dy.parameter(self.pr_pb2)
+        if getattr(self.meta, 'n_ner', 0):
+            self.ner_W1 = dy.parameter(self.ner_pW1)
+            self.ner_b1 = dy.parameter(self.ner_pb1)
+            self.ner_W2 = dy.parameter(self.ner_pW2)
+            self.ner_b2 = dy.parameter(self.ner_pb2)
 
         # apply dropout
         if self.eval:
@@ -148,63 +181,38 @@ class Parser(ArcEager):
         self.pr_f_init = self.pr_fwdRNN.initial_state()
         self.pr_b_init = self.pr_bwdRNN.initial_state()
 
-    def word_rep(self, w):
+    def word_rep(self, idx):
         if not self.eval and random.random() < 0.25:
             return self.LOOKUP_WORD[0]
-        if args.lang == 'eng':
-            idx = self.meta.w2i.get(w, self.meta.w2i.get(w.lower(), 0))
-        else:
-            idx = self.meta.w2i.get(w, 0)
-        return self.LOOKUP_WORD[idx]
+        return self.LOOKUP_WORD[int(idx)]
 
-    def char_rep(self, w, f, b):
-        bos, eos, unk = self.meta.c2i["bos"], self.meta.c2i["eos"], self.meta.c2i["unk"]
-        char_ids = [bos] + [self.meta.c2i[c] if self.meta.cc[c]>5 else unk for c in w] + [eos]
-        char_embs = [self.LOOKUP_CHAR[cid] for cid in char_ids]
+    def char_rep(self, char_ids, f, b):
+        char_embs = [self.LOOKUP_CHAR[int(cid)] for cid in char_ids]
         fw_exps = f.transduce(char_embs)
         bw_exps = b.transduce(reversed(char_embs))
         return dy.concatenate([ fw_exps[-1], bw_exps[-1] ])
 
-    def get_char_embds(self, sentence, hf, hb):
+    def get_char_embds(self, ids, hf, hb):
         char_embs = []
-        for node in sentence:
-            char_embs.append(self.char_rep(node.form, hf, hb))
+        for i in range(len(ids.words)):
+            char_embs.append(self.char_rep(ids.word_chars(i), hf, hb))
         return char_embs
 
-    def get_word_embds(self, sentence):
+    def get_word_embds(self, ids):
         word_embs = []
-        for node in sentence:
-            word_embs.append(self.word_rep(node.form))
+        for idx in ids.words:
+            word_embs.append(self.word_rep(idx))
         return word_embs
 
-    def basefeaturesEager(self, nodes, stack, i):
-        #NOTE Stack nodes
-        #s2 = nodes[stack[-3]] if stack[2:] else nodes[0].left
-        #s1 = nodes[stack[-2]] if stack[1:] else nodes[0].left
-        s0 = nodes[stack[-1]] if stack else nodes[0].left
-
-        #NOTE Buffer nodes
-        n0 = nodes[ i ] if nodes[ i: ] else nodes[0].left
-
-        #NOTE Leftmost and Rightmost children of s2,s1,s0 and b0(only leftmost)
-        #s2l = nodes[s2.left [-1]] if s2.left [-1] != None else nodes[0].left
-        #s2r = nodes[s2.right[-1]] if s2.right[-1] != None else nodes[0].left
-        #s1l = nodes[s1.left [-1]] if s1.left [-1] != None else nodes[0].left
-        #s1r = nodes[s1.right[-1]] if s1.right[-1] != None else nodes[0].left
-        #s0l = nodes[s0.left [-1]] if s0.left [-1] != None else nodes[0].left
-        #s0r = nodes[s0.right[-1]] if s0.right[-1] != None else nodes[0].left
-        #n0l = nodes[n0.left [-1]] if n0.left [-1] != None else nodes[0].left
-        return [(nd.id, nd.form) for nd in (s0,n0)]
-    
     def basefeaturesStandard(self, nodes, stack, i):
         #NOTE Stack nodes
         #s3 = nodes[stack[-4]] if stack[3:] else nodes[0].left
         #s2 = nodes[stack[-3]] if stack[2:] else nodes[0].left
         #s1 = nodes[stack[-2]] if stack[1:] else nodes[0].left
-        s0 = nodes[stack[-1]] if stack else nodes[0].left
+        s0 = stack[-1] if stack else None
 
         #NOTE Buffer nodes
-        n0 = nodes[ i ] if nodes[ i: ] else nodes[0].left
+        n0 = i
         #n0left = n0.left if i else [None]
 
         #NOTE Leftmost and Rightmost children of s2,s1,s0 and b0(only leftmost)
@@ -219,15 +227,20 @@ class Parser(ArcEager):
         #n0l = nodes[n0left [-1]]  if n0left  [-1] != None else nodes[0].left
         #n0r = nodes[n0.right[-1]] if n0.right[-1] != None else nodes[0].left
         
-        return [(nd.id, nd.form) for nd in (s0,n0)]
+        return [(nodes.ids[nd], nodes.form(nd)) if nd is not None else (-1, '__PAD__') for nd in (s0,n0)]
 
-    def feature_extraction(self, sentence):
-        dy.renew_cg()
-        self.initialize_graph_nodes()
+    @timed('parser.features')
+    def feature_extraction(self, sentence, ids=None, renew=True):
+        """`ids` are the precomputed utils.vocabIds.SentenceIds of the sentence, if any."""
+        if renew:
+            dy.renew_cg()
+            self.initialize_graph_nodes()
+        if ids is None:
+            ids = self.encoder.encode(sentence.words())
 
         # get word/char embeddings
-        wembs = self.get_word_embds(sentence)
-        cembs = self.get_char_embds(sentence, self.cf_init, self.cb_init)
+        wembs = self.get_word_embds(ids)
+        cembs = self.get_char_embds(ids, self.cf_init, self.cb_init)
         lembs = [dy.concatenate([w,c]) for w,c in zip(wembs, cembs)]
 
         # feed word vectors into base biLSTM 
@@ -242,15 +255,24 @@ class Parser(ArcEager):
 
         # get pos-hidden representation and pos loss
         pos_errs, pos_hidden = [], []
-        for xi,node in zip(ps_bi_exps, sentence):
+        for xi,tag in zip(ps_bi_exps, sentence.token_strings('tags')):
             xh = self.ps_W1 * xi
             pos_hidden.append(xh)
             xh = dy.rectify(xh) + self.ps_b1
             xo = self.ps_W2*xh + self.ps_b2
-            #tid = self.meta.p2i[node.tag]
-            err = dy.softmax(xo).npvalue() if self.eval else dy.pickneglogsoftmax(xo, self.meta.p2i[node.tag])
+            #tid = self.meta.p2i[tag]
+            err = dy.softmax(xo) if self.eval else dy.pickneglogsoftmax(xo, self.meta.p2i[tag])
             pos_errs.append(err)
 
+        # get ner probabilities/loss from the same base biLSTM
+        self.ner_errs = []
+        if getattr(self.meta, 'n_ner', 0):
+            for xi,ner in zip(bi_exps, sentence.token_strings('ner')):
+                xh = dy.rectify(self.ner_W1 * xi) + self.ner_b1
+                xo = self.ner_W2*xh + self.ner_b2
+                err = dy.softmax(xo) if self.eval else dy.pickneglogsoftmax(xo, self.meta.n2i[ner])
+                self.ner_errs.append(err)
+
         # concatenate pos hidden-layer with base biLSTM 
         wcp_exps = [dy.concatenate([w,p]) for w,p in zip(bi_exps, pos_hidden)]
         # feed concatenated embeddings into parse biLSTM
@@ -258,36 +280,67 @@ class Parser(ArcEager):
         pr_bw_exps = self.pr_b_init.transduce(reversed(wcp_exps))
         pr_bi_exps = [dy.concatenate([f,b]) for f,b in zip(pr_fw_exps, reversed(pr_bw_exps))]
 
+        # in eval mode the probabilities are left as expressions when batching several sentences
+        if self.eval and renew:
+            with timer('parser.forward'):  # DyNet runs the LSTMs lazily, on readback
+                pos_errs, self.ner_errs = self.columns(pos_errs), self.columns(self.ner_errs)
         return pr_bi_exps, pos_errs
 
-def Train(sentence, epoch, dynamic=True):
+    @staticmethod
+    def columns(exps):
+        """Values of equally sized vector expressions, computed in one forward pass."""
+        if not exps:
+            return []
+        return list(dy.concatenate_cols(exps).npvalue().reshape(-1, len(exps), order='F').T)
+
+    @timed('parser.project')
+    def project_features(self, pr_bi_exps):
+        """
+        pr_W1*[s0;b0] == W1_s*s0 + W1_b*b0, so every token (and the PAD node, last row) is
+        projected through both halves of pr_W1 once per sentence instead of once per transition.
+        """
+        dims = self.meta.lstm_wc_dim*2
+        H = dy.concatenate_cols(pr_bi_exps + [self.pad])
+        W1_s = dy.select_cols(self.pr_W1, list(range(dims)))
+        W1_b = dy.select_cols(self.pr_W1, list(range(dims, 2*dims)))
+        P_s = dy.transpose(W1_s * H)
+        P_b = dy.transpose(W1_b * H)
+        # numpy copies for scoring transitions without growing the graph
+        self.pr_np = [P_s.npvalue(), P_b.npvalue(), self.pr_b1.npvalue(), self.pr_W2.npvalue(), self.pr_b2.npvalue()]
+        return P_s, P_b
+
+    @timed('parser.project')
+    def project_array(self, H):
+        """project_features for the (n, 2*lstm_wc_dim) parser-BiLSTM values of a sentence, in numpy."""
+        dims = self.meta.lstm_wc_dim*2
+        H = np.vstack([H, self.pad.npvalue()])
+        W1 = self.pr_W1.npvalue()
+        self.pr_np = [H.dot(W1[:,:dims].T), H.dot(W1[:,dims:].T), self.pr_b1.npvalue(), self.pr_W2.npvalue(), self.pr_b2.npvalue()]
+
+    def transition_expression(self, P_s, P_b, rows):
+        """Same as transition_scores, as an expression for the loss."""
+        s0, b0 = rows
+        xh = dy.rectify(dy.pick(P_s, s0) + dy.pick(P_b, b0)) + self.pr_b1
+        return self.pr_W2*xh + self.pr_b2
+
+def Train(sentence, epoch, dynamic=True, ids=None):
     loss = []
     totalError = 0
     parser.eval = False
     configuration = Configuration(sentence)
-    pr_bi_exps, pos_errs = parser.feature_extraction(sentence[1:-1])
+    pr_bi_exps, pos_errs = parser.feature_extraction(sentence, ids)
+    P_s, P_b = parser.project_features(pr_bi_exps)
     while not parser.isFinalState(configuration):
         rfeatures = parser.basefeaturesEager(configuration.nodes, configuration.stack, configuration.b0)
-        xi = dy.concatenate([pr_bi_exps[id-1] if id > 0 else parser.pad for id, rform in rfeatures])
-        xh = parser.pr_W1 * xi
-        xh = dy.rectify(xh) + parser.pr_b1
-        xo = parser.pr_W2*xh + parser.pr_b2
-        output_probs = dy.softmax(xo).npvalue()
-        ranked_actions = sorted(zip(output_probs, range(len(output_probs))), reverse=True)
-        pscore, paction = ranked_actions[0]
+        rows = parser.feature_rows(rfeatures, len(pr_bi_exps))
+        output_probs = parser.transition_scores(rows)  # softmax is monotone, rank on scores
 
         validTransitions, allmoves = parser.get_valid_transitions(configuration) #{0: <bound method arceager.SHIFT>}
-        while parser.action_cost(configuration, parser.meta.i2td[paction], parser.meta.transitions, validTransitions) > 500:
-           ranked_actions = ranked_actions[1:]
-           pscore, paction = ranked_actions[0]
-
-        gaction = None
-        for i,(score, ltrans) in enumerate(ranked_actions):
-           cost = parser.action_cost(configuration, parser.meta.i2td[ltrans], parser.meta.transitions, validTransitions)
-           if cost == 0:
-              gaction = ltrans
-              need_update = (i > 0)
-              break
+        # best valid and best zero-cost (gold) actions
+        paction = parser.best_action(output_probs, parser.valid_mask(parser.masks, validTransitions))
+        gaction = parser.best_action(output_probs, parser.zero_cost_mask(configuration, parser.masks,
+                                        parser.meta.td2i, parser.meta.transitions, validTransitions))
+        need_update = (gaction != paction)
 
         gtransitionstr, goldLabel = parser.meta.i2td[gaction]
         ptransitionstr, predictedLabel = parser.meta.i2td[paction]
@@ -297,18 +350,23 @@ def Train(sentence, epoch, dynamic=True):
         else:
            goldTransitionFunc = allmoves[parser.meta.transitions[gtransitionstr]]
            goldTransitionFunc(configuration, goldLabel)
+        xo = parser.transition_expression(P_s, P_b, rows)
         loss.append(dy.pickneglogsoftmax(xo, parser.meta.td2i[(gtransitionstr, goldLabel)])) #NOTE original
 
         if need_update: totalError += 1
 
+    if parser.ner_errs:
+        return dy.esum(loss) + dy.esum(pos_errs) + dy.esum(parser.ner_errs), totalError
     return dy.esum(loss) + dy.esum(pos_errs), totalError
 
 def Test(parser, test_file):
     if not args.isDaemon:
-        if args.outfile:
-            ofile = io.open(args.outfile, 'w', encoding='utf-8')
-        with io.open(test_file, encoding='utf-8') as fp:
-            inputGenTest = re.finditer("(.*?)\n\n", fp.read(), re.S)
+        columnar = args.output_format not in ('conll', 'conllu')
+        if args.outfile and columnar:
+            ofile = open_writer(args.outfile, format=args.output_format)
+        elif args.outfile:
+            ofile = ConllWriter(args.outfile, dialect='u' if args.output_format == 'conllu' else 'x')
+        inputGenTest = read_sentences(test_file) if isinstance(test_file, str) else test_file
     else:
         inputGenTest = [test_file]
 
@@ -316,45 +374,39 @@ def Test(parser, test_file):
     scores = defaultdict(int)
     good, bad = 0.0, 0.0
     for idx, sentence in enumerate(inputGenTest):
-        if args.isDaemon:
-            graph = list(depenencyGraph(sentence))
-        else:
-            graph = list(depenencyGraph(sentence.group(1)))
-        pr_bi_exps, pos_errs = parser.feature_extraction(graph[1:-1])
+        graph = depenencyGraph(sentence)
+        pr_bi_exps, pos_errs = parser.feature_extraction(graph)
+        count('parser.sentences')
         pred_pos = []
-        for xo, node in zip(pos_errs, graph[1:-1]):
+        for xo, tag in zip(pos_errs, graph.token_strings('tags')):
             p_tag = parser.meta.i2p[np.argmax(xo)]
             pred_pos.append(p_tag)
-            if node.tag == p_tag:
+            if tag == p_tag:
                 good += 1
             else:
                 bad += 1
+        pred_ner = [parser.meta.i2n[np.argmax(xo)] for xo in parser.ner_errs] if parser.ner_errs else None
 
-        configuration = Configuration(graph)
-        while not parser.isFinalState(configuration):
-            rfeatures = parser.basefeaturesEager(configuration.nodes, configuration.stack, configuration.b0)
-            xi = dy.concatenate([pr_bi_exps[id-1] if id > 0 else parser.pad for id, rform in rfeatures])
-            xh = parser.pr_W1 * xi
-            xh = dy.rectify(xh) + parser.pr_b1
-            xo = parser.pr_W2*xh + parser.pr_b2
-            output_probs = dy.softmax(xo).npvalue()
-            validTransitions, _ = parser.get_valid_transitions(configuration) #{0: <bound method arceager.SHIFT>}
-            sortedPredictions = sorted(zip(output_probs, range(len(output_probs))), reverse=True)
-            for score, action in sortedPredictions:
-                transition, predictedLabel = parser.meta.i2td[action]
-                if parser.meta.transitions[transition] in validTransitions:
-                    predictedTransitionFunc = validTransitions[parser.meta.transitions[transition]]
-                    predictedTransitionFunc(configuration, predictedLabel)
-                    break
-        dgraph = deprojectivize(graph[1:-1])
+        parser.project_features(pr_bi_exps)
+        if args.beam > 1:
+            parser.beam_decode(graph, args.beam)
+        else:
+            parser.greedy_decode(graph)
+        dgraph = deprojectivize(graph)
         if args.isDaemon:
-            return dgraph, pred_pos, graph[0]
+            return dgraph.nodes(), pred_pos, pred_ner, dgraph.root()
         scores = tree_eval(dgraph, scores)
         if args.outfile:
-            for node in dgraph:
-                ofile.write('\t'.join([unicode(node.id), node.form, u'_', node.tag, u'_', u'_',
-                            unicode(node.pparent), node.pdrel.strip('%'), u'_', u'_'])+'\n')
-            ofile.write(u'\n')
+            with timer('parser.output'):
+                nodes = dgraph.nodes()
+                forms, tags, rels = [n.form for n in nodes], [n.tag for n in nodes], [n.pdrel.strip('%') for n in nodes]
+                heads = [int(n.pparent) for n in nodes]
+                if columnar:
+                    ofile.write(form=forms, pos=tags, ner=pred_ner, head=heads, rel=rels)
+                else:
+                    ofile.write_sentence(forms, tags, heads, rels)
+    if args.outfile:
+        ofile.close()
     sys.stderr.write('\n')
 
     UAS = round(100. * scores['rightAttach']/(scores['rightAttach']+scores['wrongAttach']),2)
@@ -363,55 +415,112 @@ def Test(parser, test_file):
     
     return good/(good+bad), UAS, LS, LAS
 
-def tree_eval(sentence, scores):
-    for node in sentence:
-        if node.parent == node.pparent:
-            scores['rightAttach'] += 1
-            if node.drel.strip('%') == node.pdrel.strip('%'):
-                scores['rightLabeledAttach'] += 1
-            else:
-                scores['wrongLabeledAttach'] += 1
-        else:
-            scores['wrongAttach'] += 1
-            scores['wrongLabeledAttach'] += 1
-
-        if node.drel.strip('%') == node.pdrel.strip('%'):
-            scores['rightLabel'] += 1
+def parse_batch(parser, sentences):
+    """
+    Parses a batch of tokenized sentences; returns what Test returns in daemon mode for
+    each sentence, in order. Repeated sentences are served from the result cache.
+    """
+    if parser.fingerprint is None:
+        parsed = decode_batch(parser, sentences)
+    else:
+        # the encoder's lowercasing (--lang) changes the parses of the same model
+        stage = 'parse/beam%d/lc%d' % (args.beam, parser.encoder.lowercase)
+        keys = [result_key(parser.fingerprint, stage, words) for words in sentences]
+        parsed = shared_cache().map(keys, sentences, partial(decode_batch, parser))
+    return [(list(nodes), list(pred_pos), list(pred_ner) if pred_ner is not None else None,
+             DependencyGraph.root())
+            for nodes, pred_pos, pred_ner in parsed]
+
+def decode_batch(parser, sentences):
+    """
+    Decodes a batch of tokenized sentences with all encoders in one graph (one forward
+    pass, autobatched by DyNet if enabled); returns (nodes, POS, NER or None) tuples.
+    """
+    started = timeit.default_timer()
+    parser.eval = True
+    dy.renew_cg()
+    parser.initialize_graph_nodes()
+    graphs, pr_exps, pos_exps, ner_exps = [], [], [], []
+    for words in sentences:
+        graph = depenencyGraph(words)
+        pr_bi_exps, pos_errs = parser.feature_extraction(graph, renew=False)
+        graphs.append(graph)
+        pr_exps.append(pr_bi_exps)
+        pos_exps.append(pos_errs)
+        ner_exps.append(parser.ner_errs)
+    with timer('parser.forward'):  # DyNet runs the LSTMs lazily, on readback
+        H = parser.columns([x for exps in pr_exps for x in exps])
+        pos_probs = parser.columns([x for exps in pos_exps for x in exps])
+        ner_probs = parser.columns([x for exps in ner_exps for x in exps])
+
+    parsed, start = [], 0
+    for graph in graphs:
+        n = graph.n
+        pred_pos = tuple(parser.meta.i2p[np.argmax(xo)] for xo in pos_probs[start:start+n])
+        pred_ner = tuple(parser.meta.i2n[np.argmax(xo)] for xo in ner_probs[start:start+n]) if ner_probs else None
+        parser.project_array(np.array(H[start:start+n]))
+        if args.beam > 1:
+            parser.beam_decode(graph, args.beam)
         else:
-            scores['wrongLabel'] += 1
+            parser.greedy_decode(graph)
+        dgraph = deprojectivize(graph)
+        parsed.append((tuple(dgraph.nodes()), pred_pos, pred_ner))
+        start += n
+    _sentences_.inc(len(sentences))
+    _batch_seconds_.observe(timeit.default_timer()-started)
+    return parsed
+
+def tree_eval(graph, scores):
+    attach = graph.heads[1:-1] == graph.pheads[1:-1]
+    label = np.array([g.strip('%') == p.strip('%') for g, p in
+                      zip(graph.token_strings('labels'), graph.token_strings('plabels'))], dtype=bool)
+    scores['rightAttach'] += int(attach.sum())
+    scores['wrongAttach'] += int((~attach).sum())
+    scores['rightLabeledAttach'] += int((attach & label).sum())
+    scores['wrongLabeledAttach'] += int((~(attach & label)).sum())
+    scores['rightLabel'] += int(label.sum())
+    scores['wrongLabel'] += int((~label).sum())
     return scores
 
-def train_parser(dataset):
+def train_parser(dataset, par=None):
+    """Trains on `dataset`, or on this worker's shards of it when called by DataParallel.run."""
     n_samples = len(dataset)
     sys.stdout.write("Started training ...\n")
     sys.stdout.write("Training Examples: %s Classes: %s Epochs: %d\n\n" % (n_samples, parser.meta.n_outs, args.iter))
-    psc, num_tagged, cum_loss = 0., 0, 0.
+    num_tagged, cum_loss = 0, 0.
+    order = list(range(n_samples))
+    # word/char ids of every sentence, computed once for all epochs
+    encodings = [parser.encoder.encode(sentence.words()) for sentence in dataset]
+    make_schedule = lambda: from_args(args, evaluate, read_sentences(args.dev), parser.model, parser.meta)
+    schedule = make_schedule() if par is None else par.schedule(make_schedule)
     for epoch in range(args.iter):
-        random.shuffle(dataset)
-        gtotalError, gtotal = 0, 0
-        for sid, sentence in enumerate(dataset, 1):
-            if sid % 500 == 0 or sid == n_samples:   # print status
+        if par is None:
+            random.shuffle(order)
+        else:
+            order = par.shard(list(range(n_samples)), epoch)
+        for sid, (sentence, ids) in enumerate(((dataset[i], encodings[i]) for i in order), 1):
+            csentence = sentence.copy()
+            loss, totalError = Train(csentence, epoch+1, ids=ids)
+            cum_loss += loss.scalar_value()
+            num_tagged += 2 * sentence.n - 1
+            loss.backward()
+            trainer.update()
+            if sid % 500 == 0 or sid == len(order):   # print status
                 trainer.status()
                 print(cum_loss / num_tagged)
                 cum_loss, num_tagged = 0, 0
-            sys.stdout.flush()
-        csentence = copy.deepcopy(sentence)
-        loss, totalError = Train(csentence, epoch+1)
-        cum_loss += loss.scalar_value()
-        num_tagged += 2 * len(sentence[1:-1]) - 1
-        loss.backward()
-        trainer.update()
-        #sys.stderr.write("Training Instances:: %s\r"%sid)
-        sys.stderr.flush()
-        POS, UAS, LS, LAS = Test(parser, args.dev)
-        sys.stderr.write("\nPOS ACCURACY: {}% UAS: {}%, LS: {}% and LAS: {}%\n".format(POS, UAS, LS, LAS))
-        sys.stderr.flush()
-        if LAS > psc:
-            sys.stderr.write('SAVE POINT %d\n' %epoch)
-            psc = LAS
-            if args.save_model:
-                parser.model.save('%s.dy' %args.save_model)
-        #sys.stderr.write("Epoch:: %s Loss:: %s\n" % (epoch+1, 100.*gtotalError/gtotal))
+                sys.stdout.flush()
+            if schedule.step():
+                break
+        if schedule.stopped or schedule.epoch_end():
+            break
+    schedule.close()
+
+def evaluate(sentences):
+    """LAS of the parser on a list of CONLL sentence strings."""
+    POS, UAS, LS, LAS = Test(parser, sentences)
+    sys.stderr.write("POS ACCURACY: {}% UAS: {}%, LS: {}% and LAS: {}%\n".format(POS, UAS, LS, LAS))
+    return LAS
 
 def projective(nodes):
     """Identifies if a tree is non-projective or not."""
@@ -423,55 +532,59 @@ def projective(nodes):
             if (v1 < v3 < v2) and (v4 > v2): return False
     return True
 
-def depenencyGraph(sentence):
+def depenencyGraph(sentence, strings=None):
     """Representation for dependency trees"""
-    leaf = namedtuple('leaf', ['id','form','lemma','tag','ctag','features','parent','pparent', 'drel','pdrel','left','right', 'visit'])
-    PAD = leaf._make([-1,'__PAD__','__PAD__','__PAD__','__PAD__',defaultdict(lambda:'__PAD__'),-1,-1,'__PAD__','__PAD__',[None],[None], False])
-    yield leaf._make([0, 'ROOT_F', 'ROOT_L', 'ROOT_P', 'ROOT_C', defaultdict(str), -1, -1, '__ROOT__', '__ROOT__', PAD, [None], False])
-
+    strings = strings if strings is not None else StringTable()
     if args.isDaemon:
-        for i,w in enumerate(sentence, 1):
-            node = leaf._make([int(i),w,'_','_','_','_',-1,-1,'_','_',[None],[None], False])
-            yield node
-    else:
-        for node in sentence.split("\n"):
-            id_,form,lemma,tag,ctag,features,parent,drel = node.split("\t")[:8]
-            node = leaf._make([int(id_),form,lemma,tag,ctag,features,int(parent),-1,drel,drel,[None],[None], False])
-            yield node
-
-    yield leaf._make([0, 'ROOT_F', 'ROOT_L', 'ROOT_P', 'ROOT_C', defaultdict(str), -1, -1, '__ROOT__', '__ROOT__', [None], [None], False])
-
+        return DependencyGraph.from_words(strings, sentence)
+    rows = []
+    for node in sentence.split("\n"):
+        fields = node.split("\t")
+        id_,form,lemma,tag,ctag,features,parent,drel = fields[:8]
+        ner = fields[args.ner_column] if args.ner_column else '_'
+        rows.append((int(id_),form,lemma,tag,ctag,features,int(parent),drel,ner))
+    return DependencyGraph.from_rows(strings, rows)
+
+
+def read_sentences(fname):
+    """The CONLL sentences of a file, as strings."""
+    with io.open(fname, encoding='utf-8') as fp:
+        return [m.group(1) for m in re.finditer("(.*?)\n\n", fp.read(), re.S)]
 
 def read(fname):
     with io.open(fname, encoding='utf-8') as fp:
         inputGenTrain = re.finditer("(.*?)\n\n", fp.read(), re.S)
 
-    data = []
+    data = Treebank()
     for i,sentence in enumerate(inputGenTrain):
-        graph = list(depenencyGraph(sentence.group(1)))
+        graph = depenencyGraph(sentence.group(1), data.strings)
         try:
-            pgraph = graph[:1]+projectivize(graph[1:-1])+graph[-1:]
+            pgraph = projectivize(graph)
         except:
             sys.stderr.write('Error Sent :: %d\n' %i)
             sys.stdout.flush()
             continue
         data.append(pgraph)
-        for pnode in pgraph[1:-1]:
-            for c in pnode.form:
+        for form in pgraph.words():
+            for c in form:
                 meta.cc[c] += 1
-            plabels.add(pnode.tag)
-            if pnode.parent == 0:
-                tdlabels.add(('LEFTARC', pnode.drel))
-            elif pnode.id < pnode.parent:
-                tdlabels.add(('LEFTARC', pnode.drel))
+        plabels.update(pgraph.token_strings('tags'))
+        nerlabels.update(pgraph.token_strings('ner'))
+        for id_, parent, drel in zip(pgraph.ids[1:-1], pgraph.heads[1:-1], pgraph.token_strings('labels')):
+            if parent == 0:
+                tdlabels.add(('LEFTARC', drel))
+            elif id_ < parent:
+                tdlabels.add(('LEFTARC', drel))
             else:
-                tdlabels.add(('RIGHTARC', pnode.drel))
+                tdlabels.add(('RIGHTARC', drel))
     return data
 
 
 class ArgumentParser():
     def __init__(self):
         self.ud = 1
+        self.beam = 1
+        self.ner_column = None
         self.lang = None
         self.isDaemon = True
 
@@ -497,6 +610,13 @@ if __name__ == "__main__":
     group.add_argument('--load-model', dest='load_model', help='Load Pretrained Model')
     parser.add_argument('--retune-model', dest='retune_model', help='Retune pretrained model')
     parser.add_argument('--output-file', dest='outfile', help='Output File')
+    parser.add_argument('--output-format', dest='output_format', default='conll', choices=['conll', 'conllu', 'auto', 'arrow', 'numpy'],
+                        help='CoNLL-X/CoNLL-U text (gzip/zstd by .gz/.zst name), or a columnar file (see utils.columnarOutput) with --output-file as base name')
+    parser.add_argument('--ner-column', dest='ner_column', type=int, help='0-based CONLL column with NER tags; trains a shared-encoder NER head')
+    parser.add_argument('--beam', type=int, default=1, help='Beam size for decoding (1 = greedy)')
+    parser.add_argument('--export-numpy', dest='export_numpy', action='store_true', help='Export --load-model for DyNet-free inference (tools.numpyParser)')
+    add_arguments(parser)
+    parallel_arguments(parser)
     parser.add_argument('--daemonize', dest='isDaemon', action='store_true', default = False)
     parser.add_argument('--port', type=int, dest='daemonPort', help='Specify a port number')
     args = parser.parse_args()
@@ -507,21 +627,27 @@ if __name__ == "__main__":
     if not args.load_model:
         plabels = set()
         tdlabels = set()
+        nerlabels = set()
         meta.cc = Counter(['bos', 'eos', 'unk'])
         tdlabels.add(('SHIFT', None))
         tdlabels.add(('REDUCE', None))
 
         train_sents = read(args.train)
+        from gensim.models.word2vec import Word2Vec  # training only
         wvm = Word2Vec.load_word2vec_format(args.embd, binary=args.evec)
         meta.w_dim = wvm.syn0.shape[1]
         meta.n_words = wvm.syn0.shape[0]+meta.add_words
 
         meta.i2p = dict(enumerate(plabels))
         meta.i2td = dict(enumerate(tdlabels))
-        meta.p2i = {v: k for k,v in meta.i2p.iteritems()}
-        meta.td2i = {v: k for k,v in meta.i2td.iteritems()}
+        meta.p2i = {v: k for k,v in meta.i2p.items()}
+        meta.td2i = {v: k for k,v in meta.i2td.items()}
         meta.n_outs = len(meta.i2td)
         meta.n_tags = len(meta.p2i)
+        if args.ner_column:
+            meta.i2n = dict(enumerate(nerlabels))
+            meta.n2i = {v: k for k,v in meta.i2n.items()}
+            meta.n_ner = len(meta.i2n)
         meta.c2i = {c: i for i,c in enumerate(meta.cc.keys())}
         meta.n_chars = len(meta.c2i)
 
@@ -533,15 +659,24 @@ if __name__ == "__main__":
         pickle.dump(meta, open('%s.meta' %args.save_model, 'wb'))
     if args.load_model:
         #sys.stderr.write('Loading Models ...\n')
-        parser = Parser(model=args.load_model, test=True)
+        parser = Parser(model=args.load_model)
         #sys.stderr.write('Shoot!\n')
-        POS, UAS, LS, LAS = Test(parser, args.dev)
-        sys.stderr.write("TEST-SET POS: {}%, UAS: {}%, LS: {}% and LAS: {}%\n".format(POS, UAS, LS, LAS))
+        if args.export_numpy:
+            parser.export_numpy(args.load_model)
+        if args.dev:
+            POS, UAS, LS, LAS = Test(parser, args.dev)
+            sys.stderr.write("TEST-SET POS: {}%, UAS: {}%, LS: {}% and LAS: {}%\n".format(POS, UAS, LS, LAS))
     elif args.retune_model:
         parser = Parser(model=args.retune_model)
         trainer = dy.MomentumSGDTrainer(parser.model)
-        train_parser(train_sents)
+        if args.workers > 1:
+            DataParallel(parser.model, args.workers, args.sync_every, args.seed).run(partial(train_parser, train_sents))
+        else:
+            train_parser(train_sents)
     else:
         parser = Parser(meta=meta)
         trainer = dy.MomentumSGDTrainer(parser.model)
-        train_parser(train_sents)
+        if args.workers > 1:
+            DataParallel(parser.model, args.workers, args.sync_every, args.seed).run(partial(train_parser, train_sents))
+        else:
+            train_parser(train_sents)
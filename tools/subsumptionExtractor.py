@@ -5,23 +5,41 @@ import re
 import os
 import sys
 import copy
-import socket
 import timeit
 import pickle
+import random
+import threading
+import multiprocessing
 
 import argparse
 import numpy as np
+from itertools import islice
+from functools import partial
 from collections import namedtuple as nt, defaultdict as dfd, Counter
 
-from scipy.spatial import distance
-
 import dynet as dy
 #from nltk.corpus import stopwords
-from gensim.models.word2vec import *
 from nltk.stem.wordnet import WordNetLemmatizer
 
+from utils.phraseNormalization import PhraseNormalizer, cosine_similarity
+from utils.modelBundle import load_meta, load_parameters
+from utils.resultCache import model_fingerprint, result_key, shared_cache, configure
+from utils.profiling import timed
+from utils.metrics import counter, gauge, histogram, size_histogram, stats_gauges, render, serve
+from utils.trainingSchedule import add_arguments, from_args
+from utils.bulkWriters import TsvWriter, tsv_lines
+from utils.parallelTraining import DataParallel, add_arguments as parallel_arguments
+from utils.serviceProtocol import ServiceServer, pair_handlers
+
 np.random.seed(100)
 _MAX_BUFFER_SIZE_ = 102400
+_model_lock_ = threading.Lock()  # the model is not thread-safe; shared with the ServiceServer handlers
+
+_requests_ = counter('onto_requests_total', 'Client requests served')
+_in_flight_ = gauge('onto_requests_in_flight', 'Client requests being scored')
+_request_seconds_ = histogram('onto_request_seconds', 'Time to serve a client request')
+_request_pairs_ = size_histogram('onto_request_pairs', 'Phrase pairs per client request')
+_pairs_ = counter('onto_pairs_total', 'Phrase pairs scored')
 
 class Meta:
     def __init__(self):
@@ -33,13 +51,35 @@ class Meta:
         self.tdmaps = {"Hypernym": 0, "Unrelated": 1}
 
 class SubsumptionLearning(object):
-    def __init__(self, model=None, meta=None):
-        self.model = dy.Model()
+    def __init__(self, model=None, meta=None, cache_size=100000, mmap=False):
         if model:
-            self.meta = pickle.load(open('%s.meta' %model, 'rb'))
+            self.meta = load_meta(model)
         else:
             self.meta = meta
-    
+
+        self.embeddings = None
+        if mmap:
+            # DyNet-free inference from the exported tables, shared across processes via the page cache
+            self.embeddings = np.load('%s.embd.npy' %model, mmap_mode='r')
+            self.mlp = dict(np.load('%s.mlp.npz' %model).items())
+        else:
+            self.build_model(model)
+
+        self.lmtzr = WordNetLemmatizer()
+        #self.stop = set(stopwords.words('english'))
+        sfile = open("misc/stopwords.txt")
+        self.stop = set([sword.strip() for sword in sfile])
+
+        # lemmatized ids and averaged embedding per distinct phrase (inference only)
+        embed = self.lookup_rows if self.embeddings is None else self.table_rows
+        self.phrases = PhraseNormalizer(self.meta.w2i, self.meta.n_words, self.stop,
+                                        self.lmtzr.lemmatize, embed, cache_size)
+        # predictions of a saved model are cached by content; a model being trained is not
+        self.fingerprint = model_fingerprint(model) if model else None
+
+    def build_model(self, model=None):
+        self.model = dy.Model()
+
         # ndims: hidden x input::[for eachevent in (event1, event2) 100 dims farwordlstmvec, 100 dims backwardlstmvec]
         self.pW1 = self.model.add_parameters((self.meta.n_hidden, self.meta.lstm_word_dim*2)) #2 for pair of events; 2 for forward and backward
         self.pb1 = self.model.add_parameters(self.meta.n_hidden) # ndims: hidden units
@@ -58,15 +98,16 @@ class SubsumptionLearning(object):
         self.CHARS_LOOKUP = self.model.add_lookup_parameters((self.meta.n_chars, self.meta.c_dim))
     
         if not model:
-            for word, V in wvm.vocab.iteritems():
+            for word, V in wvm.vocab.items():
                 self.WORDS_LOOKUP.init_row(V.index, wvm.syn0[V.index])
         if model:
-            self.model.populate('%s.dy' %model)
+            load_parameters(self.model, model)
 
-        self.lmtzr = WordNetLemmatizer()
-        #self.stop = set(stopwords.words('english'))
-        sfile = open("misc/stopwords.txt")
-        self.stop = set([sword.strip() for sword in sfile])
+    def export_tables(self, model):
+        """Writes the word embeddings as float32 `.embd.npy` (loadable with mmap_mode) and the MLP as `.mlp.npz`."""
+        np.save('%s.embd.npy' %model, self.WORDS_LOOKUP.as_array().astype(np.float32))
+        np.savez('%s.mlp.npz' %model, W1=self.pW1.as_array(), b1=self.pb1.as_array(),
+                                      W2=self.pW2.as_array(), b2=self.pb2.as_array())
 
     def initialize_graph_nodes(self, train=False):
         #if not train:
@@ -110,33 +151,102 @@ class SubsumptionLearning(object):
             embs = [emb*(0.4/len(embs[:-1])) for emb in embs[:-1]] + [embs[-1]]
         return embs, flag
 
+    def lookup_rows(self, ids):
+        """Embedding rows of `ids` as a (len(ids), w_dim) array."""
+        return dy.lookup_batch(self.WORDS_LOOKUP, ids).npvalue().reshape(self.meta.w_dim, -1).T
+
+    def table_rows(self, ids):
+        """Embedding rows of `ids` read from the memory-mapped table."""
+        return self.embeddings[ids]
+
+    def classify(self, X):
+        """Relation probabilities for each row of X, a concatenated pair of phrase vectors."""
+        if self.embeddings is None:
+            x = dy.inputTensor(X.T, batched=True)
+            output = dy.softmax(self.W2*(dy.rectify(self.W1*x) + self.b1) + self.b2).npvalue()
+            return output.reshape(self.meta.n_out, -1).T
+        xh = np.maximum(X.dot(self.mlp['W1'].T), 0) + self.mlp['b1']
+        xo = xh.dot(self.mlp['W2'].T) + self.mlp['b2']
+        xo = np.exp(xo - xo.max(axis=1, keepdims=True))
+        return xo / xo.sum(axis=1, keepdims=True)
+
+    def renew_graph(self):
+        if self.embeddings is None:
+            dy.renew_cg()
+            self.initialize_graph_nodes()
+
+    def embed_pair(self, subtype, supertype):
+        """Normalized phrases of a pair, or None if the pair can not be scored."""
+        # lemmatized, stopword-filtered phrases with their averaged embeddings (memoized)
+        subtype = self.phrases.normalize(subtype)
+        supertype = self.phrases.normalize(supertype)
+        if subtype.lemmas == supertype.lemmas:return
+        if not subtype.ids or not supertype.ids: return
+        if (subtype.known is False) or (supertype.known is False): return
+        return subtype, supertype
+
+    @timed('onto.predict_hyp')
     def predict_hyp(self, subtype, supertype):
-        dy.renew_cg()
-        self.initialize_graph_nodes()
-    
-        subtype = [self.lmtzr.lemmatize(sb) for sb in subtype.split() if sb not in self.stop]
-        supertype = [self.lmtzr.lemmatize(sp) for sp in supertype.split() if sp not in self.stop]
-        if subtype == supertype:return
-        # context insensitive embeddings or local embeddings
-        fembs, DSTATUS_X = self.get_linear_embd(subtype)
-        sembs, DSTATUS_Y = self.get_linear_embd(supertype)
-    
-        if len(fembs) < 1 or len(sembs) < 1: return
-        if (DSTATUS_X is False) or (DSTATUS_Y is False): return
-        fembs = fembs[0] if len(fembs) == 1 else dy.average(fembs)
-        sembs = sembs[0] if len(sembs) == 1 else dy.average(sembs)
-    
-        x = dy.concatenate([fembs,sembs])
+        if self.fingerprint is None:
+            return self.score_hyp(subtype, supertype)
+        cache, key = shared_cache(), result_key(self.fingerprint, 'hyp', (subtype, supertype))
+        result = cache.get(key, cache)
+        if result is cache:
+            result = self.score_hyp(subtype, supertype)
+            cache.put(key, result)
+        return result
+
+    def score_hyp(self, subtype, supertype):
+        self.renew_graph()
+        pair = self.embed_pair(subtype, supertype)
+        if pair is None: return
+        subtype, supertype = pair
+
+        x = np.concatenate([subtype.vector, supertype.vector])
         
         #e_dist = dy.squared_distance(fembs, sembs)
         #e_dist = distance.euclidean(fembs.npvalue(), sembs.npvalue())
-        e_dist = 1 - distance.cosine(fembs.npvalue(), sembs.npvalue())
+        e_dist = cosine_similarity(subtype.vector, supertype.vector)
         #weighted_x = x * e_dist
-        output = dy.softmax(self.W2*(dy.rectify(self.W1*x) + self.b1) + self.b2)
-        prediction = np.argmax(output.npvalue())
-        confidence = np.max(output.npvalue())
+        output = self.classify(x[None])[0]
+        prediction = np.argmax(output)
+        confidence = np.max(output)
         return self.meta.rmaps[prediction], confidence, e_dist
 
+    @timed('onto.predict_pairs')
+    def predict_pairs(self, pairs):
+        """
+        Scores both directions of every (first, second) pair in one batched forward pass.
+        Returns (subtype, supertype, relation, confidence, similarity) ordered by the more
+        confident direction (ties go to the given order), or None if the pair can not be scored.
+        Repeated pairs are served from the result cache.
+        """
+        if self.fingerprint is None:
+            return self.batch_pairs(pairs)
+        keys = [result_key(self.fingerprint, 'pairs', pair) for pair in pairs]
+        return shared_cache().map(keys, pairs, self.batch_pairs)
+
+    def batch_pairs(self, pairs):
+        self.renew_graph()
+        embedded = [self.embed_pair(first, second) for first, second in pairs]
+        vectors = [(p.vector, q.vector) for p, q in filter(None, embedded)]
+        if vectors:
+            F, S = map(np.array, zip(*vectors))
+            output = self.classify(np.vstack([np.hstack([F, S]), np.hstack([S, F])]))
+        results, row = list(), 0
+        for (first, second), pair in zip(pairs, embedded):
+            if pair is None:
+                results.append(None)
+                continue
+            e_dist = cosine_similarity(pair[0].vector, pair[1].vector)
+            forward, backward = output[row], output[len(vectors)+row]
+            if forward.max() >= backward.max():
+                results.append((first, second, self.meta.rmaps[np.argmax(forward)], forward.max(), e_dist))
+            else:
+                results.append((second, first, self.meta.rmaps[np.argmax(backward)], backward.max(), e_dist))
+            row += 1
+        return results
+
 def Train(instances, itercount):
     dy.renew_cg()
     ontoparser.initialize_graph_nodes(train=True)
@@ -158,7 +268,7 @@ def Train(instances, itercount):
         x = dy.concatenate([fembs,sembs])
 
         #e_dist = dy.squared_distance(fembs, sembs)
-        e_dist = 1 - distance.cosine(fembs.npvalue(), sembs.npvalue())
+        e_dist = cosine_similarity(fembs.npvalue(), sembs.npvalue())
         #weighted_x = x * e_dist
         output = ontoparser.W2*(dy.rectify(ontoparser.W1*x) + ontoparser.b1) + ontoparser.b2
         
@@ -169,25 +279,42 @@ def Train(instances, itercount):
         errors += 0 if groundtruth == ontoparser.meta.rmaps[prediction] else 1
     return loss, errors
 
-def nntraining(dataset):
+def nntraining(dataset, par=None):
+    """Trains on `dataset`, or on this worker's shards of it when called by DataParallel.run."""
     sys.stderr.write("Started training ...\n")
     sys.stderr.write("Training Examples: %s Classes: %s\n" % (len(dataset), len(ontoparser.meta.tdmaps)))
-    for epoch in range(15):#args.epochs):
-        np.random.shuffle(dataset)
+    make_schedule = lambda: from_args(args, evaluate, inputGenDev, ontoparser.model, ontoparser.meta)
+    schedule = make_schedule() if par is None else par.schedule(make_schedule)
+    for epoch in range(args.epochs):
+        if par is None:
+            np.random.shuffle(dataset)
+            shard = dataset
+        else:
+            shard = par.shard(dataset, epoch)
         errors = 0
         batchSize = 30
-        for instance in range(0,len(dataset), 30):
-            loss, error = Train(dataset[instance:instance+batchSize], epoch+1)
-            if not loss: continue
-            errors += error
-            cumulativeloss = dy.esum(loss)
-            _ = cumulativeloss.scalar_value()
-            cumulativeloss.backward()
-            trainer.update()
-        
-        accuracy = Test(inputGenDev)
-        ontoparser.model.save('%s.dy' %args.save_model)
-    sys.stderr.write("Epoch:: %s Loss:: %s Test Accuracy:: %s\n" % (epoch+1, 100.*errors/len(dataset), accuracy))
+        for instance in range(0,len(shard), batchSize):
+            batch = shard[instance:instance+batchSize]
+            loss, error = Train(batch, epoch+1)
+            if loss:
+                errors += error
+                cumulativeloss = dy.esum(loss)
+                _ = cumulativeloss.scalar_value()
+                cumulativeloss.backward()
+                trainer.update()
+            if schedule.step(len(batch)):  # also for empty losses: workers must step alike
+                break
+        sys.stderr.write("Epoch:: %s Loss:: %s\n" % (epoch+1, 100.*errors/len(shard)))
+        if schedule.stopped or schedule.epoch_end():
+            break
+    schedule.close()
+
+def evaluate(instances):
+    """Mean per-class accuracy on dev instances."""
+    ontoparser.phrases.clear()  # embeddings were updated since the last evaluation
+    accuracy = Test(instances)
+    sys.stderr.write("Test Accuracy:: %s\n" % accuracy)
+    return np.mean([acc for label, acc in accuracy])
 
 
 def Test(dataset):
@@ -199,7 +326,7 @@ def Test(dataset):
         groundtruth = "Hypernym" if groundtruth == "True" else "Unrelated"
         inst[groundtruth] += 1
         try:
-            prediction, confidence, edist = predict_hyp(subtype, supertype)
+            prediction, confidence, edist = ontoparser.predict_hyp(subtype, supertype)
             #print subtype, supertype, prediction, groundtruth, edist
         except TypeError:
             continue
@@ -209,7 +336,7 @@ def Test(dataset):
             hits[groundtruth][-1] += 1
     #return [(hit, 100.*hits[hit]/inst[hit]) for hit in hits if inst[hit]]
     total = sum(hits['Hypernym']+hits['Unrelated'])
-    return [(hit, 100.*hits[hit][0]/sum(hits[hit])) for hit in hits]
+    return [(hit, 100.*hits[hit][0]/sum(hits[hit])) for hit in hits if sum(hits[hit])]
 
 def read(inputGenTrain):
     global train_sents, meta, plabels, tdlabels
@@ -218,36 +345,112 @@ def read(inputGenTrain):
         train_sents.append((firstW, secondW, "Hypernym" if rel == "True" else "Unrelated"))
         meta.cc.update(firstW+secondW)
 
-def processInput(ifp, ofp):
-    #dy.renew_cg()
-    #ontoparser.initialize_graph_nodes()
-    for line in ifp:
-        if not line.strip():continue
-        subtype, supertype = line.strip().split('\t')
-        predictions = list()
-        for pair in [(subtype, supertype), (supertype, subtype)]:
-            try:
-                prediction, confidence, distance = predict_hyp(pair[0], pair[1])
-                predictions.append((subtype, supertype, prediction, confidence, distance))
-            except:
-                continue
-        if len(predictions) < 2:continue
-        if predictions[0][3] >= predictions[1][3]:
-            subtype, supertype, prediction, confidence, distance = predictions[0]
-            ofp.write("%s\t%s\t%s\t%s\t%s\n" % (subtype, supertype, prediction, str(confidence), str(distance)))
+def read_chunks(ifp, chunk_size):
+    """Yields lists of at most `chunk_size` (first, second) pairs from a TSV stream."""
+    while True:
+        lines = list(islice(ifp, chunk_size))
+        if not lines: return
+        yield [tuple(line.strip().split('\t')) for line in lines if line.strip()]
+
+def score_chunk(pairs):
+    """Scores a chunk of pairs in one batch; returns the pair count and the formatted output lines."""
+    predictions = ontoparser.predict_pairs(pairs)
+    return len(pairs), tsv_lines([p for p in predictions if p is not None])
+
+def processInput(ifp, ofp, chunk_size=1000):
+    n_pairs = 0
+    for pairs in read_chunks(ifp, chunk_size):
+        count, output = score_chunk(pairs)
+        ofp.write(output)
+        n_pairs += count
+    return n_pairs
+
+def init_worker(model, mmap, cache_size, result_cache=None):
+    global ontoparser
+    configure(cache_size, result_cache)  # own sqlite connection per process
+    ontoparser = SubsumptionLearning(model=model, mmap=mmap, cache_size=cache_size)
+
+def score_pairs(ifile, ofile, chunk_size, workers=1):
+    """
+    Streams a TSV pair file through the model chunk by chunk and writes the results in input order.
+    With several workers, at most 2*workers chunks are in flight so memory stays bounded.
+    """
+    pool = None
+    start = timeit.default_timer()
+    with io.open(ifile, encoding='utf-8') as ifp, TsvWriter(ofile) as ofp:
+        chunks = read_chunks(ifp, chunk_size)
+        if workers > 1:
+            window = threading.BoundedSemaphore(2*workers)
+            def throttled(chunks):
+                for chunk in chunks:
+                    window.acquire()
+                    yield chunk
+            pool = multiprocessing.Pool(workers, init_worker, (args.load_model, args.mmap, args.cache_size, args.result_cache))
+            scored = pool.imap(score_chunk, throttled(chunks))
         else:
-            subtype, supertype, prediction, confidence, distance = predictions[1]
-            ofp.write("%s\t%s\t%s\t%s\t%s\n" % (subtype, supertype, prediction, str(confidence), str(distance)))
+            scored = map(score_chunk, chunks)
+        n_pairs = 0
+        for count, output in scored:
+            if pool: window.release()
+            ofp.write(output)
+            n_pairs += count
+            elapsed = timeit.default_timer() - start
+            sys.stderr.write("Scored %d pairs (%.1f pairs/sec)\r" % (n_pairs, n_pairs/elapsed))
+            sys.stderr.flush()
+    if pool:
+        pool.close()
+        pool.join()
+    sys.stderr.write("\n")
+    return n_pairs
 
 def run_client(ip, port, clientsocket):
-    data = clientsock.recv(_MAX_BUFFER_SIZE_)
-    fakeInputFile = StringIO.StringIO(data)
-    fakeOutputFile = StringIO.StringIO("")
-    processInput(fakeInputFile, fakeOutputFile)
-    fakeInputFile.close()
-    clientsocket.send(fakeOutputFile.getvalue())
-    fakeOutputFile.close()
-    clientsocket.close()
+    data = clientsocket.recv(_MAX_BUFFER_SIZE_)
+    if data.strip() == b'STATS':  # metrics in the Prometheus text format
+        clientsocket.sendall(render().encode('utf-8'))
+        clientsocket.close()
+        return
+    started = timeit.default_timer()
+    _in_flight_.inc()
+    n_pairs = 0
+    try:
+        fakeInputFile = io.StringIO(data.decode('utf-8'))
+        fakeOutputFile = io.StringIO()
+        with _model_lock_:
+            n_pairs = processInput(fakeInputFile, fakeOutputFile)
+        fakeInputFile.close()
+        clientsocket.sendall(fakeOutputFile.getvalue().encode('utf-8'))
+        fakeOutputFile.close()
+    finally:
+        clientsocket.close()
+        _in_flight_.dec()
+        _requests_.inc()
+        _pairs_.inc(n_pairs)
+        _request_pairs_.observe(n_pairs)
+        _request_seconds_.observe(timeit.default_timer()-started)
+
+def predict_hyps(pairs):
+    """predict_hyp over (subtype, supertype) pairs, as (subtype, supertype, relation, confidence, similarity) or None."""
+    predictions = [ontoparser.predict_hyp(first, second) for first, second in pairs]
+    return [(first, second) + tuple(p) if p is not None else None for (first, second), p in zip(pairs, predictions)]
+
+def observed(score, pairs):
+    """Runs `score` on the pairs of a framed request, counted like a client request."""
+    started = timeit.default_timer()
+    _in_flight_.inc()
+    try:
+        return score(pairs)
+    finally:
+        _in_flight_.dec()
+        _requests_.inc()
+        _pairs_.inc(len(pairs))
+        _request_pairs_.observe(len(pairs))
+        _request_seconds_.observe(timeit.default_timer()-started)
+
+def model_bytes(model):
+    """Bytes of the embedding table and MLP of a loaded model."""
+    if model.embeddings is not None:
+        return model.embeddings.nbytes + sum(v.nbytes for v in model.mlp.values())
+    return 4*sum(np.prod(p.shape()) for p in model.model.parameters_list() + model.model.lookup_parameters_list())
 
 
 if __name__ == "__main__":
@@ -256,27 +459,45 @@ if __name__ == "__main__":
     parser.add_argument('--dynet-mem')
     parser.add_argument('--dynet-seed', dest='seed', type=int)
     parser.add_argument('--trainer', help='NN Optimizer [simsgd|momsgd|adam|adadelta|adagrad]', default='momsgd')
-    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--epochs', type=int, default=15)
     parser.add_argument('--ebin', type=int, default=1, help='1 if binary embeddings else 0')
     parser.add_argument('--train', help="<train-file>")
     parser.add_argument('--dev', help="<development-file>")
     parser.add_argument('--embedding', help="<word2vec-embedding>")
+    add_arguments(parser)
     group.add_argument('--save-model', dest='save_model')
     group.add_argument('--load-model', dest='load_model')
     parser.add_argument('-d', '--daemonize', dest='isDaemon', help='Daemonize me?', action='store_true', default = False)
     parser.add_argument('-p', '--port', type=int, dest='daemonPort', help='Specify a port number')
+    parser.add_argument('--metrics-port', type=int, dest='metricsPort', help='Serve Prometheus metrics over HTTP on this port')
+    parser.add_argument('--mmap', action='store_true', help='Infer with NumPy from the memory-mapped tables of --load-model')
+    parser.add_argument('--export-tables', dest='export_tables', action='store_true', help='Export embedding/MLP tables for --mmap')
+    parser.add_argument('--score-pairs', dest='score_pairs', help='<pair-file> to score with --load-model (streamed)')
+    parser.add_argument('--out', help='<output-file> for --score-pairs (gzip/zstd by .gz/.zst name, - for stdout)')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=10000, help='Pairs scored per batch')
+    parser.add_argument('--workers', type=int, default=1, help='Processes scoring chunks in parallel, or training model replicas')
+    parallel_arguments(parser, workers=False)
+    parser.add_argument('--phrase-cache', type=int, dest='cache_size', default=100000, help='Max. phrases kept in the normalization cache')
+    parser.add_argument('--result-cache', dest='result_cache', help='sqlite file keeping predictions across runs')
     args = parser.parse_args()
+    if args.mmap and not args.load_model:
+        parser.error('--mmap needs the tables of --load-model')
+    if args.score_pairs and args.workers > 1 and not args.load_model:
+        parser.error('--score-pairs with --workers > 1 needs --load-model: the workers load the model themselves')
     np.random.seed(args.seed)
     random.seed(args.seed)
 
     if args.dev:
         with io.open(args.dev, encoding='utf-8') as fp:
             inputGenDev = fp.readlines()
+    if args.result_cache:
+        configure(args.cache_size, args.result_cache)
 
     meta = Meta()
     if not args.load_model:
         with io.open(args.train, encoding='utf-8') as fp:
             inputGenTrain = fp.readlines()
+        from gensim.models.word2vec import Word2Vec  # training only
         try:
             wvm = Word2Vec.load_word2vec_format(args.embedding, binary=True)#args.ebin)
         except:
@@ -307,9 +528,12 @@ if __name__ == "__main__":
     if args.save_model:
         pickle.dump(meta, open('%s.meta' %args.save_model, 'wb'))
     if args.load_model:
-        ontoparser = SubsumptionLearning(model=args.load_model)
+        # only the workers score when the parent has nothing else to do with the model
+        workers_only = args.score_pairs and args.workers > 1 and not (args.dev or args.isDaemon or args.export_tables)
+        if not workers_only:
+            ontoparser = SubsumptionLearning(model=args.load_model, cache_size=args.cache_size, mmap=args.mmap)
     else:
-        ontoparser = SubsumptionLearning(meta=meta)
+        ontoparser = SubsumptionLearning(meta=meta, cache_size=args.cache_size)
         trainers = {
             'momsgd'  : dy.MomentumSGDTrainer(ontoparser.model, edecay=0.25),
             'adam'    : dy.AdamTrainer(ontoparser.model, edecay=0.25),
@@ -318,25 +542,30 @@ if __name__ == "__main__":
             'adadelta' : dy.AdadeltaTrainer(ontoparser.model, edecay=0.25)
             }
         trainer = trainers[args.trainer]
-        nntraining(train_sents)
+        if args.workers > 1:
+            DataParallel(ontoparser.model, args.workers, args.sync_every, args.seed).run(partial(nntraining, train_sents))
+        else:
+            nntraining(train_sents)
+
+    if args.export_tables:
+        ontoparser.export_tables(args.load_model or args.save_model)
 
     if args.dev:
         accuracy = Test(inputGenDev)
         sys.stdout.write("Accuracy: {}%\n".format(accuracy))
+        sys.stderr.write("Phrase cache: {}\n".format(ontoparser.phrases.stats()))
+        sys.stderr.write("Result cache: {}\n".format(shared_cache().stats()))
 
-    if args.isDaemon and args.daemonPort:
-        sys.stderr.write('Leastening at port %d\n' %args.daemonPort)
-        host = "0.0.0.0" #Listen on all interfaces
-        port = args.daemonPort #Port number
-
-        tcpsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        tcpsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-        tcpsock.bind((host,port))
+    if args.score_pairs:
+        score_pairs(args.score_pairs, args.out, args.chunk_size, args.workers)
 
-        while True:
-            tcpsock.listen(4)
-            #print "nListening for incoming connections..."
-            (clientsock, (ip, port)) = tcpsock.accept()
-
-            run_client(ip, port, clientsock)
+    if args.isDaemon and args.daemonPort:
+        gauge('onto_model_bytes', 'Memory of the embedding table and MLP', lambda: model_bytes(ontoparser))
+        stats_gauges('onto_phrase_cache', ontoparser.phrases.stats)
+        if args.metricsPort:
+            serve(args.metricsPort)
+        sys.stderr.write('Listening at port %d\n' %args.daemonPort)
+        # framed clients (utils.serviceClient) keep their connection; others get one TSV exchange
+        handlers = pair_handlers(partial(observed, ontoparser.predict_pairs), partial(observed, predict_hyps), render)
+        server = ServiceServer(("0.0.0.0", args.daemonPort), handlers, legacy=run_client, lock=_model_lock_)
+        server.serve_forever()
@@ -5,14 +5,28 @@ import re
 import sys
 import math
 import string
+import timeit
 import random
 import pickle
 from argparse import ArgumentParser
+from functools import partial
 from collections import Counter, defaultdict
 
 import dynet as dy
 import numpy as np
-from gensim.models.word2vec import Word2Vec
+
+from utils.modelBundle import load_meta, load_parameters
+from utils.vocabIds import VocabEncoder
+from utils.resultCache import model_fingerprint, result_key, shared_cache
+from utils.profiling import timer, timed
+from utils.metrics import counter, histogram
+from utils.trainingSchedule import add_arguments, from_args
+from utils.parallelTraining import DataParallel, add_arguments as parallel_arguments
+from utils.bulkWriters import TaggedWriter
+
+_sentences_ = counter('tagger_sentences_total', 'Sentences tagged (cache misses)')
+_batch_seconds_ = histogram('tagger_batch_seconds', 'Time to tag one batch')
+
 
 class Meta:
     def __init__(self):
@@ -27,12 +41,12 @@ class Tagger():
     def __init__(self, model=None, meta=None):
         self.model = dy.Model()
         if model:
-            self.meta = pickle.load(open('%s.meta' %model, 'rb'))
+            self.meta = load_meta(model)
         else:
             self.meta = meta
         self.WORDS_LOOKUP = self.model.add_lookup_parameters((self.meta.n_words, self.meta.w_dim))
         if not model:
-            for word, V in wvm.vocab.iteritems():
+            for word, V in wvm.vocab.items():
                 self.WORDS_LOOKUP.init_row(V.index+self.meta.add_words, wvm.syn0[V.index])
 
         self.CHARS_LOOKUP = self.model.add_lookup_parameters((self.meta.n_chars, self.meta.c_dim))
@@ -53,18 +67,18 @@ class Tagger():
         self.cfwdRNN = dy.LSTMBuilder(1, self.meta.c_dim, self.meta.lstm_char_dim, self.model)
         self.cbwdRNN = dy.LSTMBuilder(1, self.meta.c_dim, self.meta.lstm_char_dim, self.model)
         if model:
-            self.model.populate('%s.dy' %model)
+            load_parameters(self.model, model)
+        self.encoder = VocabEncoder(self.meta.w2i, self.meta.c2i, self.meta.cc)
+        # results of a saved model are cached by content; a model being trained is not
+        self.fingerprint = model_fingerprint(model) if model else None
 
-    def word_rep(self, word):
+    def word_rep(self, idx):
         if not self.eval and random.random() < 0.25:
             return self.WORDS_LOOKUP[0]
-        idx = self.meta.w2i.get(word, self.meta.w2i.get(word.lower(), 0))
-        return self.WORDS_LOOKUP[idx]
+        return self.WORDS_LOOKUP[int(idx)]
     
-    def char_rep(self, w, f, b):
-        bos, eos, unk = self.meta.c2i["bos"], self.meta.c2i["eos"], self.meta.c2i["unk"]
-        char_ids = [bos] + [self.meta.c2i[c] if self.meta.cc[c]>5 else unk for c in w] + [eos]
-        char_embs = [self.CHARS_LOOKUP[cid] for cid in char_ids]
+    def char_rep(self, char_ids, f, b):
+        char_embs = [self.CHARS_LOOKUP[int(cid)] for cid in char_ids]
         fw_exps = f.transduce(char_embs)
         bw_exps = b.transduce(reversed(char_embs))
         return dy.concatenate([ fw_exps[-1], bw_exps[-1] ])
@@ -87,7 +101,7 @@ class Tagger():
         self.cfwdRNN.disable_dropout()
         self.cbwdRNN.disable_dropout()
 
-    def build_tagging_graph(self, words):
+    def initialize_graph_nodes(self):
         dy.renew_cg()
         # parameters -> expressions
         self.w1 = dy.parameter(self.W1)
@@ -102,29 +116,35 @@ class Tagger():
             self.enable_dropout()
 
         # initialize the RNNs
-        f_init = self.fwdRNN.initial_state()
-        b_init = self.bwdRNN.initial_state()
-        f2_init = self.fwdRNN2.initial_state()
-        b2_init = self.bwdRNN2.initial_state()
+        self.f_init = self.fwdRNN.initial_state()
+        self.b_init = self.bwdRNN.initial_state()
+        self.f2_init = self.fwdRNN2.initial_state()
+        self.b2_init = self.bwdRNN2.initial_state()
     
         self.cf_init = self.cfwdRNN.initial_state()
         self.cb_init = self.cbwdRNN.initial_state()
-    
+
+    @timed('tagger.graph')
+    def build_tagging_graph(self, ids, renew=True):
+        """`ids` is the utils.vocabIds.SentenceIds of a sentence."""
+        if renew:
+            self.initialize_graph_nodes()
+
         # get the word vectors. word_rep(...) returns a 128-dim vector expression for each word.
-        wembs = [self.word_rep(w) for w in words]
-        cembs = [self.char_rep(w, self.cf_init, self.cb_init) for w in words]
+        wembs = [self.word_rep(idx) for idx in ids.words]
+        cembs = [self.char_rep(ids.word_chars(i), self.cf_init, self.cb_init) for i in range(len(ids.words))]
         xembs = [dy.concatenate([w, c]) for w,c in zip(wembs, cembs)]
     
         # feed word vectors into biLSTM
-        fw_exps = f_init.transduce(xembs)
-        bw_exps = b_init.transduce(reversed(xembs))
+        fw_exps = self.f_init.transduce(xembs)
+        bw_exps = self.b_init.transduce(reversed(xembs))
     
         # biLSTM states
         bi_exps = [dy.concatenate([f,b]) for f,b in zip(fw_exps, reversed(bw_exps))]
 
         # feed word vectors into biLSTM
-        fw_exps = f2_init.transduce(bi_exps)
-        bw_exps = b2_init.transduce(reversed(bi_exps))
+        fw_exps = self.f2_init.transduce(bi_exps)
+        bw_exps = self.b2_init.transduce(reversed(bi_exps))
     
         # biLSTM states
         bi_exps = [dy.concatenate([f,b]) for f,b in zip(fw_exps, reversed(bw_exps))]
@@ -138,26 +158,68 @@ class Tagger():
     
         return exps
     
-    def sent_loss(self, words, tags):
+    def sent_loss(self, ids, tags, renew=True):
         self.eval = False
-        vecs = self.build_tagging_graph(words)
+        vecs = self.build_tagging_graph(ids, renew)
         errs = []
         for v,t in zip(vecs,tags):
             tid = self.meta.t2i[t]
             err = dy.pickneglogsoftmax(v, tid)
             errs.append(err)
         return dy.esum(errs)
+
+    def batch_loss(self, batch):
+        """Summed loss of a minibatch of (ids, tags) in one graph (autobatched by DyNet if enabled)."""
+        self.eval = False
+        self.initialize_graph_nodes()
+        return dy.esum([self.sent_loss(ids, tags, renew=False) for ids, tags in batch])
     
-    def tag_sent(self, words):
+    def tag_ids(self, ids):
         self.eval = True
-        vecs = self.build_tagging_graph(words)
+        vecs = self.build_tagging_graph(ids)
         vecs = [dy.softmax(v) for v in vecs]
-        probs = [v.npvalue() for v in vecs]
+        with timer('tagger.forward'):  # DyNet runs the LSTMs lazily, on readback
+            probs = [v.npvalue() for v in vecs]
         tags = []
         for prb in probs:
             tag = np.argmax(prb)
             tags.append(self.meta.i2t[tag])
-        return zip(words, tags)
+        return tags
+
+    def tag_sent(self, words):
+        return self.tag_batch([words])[0]
+
+    def tag_batch(self, sentences):
+        """Tags a batch of sentences; repeated sentences are served from the result cache."""
+        if self.fingerprint is None:
+            tags = self.batch_tags(sentences)
+        else:
+            keys = [result_key(self.fingerprint, 'tags', words) for words in sentences]
+            tags = shared_cache().map(keys, sentences, self.batch_tags)
+        return [list(zip(words, stags)) for words, stags in zip(sentences, tags)]
+
+    def batch_tags(self, sentences):
+        """Tag tuples of a batch of sentences."""
+        started = timeit.default_timer()
+        tagged = self.tag_ids_batch([self.encoder.encode(words) for words in sentences])
+        _sentences_.inc(len(sentences))
+        _batch_seconds_.observe(timeit.default_timer()-started)
+        return tagged
+
+    def tag_ids_batch(self, batch):
+        """Tag tuples of a batch of SentenceIds from one graph and one forward pass (autobatched by DyNet if enabled)."""
+        self.eval = True
+        self.initialize_graph_nodes()
+        vecs = [dy.softmax(v) for ids in batch if len(ids.words)
+                for v in self.build_tagging_graph(ids, renew=False)]
+        with timer('tagger.forward'):  # DyNet runs the LSTMs lazily, on readback
+            probs = dy.concatenate_cols(vecs).npvalue().reshape(-1, len(vecs), order='F').T if vecs else []
+        tagged, start = [], 0
+        for ids in batch:
+            n = len(ids.words)
+            tagged.append(tuple(self.meta.i2t[np.argmax(prb)] for prb in probs[start:start+n]))
+            start += n
+        return tagged
 
 def read(fname):
     data = []
@@ -175,52 +237,73 @@ def read(fname):
     if sent: data.append(sent)
     return data
 
-def eval(dev, ofile=None):
+def evaluate(dev, batch_size=64, ofile=None):
+    """Token and sentence accuracy on (ids, golds) pairs, tagged in length-sorted batches."""
     good_sent = bad_sent = good = bad = 0.0
     gall, pall = [], []
     #ofp = open(ofile, 'w')
-    for sent in dev:
-        words, golds = zip(*sent)
-        tags = [t for w,t in tagger.tag_sent(words)]
-        #ofp.write('\n'.join(tags)+'\n\n')
-        #pall.extend(tags)
-        if list(tags) == list(golds): good_sent += 1
-        else: bad_sent += 1
-        for go,gu in zip(golds,tags):
-            if go == gu: good += 1
-            else: bad += 1
+    for batch in minibatches(dev, batch_size, shuffle=False):
+        for (ids, golds), tags in zip(batch, tagger.tag_ids_batch([ids for ids, golds in batch])):
+            #ofp.write('\n'.join(tags)+'\n\n')
+            #pall.extend(tags)
+            if list(tags) == list(golds): good_sent += 1
+            else: bad_sent += 1
+            for go,gu in zip(golds,tags):
+                if go == gu: good += 1
+                else: bad += 1
     #print(cr(gall, pall, digits=4))
     print(good/(good+bad), good_sent/(good_sent+bad_sent))
     return good/(good+bad)
 
-def train_tagger(train):
-    pr_acc = 0.0
+def minibatches(data, batch_size, shuffle=True):
+    """Batches of `batch_size` sentences of similar length, in random order if `shuffle`."""
+    order = sorted(range(len(data)), key=lambda i: (len(data[i][1]), random.random() if shuffle else i))
+    batches = [[data[i] for i in order[k:k+batch_size]] for k in range(0, len(order), batch_size)]
+    if shuffle:
+        random.shuffle(batches)
+    return batches
+
+def train_tagger(train, par=None):
+    """Trains on `train`, or on this worker's shards of it when called by DataParallel.run."""
     num_tagged, cum_loss = 0, 0
-    for ITER in xrange(args.iter):
-        save = False
-        random.shuffle(train)
-        for i,s in enumerate(train, 1):
-            if i > 0 and i % 500 == 0:   # print status
-                trainer.status()
-                print(cum_loss / num_tagged)
-                cum_loss, num_tagged = 0, 0
-            words, golds = zip(*s)
-            loss_exp =  tagger.sent_loss(words, golds)
+    make_schedule = lambda: from_args(args, lambda items: evaluate(items, args.eval_batch_size), dev, tagger.model, tagger.meta)
+    schedule = make_schedule() if par is None else par.schedule(make_schedule)
+    for ITER in range(args.iter):
+        started, epoch_tokens, seen = timeit.default_timer(), 0, 0
+        shard = train if par is None else par.shard(train, ITER)
+        for batch in minibatches(shard, args.batch_size):
+            loss_exp = tagger.batch_loss(batch)
             cum_loss += loss_exp.scalar_value()
-            num_tagged += len(golds)
+            n_tokens = sum(len(golds) for ids, golds in batch)
+            num_tagged += n_tokens
+            epoch_tokens += n_tokens
             loss_exp.backward()
             trainer.update()
-        print("epoch %r finished" % ITER)
-        new_acc = eval(dev)
-        if new_acc > pr_acc:
-            pr_acc = new_acc
-            save = True
-        if save:
-            print('Save Point:: %d' %ITER)
-            if args.save_model:
-                tagger.model.save('%s.dy' %args.save_model)
-            save = False
+            seen += len(batch)
+            if seen // 500 > (seen-len(batch)) // 500:   # print status every 500 sentences
+                trainer.status()
+                print(cum_loss / num_tagged)
+                cum_loss, num_tagged = 0, 0
+            if schedule.step(len(batch)):
+                break
+        elapsed = timeit.default_timer() - started
+        print("epoch %r finished (%.1f tokens/sec%s)" % (ITER, epoch_tokens/elapsed, '' if par is None else ' in worker %d' % par.rank))
         sys.stdout.flush()
+        if schedule.stopped or schedule.epoch_end():
+            break
+    schedule.close()
+
+def write_tagged(data, fname, batch_size=64):
+    """Tags the sentences of `data` and writes them as `id word tag` TSV."""
+    sentences = [[w for w,p in sent] for sent in data]
+    with TaggedWriter(fname) as writer:
+        for k in range(0, len(sentences), batch_size):
+            for tagged in tagger.tag_batch(sentences[k:k+batch_size]):
+                writer.write_sentence(tagged)
+
+def encode(data):
+    """(word/char ids, gold tags) of every sentence, computed once for all epochs."""
+    return [(tagger.encoder.encode([w for w,p in sent]), [p for w,p in sent]) for sent in data]
 
 def get_cc(data):
     tags, chars = set(), set()
@@ -251,7 +334,12 @@ if __name__ == '__main__':
     parser.add_argument('--trainer')
     parser.add_argument('--pos', type=int)
     parser.add_argument('--iter', type=int, default=500)
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=1, help='Sentences of similar length per update (use with --dynet-autobatch 1)')
+    parser.add_argument('--eval-batch-size', dest='eval_batch_size', type=int, default=64, help='Sentences per batch when tagging the dev set')
     parser.add_argument('--evec', type=int)
+    parser.add_argument('--output-file', dest='outfile', help='Write the tagged --dev file (with --load-model; gzip/zstd by .gz/.zst name)')
+    add_arguments(parser)
+    parallel_arguments(parser)
     group.add_argument('--save-model', dest='save_model')
     group.add_argument('--load-model', dest='load_model')
     args = parser.parse_args()
@@ -263,6 +351,7 @@ if __name__ == '__main__':
         dev = read(args.dev)
     if not args.load_model: 
         train = read(args.train)
+        from gensim.models.word2vec import Word2Vec  # training only
         wvm = Word2Vec.load_word2vec_format(args.embd, binary=args.evec)
         meta.w_dim = wvm.syn0.shape[1]
         meta.n_words = wvm.syn0.shape[0]+meta.add_words
@@ -276,8 +365,14 @@ if __name__ == '__main__':
         pickle.dump(meta, open('%s.meta' %args.save_model, 'wb'))
     if args.load_model:
         tagger = Tagger(model=args.load_model)
-        eval(dev) 
+        evaluate(encode(dev), args.eval_batch_size)
+        if args.outfile:
+            write_tagged(dev, args.outfile, args.eval_batch_size)
     else:
         tagger = Tagger(meta=meta)
         trainer = dy.MomentumSGDTrainer(tagger.model)
-        train_tagger(train)
+        dev = encode(dev)
+        if args.workers > 1:
+            DataParallel(tagger.model, args.workers, args.sync_every, args.seed).run(partial(train_tagger, encode(train)))
+        else:
+            train_tagger(encode(train))
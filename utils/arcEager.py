@@ -25,6 +25,10 @@
 import numpy as np
 
 class ArcEager(object):
+    """
+    Arc-eager transitions over a configuration whose `nodes` is a columnar
+    utils.dependencyGraph.DependencyGraph; arcs are written to its pheads/plabels.
+    """
     
     def SHIFT(self, configuration, label=None):
         """
@@ -40,16 +44,9 @@ class ArcEager(object):
         """
         b0 = configuration.b0
         s0 = configuration.stack[-1]
-        s0N = configuration.nodes[s0]
-        b0N = configuration.nodes[b0]
-    
-        configuration.nodes[b0] = configuration.nodes[b0]._replace(pparent=s0N.id, pdrel=label)
-        if b0 < s0:
-            configuration.nodes[s0] = configuration.nodes[s0]._replace(left=configuration.nodes[s0].left+[b0])
-        else:
-            configuration.nodes[s0] = configuration.nodes[s0]._replace(right=configuration.nodes[s0].right+[b0])
-            configuration.stack.append(b0)
-            configuration.b0 = b0+1
+        configuration.nodes.set_head(b0, configuration.nodes.ids[s0], label)
+        configuration.stack.append(b0)
+        configuration.b0 = b0+1
     
     def LEFTARC(self, configuration, label=None):
         """
@@ -57,13 +54,7 @@ class ArcEager(object):
         """
         b0 = configuration.b0
         s0 = configuration.stack.pop()
-        s0N = configuration.nodes[s0]
-        b0N = configuration.nodes[b0]
-        configuration.nodes[s0] = configuration.nodes[s0]._replace(pparent=b0N.id, pdrel=label)
-        if s0 < b0:
-            configuration.nodes[b0] = configuration.nodes[b0]._replace(left=configuration.nodes[b0].left+[s0])
-        else:
-            configuration.nodes[b0] = configuration.nodes[b0]._replace(right=configuration.nodes[b0].right+[s0])
+        configuration.nodes.set_head(s0, configuration.nodes.ids[b0], label)
     
     def REDUCE(self, configuration, label=None):
         """
@@ -78,37 +69,75 @@ class ArcEager(object):
         consumed and both the stack and queue are empty.
         """
         b0 = configuration.b0
-        return (len(configuration.stack) == 0) and (len(configuration.nodes[b0:]) == 1)
+        return (len(configuration.stack) == 0) and (b0 == len(configuration.nodes)-1)
     
     def get_valid_transitions(self, configuration):
         moves = {0:self.SHIFT,1:self.LEFTARC,2:self.RIGHTARC,3:self.REDUCE}
         allmoves = {0:self.SHIFT,1:self.LEFTARC,2:self.RIGHTARC,3:self.REDUCE}
         b0 = configuration.b0
-        if len(configuration.nodes[b0:])==1:
-            assert(configuration.nodes[b0].id == 0)
+        pheads = configuration.nodes.pheads
+        if b0 == len(configuration.nodes)-1:
+            assert(configuration.nodes.ids[b0] == 0)
             del moves[0]
             del moves[2]
     
         if len(configuration.stack) == 0: del moves[3]
-        elif (configuration.nodes[b0:]):
-            if configuration.nodes[configuration.stack[-1]].pparent == -1: del moves[3]
+        elif pheads[configuration.stack[-1]] == -1: del moves[3]
     
         if len(configuration.stack) < 1:
             del moves[1]
             del moves[2]
         else:
-            if configuration.nodes[configuration.stack[-1]].pparent > -1: del moves[1] #['LEFTARC'] # if s0 has parent no LEFT ARC
-            if configuration.nodes[b0].pparent > -1: del moves[2] #['RIGHTARC'] # b0 has parent no RIGHT ARC unnecessary condition
+            if pheads[configuration.stack[-1]] > -1: del moves[1] #['LEFTARC'] # if s0 has parent no LEFT ARC
+            if pheads[b0] > -1: del moves[2] #['RIGHTARC'] # b0 has parent no RIGHT ARC unnecessary condition
         return moves, allmoves
     
+    def build_transition_masks(self, i2td, transitions):
+        """Boolean masks over the labeled transitions, one row per transition type."""
+        masks = np.zeros((len(transitions), len(i2td)), dtype=bool)
+        for action, (transition, label) in i2td.items():
+            masks[transitions[transition], action] = True
+        return masks
+
+    def valid_mask(self, masks, valid_transitions):
+        return masks[list(valid_transitions)].any(axis=0)
+
+    def zero_cost_mask(self, configuration, masks, td2i, transitions, valid_transitions):
+        """
+        Labeled transitions with zero cost under the dynamic oracle. The label only matters
+        through the gold label of s0 (LEFTARC) or b0 (RIGHTARC), so each valid transition
+        type needs at most two cost computations instead of one per label.
+        """
+        mask = np.zeros(masks.shape[1], dtype=bool)
+        for transition, tid in transitions.items():
+            if tid not in valid_transitions: continue
+            if self.action_cost(configuration, (transition, None), transitions, valid_transitions) == 0:
+                mask |= masks[tid]
+                continue
+            if transition == 'LEFTARC':
+                label = configuration.nodes.label(configuration.stack[-1])
+            elif transition == 'RIGHTARC':
+                label = configuration.nodes.label(configuration.b0)
+            else: continue
+            if (transition, label) in td2i and \
+               self.action_cost(configuration, (transition, label), transitions, valid_transitions) == 0:
+                mask[td2i[(transition, label)]] = True
+        return mask
+
+    def best_action(self, scores, mask):
+        """Highest scoring labeled transition allowed by `mask`."""
+        if not mask.any():
+            raise ValueError('no labeled transition is allowed in this configuration')
+        return int(np.argmax(np.where(mask, scores, -np.inf)))
+
     def predict(self, configuration):
         if not configuration.stack:
             return self.SHIFT, None
         else:
-            s0 = configuration.nodes[configuration.stack[-1]]
-            b0 = configuration.nodes[configuration.b0]
-            if s0.parent == b0.id: return self.LEFTARC, s0.drel
-            elif s0.id == b0.parent: return self.RIGHTARC, b0.drel
+            nodes = configuration.nodes
+            s0, b0 = configuration.stack[-1], configuration.b0
+            if nodes.heads[s0] == nodes.ids[b0]: return self.LEFTARC, nodes.label(s0)
+            elif nodes.ids[s0] == nodes.heads[b0]: return self.RIGHTARC, nodes.label(b0)
             elif self.dependencyLink(configuration): return self.REDUCE, None
             else: return self.SHIFT, None
     
@@ -117,14 +146,14 @@ class ArcEager(object):
         Resolves ambiguity between shift and reduce actions.
         if a dependency exits between any node (<s0) and (b0) then reduce else shift.
         """
+        nodes, b0 = configuration.nodes, configuration.b0
         for Sx in configuration.stack[:-1]:
-            Sx = configuration.nodes[Sx]
-            b0 = configuration.nodes[configuration.b0]
-            if (Sx.parent == b0.id) or (Sx.id == b0.parent): return True
+            if (nodes.heads[Sx] == nodes.ids[b0]) or (nodes.ids[Sx] == nodes.heads[b0]): return True
         return False
     
     def action_cost(self, configuration, labeled_transition, transitions, valid_transitions):
        stack, nodes, b0 = configuration.stack, configuration.nodes, configuration.b0
+       heads, pheads = nodes.heads, nodes.pheads
        transition, label = labeled_transition
     
        if transitions[transition] not in valid_transitions: return 1000
@@ -134,9 +163,9 @@ class ArcEager(object):
           # b0 can no longer have children or parents on stack
     
           for s in stack:
-             if nodes[s].parent == b0 and nodes[s].pparent == -1:
+             if heads[s] == b0 and pheads[s] == -1:
                 lost += 1
-             if nodes[b0].parent == s:
+             if heads[b0] == s:
                 if s != 0: # if real parent is ROOT and is on stack,
                            # we will get it by post-proc at the end.
                    lost += 1
@@ -145,23 +174,19 @@ class ArcEager(object):
           # s0 can no longer have deps on buffer
     
           s0 = stack[-1]
-          for tok in nodes[b0:]:
-             if tok.parent == s0:
-                lost += 1
+          lost += int(np.count_nonzero(heads[b0:] == s0))
     
        elif transition == 'LEFTARC':
           # s0 can no longer have deps on buffer
           # s0 can no longer have parents on buffer[1:]
     	
           s0 = stack[-1]
-          for (idx, tok) in enumerate(nodes[b0:]):
-             if nodes[s0].parent == tok.id:
-                if (idx > 0):
-                   lost += 1
-                elif nodes[s0].drel != label:
-                   lost += 1
-             if tok.parent == s0:
+          for idx in np.nonzero(nodes.ids[b0:] == heads[s0])[0]:
+             if (idx > 0):
+                lost += 1
+             elif nodes.label(s0) != label:
                 lost += 1
+          lost += int(np.count_nonzero(heads[b0:] == s0))
     
        elif transition == 'RIGHTARC':
           # b0 can no longer have parents in stack[:-1]
@@ -169,14 +194,14 @@ class ArcEager(object):
           # b0 can no longer have parents in buffer
     
           s0 = stack[-1]
-          b0parent = nodes[b0].parent
+          b0parent = heads[b0]
           for s in stack:
-             if nodes[s].parent == b0 and nodes[s].pparent == -1:
+             if heads[s] == b0 and pheads[s] == -1:
                 lost += 1
              if (b0parent == s):
                 if s != s0:
                    lost += 1
-                elif nodes[b0].drel != label:
+                elif nodes.label(b0) != label:
                    lost += 1
           # If root-at-end representation, lose the correct parent of b0 if it is root.
           if b0parent > b0 or (b0parent == 0 and stack and stack[0] != 0):
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+"""
+Arc-eager decoding of the parser from NumPy arrays: the s0/b0 features, transition
+scores from the projected parser-BiLSTM features (`pr_np`, see Parser.project_array)
+and greedy or beam decoding. Shared by the DyNet Parser and the DyNet-free NumpyParser,
+which set `meta`, `masks` and `pr_np`.
+"""
+
+import numpy as np
+
+from utils.arcEager import ArcEager
+from utils.beamSearch import beam_search
+from utils.profiling import timer, timed, count
+
+
+class Configuration(object):
+    def __init__(self, nodes=[]):
+        self.stack = list()
+        self.b0 = 1
+        self.nodes = nodes
+
+
+class ArcEagerDecoder(ArcEager):
+    def basefeaturesEager(self, nodes, stack, i):
+        #NOTE Stack nodes
+        #s2 = nodes[stack[-3]] if stack[2:] else nodes[0].left
+        #s1 = nodes[stack[-2]] if stack[1:] else nodes[0].left
+        s0 = stack[-1] if stack else None
+
+        #NOTE Buffer nodes
+        n0 = i
+
+        #NOTE Leftmost and Rightmost children of s2,s1,s0 and b0(only leftmost)
+        #s2l = nodes[s2.left [-1]] if s2.left [-1] != None else nodes[0].left
+        #s2r = nodes[s2.right[-1]] if s2.right[-1] != None else nodes[0].left
+        #s1l = nodes[s1.left [-1]] if s1.left [-1] != None else nodes[0].left
+        #s1r = nodes[s1.right[-1]] if s1.right[-1] != None else nodes[0].left
+        #s0l = nodes[s0.left [-1]] if s0.left [-1] != None else nodes[0].left
+        #s0r = nodes[s0.right[-1]] if s0.right[-1] != None else nodes[0].left
+        #n0l = nodes[n0.left [-1]] if n0.left [-1] != None else nodes[0].left
+        return [(nodes.ids[nd], nodes.form(nd)) if nd is not None else (-1, '__PAD__') for nd in (s0,n0)]
+
+    def feature_rows(self, rfeatures, pad):
+        return [id-1 if id > 0 else pad for id, rform in rfeatures]
+
+    def transition_scores(self, rows):
+        """Parser-MLP output for the s0/b0 `rows` of the projected features, in numpy (rows may be arrays)."""
+        P_s, P_b, b1, W2, b2 = self.pr_np
+        s0, b0 = rows
+        xh = np.maximum(P_s[s0] + P_b[b0], 0) + b1
+        return xh.dot(W2.T) + b2
+
+    def greedy_decode(self, graph):
+        """Fills pparent/pdrel of `graph` with the best valid transition at every step."""
+        n = graph.n
+        configuration = Configuration(graph)
+        while not self.isFinalState(configuration):
+            with timer('parser.scores'):
+                rfeatures = self.basefeaturesEager(configuration.nodes, configuration.stack, configuration.b0)
+                output_probs = self.transition_scores(self.feature_rows(rfeatures, n))
+            with timer('parser.transitions'):
+                validTransitions, _ = self.get_valid_transitions(configuration) #{0: <bound method arceager.SHIFT>}
+                action = self.best_action(output_probs, self.valid_mask(self.masks, validTransitions))
+                transition, predictedLabel = self.meta.i2td[action]
+                predictedTransitionFunc = validTransitions[self.meta.transitions[transition]]
+                predictedTransitionFunc(configuration, predictedLabel)
+            count('parser.transitions')
+
+    @timed('parser.beam')
+    def beam_decode(self, graph, beam):
+        """Fills pparent/pdrel of `graph` with the best of `beam` hypotheses; all are scored in one batch per step."""
+        n = graph.n
+        best = beam_search(n, lambda s0, b0: self.transition_scores((s0, b0)),
+                            self.masks, self.meta.i2td, self.meta.transitions, beam)
+        for dependent, (head, label) in best.heads().items():
+            graph.set_head(dependent, head, label)
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+"""
+Beam-search decoding for the arc-eager system on compact copy-on-write states.
+
+A state never copies node lists: the stack and the predicted arcs are persistent
+linked lists (shared tails between hypotheses) and the "has a head" flags are bits
+of an int, so branching a hypothesis is O(1).
+"""
+
+import numpy as np
+
+SHIFT, LEFTARC, RIGHTARC, REDUCE = 0, 1, 2, 3
+
+
+class BeamState(object):
+    __slots__ = ('stack', 'b0', 'headed', 'arcs', 'score')
+
+    def __init__(self, stack=None, b0=1, headed=0, arcs=None, score=0.0):
+        self.stack = stack  # (top, rest) or None
+        self.b0 = b0
+        self.headed = headed  # bit i set once node i got its head
+        self.arcs = arcs  # (dependent, head, label, rest) or None
+        self.score = score
+
+    def valid_transitions(self, n):
+        """Same rules as ArcEager.get_valid_transitions for a sentence of n tokens."""
+        moves = set([SHIFT, LEFTARC, RIGHTARC, REDUCE])
+        if self.b0 == n+1:
+            moves -= set([SHIFT, RIGHTARC])
+        if self.stack is None:
+            moves -= set([REDUCE, LEFTARC, RIGHTARC])
+        else:
+            s0 = self.stack[0]
+            if not self.headed >> s0 & 1: moves.discard(REDUCE)
+            else: moves.discard(LEFTARC)
+            if self.headed >> self.b0 & 1: moves.discard(RIGHTARC)
+        return moves
+
+    def feature_rows(self, n):
+        """Rows of s0 and b0 in the projected features; row n is the PAD node."""
+        s0 = self.stack[0]-1 if self.stack is not None else n
+        b0 = self.b0-1 if self.b0 <= n else n
+        return s0, b0
+
+    def apply(self, transition, label, n, score):
+        stack, b0, headed, arcs = self.stack, self.b0, self.headed, self.arcs
+        if transition == SHIFT:
+            stack, b0 = (b0, stack), b0+1
+        elif transition == LEFTARC:
+            s0, stack = stack
+            arcs = (s0, b0 if b0 <= n else 0, label, arcs)
+            headed |= 1 << s0
+        elif transition == RIGHTARC:
+            arcs = (b0, stack[0], label, arcs)
+            headed |= 1 << b0
+            stack, b0 = (b0, stack), b0+1
+        else:
+            stack = stack[1]
+        return BeamState(stack, b0, headed, arcs, score)
+
+    def isFinal(self, n):
+        return self.stack is None and self.b0 == n+1
+
+    def heads(self):
+        """{dependent: (head, label)} of all predicted arcs."""
+        heads, arcs = dict(), self.arcs
+        while arcs is not None:
+            dependent, head, label, arcs = arcs
+            heads[dependent] = (head, label)
+        return heads
+
+
+def log_softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    return scores - np.log(np.exp(scores).sum(axis=1, keepdims=True))
+
+def beam_search(n, score_fn, masks, i2td, transitions, beam=4):
+    """
+    Decodes a sentence of n tokens keeping the `beam` best hypotheses by summed
+    transition log-probabilities. score_fn(s0_rows, b0_rows) scores all live
+    hypotheses in one batch and returns a (len(rows), n_outs) array.
+    """
+    labels = [label for action, (transition, label) in sorted(i2td.items())]
+    types = np.array([transitions[transition] for action, (transition, label) in sorted(i2td.items())])
+    states = [BeamState()]
+    while not all(state.isFinal(n) for state in states):
+        live = [state for state in states if not state.isFinal(n)]
+        rows = np.array([state.feature_rows(n) for state in live])
+        logp = log_softmax(score_fn(rows[:,0], rows[:,1]))
+        valid = np.array([masks[list(state.valid_transitions(n))].any(axis=0) for state in live])
+        totals = np.where(valid, logp + np.array([[state.score] for state in live]), -np.inf)
+        flat = totals.ravel()
+        k = min(beam, int(np.isfinite(flat).sum()))
+        best = np.argpartition(-flat, k-1)[:k]
+        best = best[np.argsort(-flat[best], kind='stable')]
+        states = [state for state in states if state.isFinal(n)]
+        for index in best:
+            hyp, action = divmod(int(index), totals.shape[1])
+            states.append(live[hyp].apply(types[action], labels[action], n, flat[index]))
+        states = sorted(states, key=lambda state: -state.score)[:beam]
+    return states[0]
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+"""
+Buffered writers for the CoNLL, tagger TSV and onto TSV outputs.
+
+Sentences are formatted whole (one join per sentence instead of one `write` per token)
+and written in blocks of `buffer_size` bytes, optionally compressed. The
+compression follows the file name (`.gz` gzip, `.zst` zstd, which needs the zstandard
+package) unless `compress` is given:
+
+    with ConllWriter('dev.parsed.conll.gz') as writer:
+        writer.write_sentence(forms, tags, heads, labels)
+    with TaggedWriter('text.pos') as writer:
+        writer.write_sentence(zip(words, tags))
+"""
+
+import io
+import sys
+import gzip
+
+_BUFFER_SIZE_ = 1 << 20
+
+
+def compression(path, compress=None):
+    if compress is not None:
+        return compress or None
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+def open_binary(path, compress=None, level=None):
+    """Binary output stream of `path`, compressed as `compression(path, compress)` says."""
+    kind = compression(path, compress)
+    if kind is None:
+        return open(path, 'wb')
+    if kind == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=level or 6)
+    if kind == 'zstd':
+        import zstandard  # optional, only for .zst outputs
+        return zstandard.ZstdCompressor(level=level or 3).stream_writer(open(path, 'wb'), closefd=True)
+    raise ValueError('unknown compression: %s' % kind)
+
+_IDS_ = []
+
+def token_ids(n):
+    """The strings '1'..`n`."""
+    while len(_IDS_) < n:
+        _IDS_.append(str(len(_IDS_)+1))
+    return _IDS_[:n]
+
+def tsv_lines(rows):
+    """One tab-separated line per row."""
+    return ''.join(['\t'.join([u'%s' % field for field in row]) + '\n' for row in rows])
+
+
+class BufferedWriter(object):
+    """utf-8 text writer flushing in blocks of `buffer_size` bytes; `path` '-' is stdout."""
+
+    def __init__(self, path, compress=None, buffer_size=_BUFFER_SIZE_, level=None):
+        self.path = path
+        if path == '-':
+            self.fp, self.owned = sys.stdout, False
+        else:
+            raw = open_binary(path, compress, level)
+            self.fp, self.owned = io.TextIOWrapper(io.BufferedWriter(raw, buffer_size), encoding='utf-8'), True
+
+    def write(self, text):
+        self.fp.write(text)
+
+    def close(self):
+        if self.owned:
+            self.fp.close()
+        else:
+            self.fp.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class ConllWriter(BufferedWriter):
+    """
+    CoNLL-X (ID FORM LEMMA POSTAG CPOSTAG FEATS HEAD DEPREL PHEAD PDEPREL, the column
+    order tools.parser reads back) or, with dialect 'u', CoNLL-U (ID FORM LEMMA UPOS XPOS
+    FEATS HEAD DEPREL DEPS MISC, plus sent_id/text comments). Missing columns are
+    written as '_'.
+    """
+
+    def __init__(self, path, dialect='x', **kwargs):
+        BufferedWriter.__init__(self, path, **kwargs)
+        if dialect not in ('x', 'u'):
+            raise ValueError('unknown CoNLL dialect: %s' % dialect)
+        self.dialect = dialect
+        self.n_sentences = 0
+
+    def write_sentence(self, forms, tags, heads, labels, lemmas=None, ctags=None, feats=None):
+        self.n_sentences += 1
+        n = len(forms)
+        blank = [u'_']*n
+        rows = zip(token_ids(n), forms, lemmas or blank, tags, ctags or blank, feats or blank, map(str, heads), labels, blank, blank)
+        text = u'\n'.join(map(u'\t'.join, rows)) + u'\n\n' if n else u'\n'
+        if self.dialect == 'u':
+            text = u'# sent_id = %d\n# text = %s\n' % (self.n_sentences, u' '.join(forms)) + text
+        self.write(text)
+
+
+class TaggedWriter(BufferedWriter):
+    """Tagger output: `id word tag` per token, sentences separated by a blank line."""
+
+    def write_sentence(self, tagged):
+        tagged = list(tagged)
+        self.write(u''.join([u'%s\t%s\t%s\n' % (i, word, tag) for i, (word, tag) in zip(token_ids(len(tagged)), tagged)]) + u'\n')
+
+
+class TsvWriter(BufferedWriter):
+    """Row-per-line TSV, e.g. the onto relations `id first second relation confidence distance`."""
+
+    def write_rows(self, rows):
+        self.write(tsv_lines(rows))
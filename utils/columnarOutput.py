@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+
+"""
+Columnar, memory-mappable output of the pipeline (tokens, POS, NER, heads, relations).
+
+Instead of re-parsing the tab-separated `.pos`/`.ner`/`.parse` files, downstream jobs
+open one columnar file and read any slice of sentences without scanning it:
+
+    with open_writer('corpus', format='numpy') as writer:
+        writer.write(form=words, pos=tags, head=heads, rel=labels)
+    reader = open_reader('corpus.cols')
+    reader.slice(1000, 1010)   # [{'form': [...], 'pos': [...], ...}, ...]
+
+Two layouts are written:
+
+  arrow   `<base>.arrow`, an Arrow IPC file with one row of list columns per sentence
+          (needs pyarrow)
+  numpy   `<base>.cols/`, one raw array per column plus sentence offsets:
+            meta.json                    columns, sentence and token counts
+            offsets.i64                  (n_sentences+1,) token offsets of the sentences
+            <column>.i32                 token values; codes into the string table of
+                                         string columns
+            <column>.strings.bin/.off    utf-8 string table and its (n+1,) offsets
+
+`format='auto'` picks arrow when pyarrow is installed. Writers buffer at most
+`buffer_tokens` tokens before appending to the files; a missing column of a sentence
+is written as '_' (strings) or -1 (heads).
+"""
+
+import io
+import os
+import json
+import importlib.util
+
+import numpy as np
+
+TOKEN_COLUMNS = (('form', 'str'), ('pos', 'str'), ('ner', 'str'), ('head', 'int'), ('rel', 'str'))
+_MISSING_ = {'str': u'_', 'int': -1}
+_FORMAT_ = 'clearnlp-columns'
+
+
+def arrow_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+class NumpyColumnWriter(object):
+    def __init__(self, path, columns=TOKEN_COLUMNS, buffer_tokens=1 << 16):
+        self.path = path
+        self.columns = list(columns)
+        self.buffer_tokens = buffer_tokens
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.files = dict((name, open(os.path.join(path, '%s.i32' % name), 'wb')) for name, kind in self.columns)
+        self.offsets_file = open(os.path.join(path, 'offsets.i64'), 'wb')
+        self.strings = dict((name, {}) for name, kind in self.columns if kind == 'str')  # string -> code
+        self.buffers = dict((name, []) for name, kind in self.columns)
+        self.offsets = [0]
+        self.n_sentences = self.n_tokens = self.buffered = 0
+
+    def code(self, table, value):
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        return code
+
+    def write(self, **values):
+        """Appends one sentence; every given column is a sequence with one value per token."""
+        n = len(next(iter(values.values()))) if values else 0
+        for name, kind in self.columns:
+            column = values.get(name)
+            if column is None:
+                column = [_MISSING_[kind]]*n
+            elif len(column) != n:
+                raise ValueError('column %s has %d values for %d tokens' % (name, len(column), n))
+            if kind == 'str':
+                table = self.strings[name]
+                self.buffers[name].extend([self.code(table, value) for value in column])
+            else:
+                self.buffers[name].extend(column)
+        self.n_sentences += 1
+        self.n_tokens += n
+        self.buffered += n
+        self.offsets.append(self.n_tokens)
+        if self.buffered >= self.buffer_tokens:
+            self.flush()
+
+    def flush(self):
+        for name, kind in self.columns:
+            np.array(self.buffers[name], dtype=np.int32).tofile(self.files[name])
+            self.buffers[name] = []
+        np.array(self.offsets, dtype=np.int64).tofile(self.offsets_file)
+        self.offsets = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        for fp in list(self.files.values()) + [self.offsets_file]:
+            fp.close()
+        for name, table in self.strings.items():
+            strings = sorted(table, key=table.get)
+            encoded = [s.encode('utf-8') for s in strings]
+            with open(os.path.join(self.path, '%s.strings.bin' % name), 'wb') as fp:
+                fp.write(b''.join(encoded))
+            np.cumsum([0] + [len(s) for s in encoded], dtype=np.int64).tofile(
+                os.path.join(self.path, '%s.strings.off' % name))
+        header = {'format': _FORMAT_, 'version': 1, 'columns': self.columns,
+                  'n_sentences': self.n_sentences, 'n_tokens': self.n_tokens}
+        with io.open(os.path.join(self.path, 'meta.json'), 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(header, indent=1))  # written last: its presence marks a complete file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class ArrowColumnWriter(object):
+    def __init__(self, path, columns=TOKEN_COLUMNS, buffer_tokens=1 << 16):
+        import pyarrow as pa
+        self.pa = pa
+        self.columns = list(columns)
+        self.buffer_tokens = buffer_tokens
+        types = {'str': pa.list_(pa.string()), 'int': pa.list_(pa.int32())}
+        self.schema = pa.schema([(name, types[kind]) for name, kind in self.columns])
+        self.writer = pa.ipc.new_file(path, self.schema)
+        self.buffers = dict((name, []) for name, kind in self.columns)
+        self.buffered = 0
+
+    def write(self, **values):
+        n = len(next(iter(values.values()))) if values else 0
+        for name, kind in self.columns:
+            column = values.get(name)
+            if column is not None and len(column) != n:
+                raise ValueError('column %s has %d values for %d tokens' % (name, len(column), n))
+            self.buffers[name].append(list(column) if column is not None else [_MISSING_[kind]]*n)
+        self.buffered += n
+        if self.buffered >= self.buffer_tokens:
+            self.flush()
+
+    def flush(self):
+        if self.buffers[self.columns[0][0]]:
+            arrays = [self.pa.array(self.buffers[name], type=field.type) for (name, kind), field in zip(self.columns, self.schema)]
+            self.writer.write_batch(self.pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.buffers = dict((name, []) for name, kind in self.columns)
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class NumpyColumnReader(object):
+    def __init__(self, path):
+        self.path = path
+        with io.open(os.path.join(path, 'meta.json'), encoding='utf-8') as fp:
+            header = json.load(fp)
+        if header.get('format') != _FORMAT_:
+            raise ValueError('%s is not a columnar output directory' % path)
+        self.columns = [tuple(column) for column in header['columns']]
+        self.n_sentences = header['n_sentences']
+        self.offsets = self.memmap('offsets.i64', np.int64, header['n_sentences']+1)
+        self.values = dict((name, self.memmap('%s.i32' % name, np.int32, header['n_tokens']))
+                           for name, kind in self.columns)
+        self.tables = {}
+
+    def memmap(self, fname, dtype, size):
+        if size == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, fname), dtype=dtype, mode='r', shape=(size,))
+
+    def strings(self, name):
+        """(blob, offsets) of a string table, mapped on first use."""
+        if name not in self.tables:
+            offsets = np.fromfile(os.path.join(self.path, '%s.strings.off' % name), dtype=np.int64)
+            size = int(offsets[-1])
+            blob = np.memmap(os.path.join(self.path, '%s.strings.bin' % name), dtype=np.uint8, mode='r') if size else b''
+            self.tables[name] = (blob, offsets)
+        return self.tables[name]
+
+    def decode(self, name, codes):
+        blob, offsets = self.strings(name)
+        decoded = {}
+        for code in set(codes.tolist()):
+            decoded[code] = bytes(blob[offsets[code]:offsets[code+1]]).decode('utf-8')
+        return [decoded[code] for code in codes.tolist()]
+
+    def __len__(self):
+        return self.n_sentences
+
+    def column(self, name, start=0, stop=None):
+        """Values of one column for sentences start..stop, as one list per sentence."""
+        stop = self.n_sentences if stop is None else min(stop, self.n_sentences)
+        if start >= stop:
+            return []
+        kind = dict(self.columns)[name]
+        bounds = np.asarray(self.offsets[start:stop+1])
+        values = np.asarray(self.values[name][bounds[0]:bounds[-1]])
+        values = self.decode(name, values) if kind == 'str' else values.tolist()
+        bounds = bounds - bounds[0]
+        return [values[bounds[i]:bounds[i+1]] for i in range(len(bounds)-1)]
+
+    def slice(self, start, stop, columns=None):
+        """Sentences start..stop as {column: values} dicts, read without scanning the others."""
+        names = columns or [name for name, kind in self.columns]
+        values = [self.column(name, start, stop) for name in names]
+        return [dict(zip(names, sentence)) for sentence in zip(*values)]
+
+    def sentence(self, i):
+        return self.slice(i, i+1)[0]
+
+
+class ArrowColumnReader(object):
+    def __init__(self, path):
+        import pyarrow as pa
+        self.table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()  # zero-copy on the mapping
+        self.columns = [(field.name, 'int' if pa.types.is_integer(field.type.value_type) else 'str')
+                        for field in self.table.schema]
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def column(self, name, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self.table.column(name).slice(start, max(0, stop-start)).to_pylist()
+
+    def slice(self, start, stop, columns=None):
+        names = columns or [name for name, kind in self.columns]
+        values = [self.column(name, start, stop) for name in names]
+        return [dict(zip(names, sentence)) for sentence in zip(*values)]
+
+    def sentence(self, i):
+        return self.slice(i, i+1)[0]
+
+
+def open_writer(base, columns=TOKEN_COLUMNS, format='auto', buffer_tokens=1 << 16):
+    """Writer of `base`.arrow or `base`.cols/ (see the module docstring)."""
+    if format == 'auto':
+        format = 'arrow' if arrow_available() else 'numpy'
+    if format == 'arrow':
+        return ArrowColumnWriter('%s.arrow' % base, columns, buffer_tokens)
+    if format == 'numpy':
+        return NumpyColumnWriter('%s.cols' % base, columns, buffer_tokens)
+    raise ValueError('unknown columnar format: %s' % format)
+
+def open_reader(path):
+    if os.path.isdir(path):
+        return NumpyColumnReader(path)
+    return ArrowColumnReader(path)
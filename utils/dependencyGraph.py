@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+"""
+Columnar dependency graphs.
+
+A sentence of n tokens is a set of parallel int32 columns over positions 0..n+1: the
+ROOT node at 0, tokens at their ids 1..n and the end-ROOT (id 0) at n+1, the same
+layout as the old list of `leaf` namedtuples. Strings (forms, tags, labels, ...) are
+interned in a StringTable shared by a whole treebank; children are CSR index arrays
+built from a head column when needed. A Treebank stores all sentences in a single set
+of concatenated columns and hands out sentences as zero-copy views.
+"""
+
+from array import array
+from collections import namedtuple, defaultdict
+
+import numpy as np
+
+leaf = namedtuple('leaf', ['id','form','lemma','tag','ctag','features','parent','pparent', 'drel','pdrel','left','right', 'visit', 'ner'])
+
+_STRING_COLUMNS_ = ('forms', 'lemmas', 'tags', 'ctags', 'feats', 'labels', 'plabels', 'ner')
+_COLUMNS_ = ('ids', 'heads', 'pheads', 'visit') + _STRING_COLUMNS_
+
+
+class StringTable(object):
+    """Interns strings as consecutive int ids."""
+
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def index(self, string):
+        i = self.ids.get(string)
+        if i is None:
+            i = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return i
+
+    def __getitem__(self, i):
+        return self.strings[i]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+def csr_children(heads):
+    """
+    (indptr, indices) of the children of every position given a head column (-1 = no
+    head): the children of node k are indices[indptr[k]:indptr[k+1]], in id order.
+    """
+    heads = np.asarray(heads)
+    positions = np.nonzero(heads >= 0)[0]
+    order = np.argsort(heads[positions], kind='mergesort')
+    indptr = np.zeros(len(heads)+1, dtype=np.int32)
+    np.cumsum(np.bincount(heads[positions], minlength=len(heads)), out=indptr[1:])
+    return indptr, positions[order].astype(np.int32)
+
+
+class DependencyGraph(object):
+    __slots__ = ('strings',) + _COLUMNS_
+
+    def __init__(self, strings, **columns):
+        self.strings = strings
+        for name in _COLUMNS_:
+            setattr(self, name, columns[name])
+
+    @classmethod
+    def from_rows(cls, strings, rows):
+        """Graph of (id, form, lemma, tag, ctag, features, head, label, ner) token rows."""
+        n = len(rows)
+        columns = dict((name, np.empty(n+2, dtype=np.int32)) for name in _COLUMNS_)
+        root_row = (0, 'ROOT_F', 'ROOT_L', 'ROOT_P', 'ROOT_C', '', -1, '__ROOT__', '_')
+        for position, row in enumerate([root_row] + list(rows) + [root_row]):
+            id_, form, lemma, tag, ctag, features, head, label, ner = row
+            columns['ids'][position] = id_
+            columns['heads'][position] = head
+            columns['forms'][position] = strings.index(form)
+            columns['lemmas'][position] = strings.index(lemma)
+            columns['tags'][position] = strings.index(tag)
+            columns['ctags'][position] = strings.index(ctag)
+            columns['feats'][position] = strings.index(features)
+            columns['labels'][position] = strings.index(label)
+            columns['ner'][position] = strings.index(ner)
+        columns['pheads'][:] = -1
+        columns['plabels'][:] = columns['labels']
+        columns['visit'][:] = 0
+        return cls(strings, **columns)
+
+    @classmethod
+    def from_words(cls, strings, words):
+        return cls.from_rows(strings, [(i, w, '_', '_', '_', '_', -1, '_', '_') for i, w in enumerate(words, 1)])
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n(self):
+        return len(self.ids)-2
+
+    def copy(self, deep=False):
+        """Shares the gold columns (unless `deep`) and copies the predicted ones, which decoding overwrites."""
+        columns = dict((name, getattr(self, name).copy() if deep else getattr(self, name)) for name in _COLUMNS_)
+        columns['pheads'] = self.pheads.copy()
+        columns['plabels'] = self.plabels.copy()
+        return DependencyGraph(self.strings, **columns)
+
+    def form(self, i):
+        return self.strings[self.forms[i]]
+
+    def tag(self, i):
+        return self.strings[self.tags[i]]
+
+    def label(self, i):
+        return self.strings[self.labels[i]]
+
+    def plabel(self, i):
+        return self.strings[self.plabels[i]]
+
+    def token_strings(self, column):
+        """Strings of a column (e.g. 'forms') for the tokens 1..n."""
+        strings = self.strings
+        return [strings[i] for i in getattr(self, column)[1:-1]]
+
+    def words(self):
+        return self.token_strings('forms')
+
+    def set_label(self, i, label):
+        self.labels[i] = self.strings.index(label)
+
+    def set_head(self, i, head, label):
+        self.pheads[i] = head
+        self.plabels[i] = self.strings.index(label)
+
+    def children(self, predicted=False):
+        return csr_children(self.pheads if predicted else self.heads)
+
+    @staticmethod
+    def root():
+        PAD = leaf._make([-1,'__PAD__','__PAD__','__PAD__','__PAD__',defaultdict(lambda:'__PAD__'),-1,-1,'__PAD__','__PAD__',[None],[None], False, '__PAD__'])
+        return leaf._make([0, 'ROOT_F', 'ROOT_L', 'ROOT_P', 'ROOT_C', defaultdict(str), -1, -1, '__ROOT__', '__ROOT__', PAD, [None], False, '_'])
+
+    def nodes(self):
+        """The tokens as `leaf` namedtuples (for output and display), left/right from the predicted tree."""
+        indptr, indices = self.children(predicted=True)
+        s = self.strings
+        nodes = []
+        for i in range(1, self.n+1):
+            kids = [int(c) for c in indices[indptr[i]:indptr[i+1]]]
+            nodes.append(leaf._make([int(self.ids[i]), s[self.forms[i]], s[self.lemmas[i]], s[self.tags[i]],
+                                     s[self.ctags[i]], s[self.feats[i]], int(self.heads[i]), int(self.pheads[i]),
+                                     s[self.labels[i]], s[self.plabels[i]], [c for c in kids if c < i] or [None],
+                                     [c for c in kids if c > i] or [None], bool(self.visit[i]), s[self.ner[i]]]))
+        return nodes
+
+
+class Treebank(object):
+    """Sentences stored as concatenated columns plus offsets; items are DependencyGraph views."""
+
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else StringTable()
+        self.buffers = dict((name, array('i')) for name in _COLUMNS_)
+        self.offsets = array('l', [0])
+        self.columns = None
+
+    def append(self, graph):
+        if self.columns is not None:
+            self.buffers = dict((name, array('i', column.tolist())) for name, column in self.columns.items())
+            self.columns = None
+        for name in _COLUMNS_:
+            self.buffers[name].extend(getattr(graph, name).tolist())
+        self.offsets.append(self.offsets[-1] + len(graph))
+
+    def freeze(self):
+        """Moves the growable buffers into numpy columns (done on first access)."""
+        if self.columns is None:
+            self.columns = dict((name, np.array(buf, dtype=np.int32)) for name, buf in self.buffers.items())
+            self.buffers = None
+        return self.columns
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, i):
+        columns = self.freeze()
+        start, end = self.offsets[i], self.offsets[i+1]
+        return DependencyGraph(self.strings, **dict((name, column[start:end]) for name, column in columns.items()))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        """Bytes held by the columns and offsets (strings excluded)."""
+        columns = self.freeze()
+        return sum(column.nbytes for column in columns.values()) + self.offsets.itemsize*len(self.offsets)
@@ -19,6 +19,7 @@ from collections import Counter
 
 import networkx as nx
 from utils.wordAssociationScore import get_npmi
+from utils.profiling import timer, timed
 
 
 #apply syntactic filters based on POS tags
@@ -89,6 +90,7 @@ def buildGraph(nodes, ngrams=None):
         
     return gr
 
+@timed('keyphrases')
 def extractKeyphrases(text):
     tokenizedText = [sentence.split() for sentence in text]
     bigramCounts, npmiScores = get_npmi(tokenizedText)
@@ -97,7 +99,8 @@ def extractKeyphrases(text):
     tagged = list()
     filteredText = list()
     for sentTokens in tokenizedText: #List of sentences with each sentence inturn a list of tokens 
-        tagged_d = nltk.pos_tag(sentTokens)
+        with timer('keyphrases.pos_tag'):
+            tagged_d = nltk.pos_tag(sentTokens)
         tagged += tagged_d
         filteredText.append([ptok[0].lower() for ptok in filter_for_tags(tagged_d) if ptok[0] not in string.punctuation])
     textlist = [x[0].lower() for x in tagged]
@@ -114,7 +117,8 @@ def extractKeyphrases(text):
     graph = buildGraph(word_set_list,ngrams)
 
     #pageRank - initial value of 1.0, error tolerance of 0,0001, 
-    calculated_page_rank = nx.pagerank(graph, weight='weight')
+    with timer('keyphrases.pagerank'):
+        calculated_page_rank = nx.pagerank(graph, weight='weight')
 
     #most important words in ascending order of importance
     keyphrases = sorted(calculated_page_rank, key=calculated_page_rank.get, reverse=True)
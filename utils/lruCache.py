@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used entry and counts hits/misses."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.store = OrderedDict()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def get(self, key, default=None):
+        try:
+            value = self.store[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.store.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.store[key] = value
+        self.store.move_to_end(key)
+        if self.maxsize and len(self.store) > self.maxsize:
+            self.store.popitem(last=False)
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.store),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
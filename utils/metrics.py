@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+"""
+Service metrics (counters, gauges, histograms) in the Prometheus text format.
+
+Every thread updates its own shard of a metric, so `inc` and `observe` take no lock
+(the shard list is only locked the first time a thread touches a metric); a scrape sums
+the shards. The shard of a thread that exits is folded into the metric's base totals,
+so the one-thread-per-connection daemons do not accumulate shards. Gauges may also be computed at scrape time from a callback, e.g. cache hit
+rates or model memory. All daemons share the module registry and expose it either over
+HTTP (`serve(port)`, GET /metrics) or through the STATS command of their socket:
+
+    requests = counter('onto_requests_total', 'Client requests served')
+    latency = histogram('onto_request_seconds', 'Request latency')
+    requests.inc(); latency.observe(0.012)
+    serve(9100)
+"""
+
+import os
+import sys
+import bisect
+import weakref
+import threading
+
+_LATENCY_BUCKETS_ = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+_SIZE_BUCKETS_ = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+_lock_ = threading.RLock()  # re-entrant: a shard may be retired by the collector while it is held
+_registry_ = []  # metrics in registration order
+
+
+class _Owner(object):
+    """Held in a thread's locals only, so it is freed when the thread exits."""
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, width=1):
+        self.name = name
+        self.help = help
+        self.width = width  # values per shard
+        self.local = threading.local()
+        self.shards = {}  # id -> shard of a live thread
+        self.base = [0]*width  # totals of the threads that exited
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = [0]*self.width
+            self.local.owner = owner = _Owner()
+            with _lock_:
+                self.shards[id(shard)] = shard
+            weakref.finalize(owner, self.retire, shard)
+            return shard
+
+    def retire(self, shard):
+        """Folds the shard of an exited thread into `base`."""
+        with _lock_:
+            for i, value in enumerate(shard):
+                self.base[i] += value
+            del self.shards[id(shard)]
+
+    def totals(self):
+        with _lock_:
+            totals = list(self.base)
+            shards = list(self.shards.values())
+        for shard in shards:
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+    def samples(self):
+        """[(suffix, labels, value)] of the exposition."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+        for suffix, labels, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, labels, format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, n=1):
+        self.shard()[0] += n
+
+    def value(self):
+        return self.totals()[0]
+
+    def samples(self):
+        return [('', '', self.value())]
+
+
+class Gauge(Metric):
+    """A level (in-flight requests, queue depth) moved with inc/dec, or read from `function` at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        Metric.__init__(self, name, help)
+        self.function = function
+
+    def inc(self, n=1):
+        self.shard()[0] += n
+
+    def dec(self, n=1):
+        self.shard()[0] -= n
+
+    def value(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return float('nan')
+        return self.totals()[0]
+
+    def samples(self):
+        return [('', '', self.value())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=_LATENCY_BUCKETS_):
+        self.buckets = tuple(sorted(buckets))
+        # one count per bucket, the +Inf bucket and the sum of observations
+        Metric.__init__(self, name, help, width=len(self.buckets)+2)
+
+    def observe(self, value):
+        shard = self.shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def samples(self):
+        totals = self.totals()
+        samples, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), totals[:-1]):
+            cumulative += count
+            samples.append(('_bucket', '{le="%s"}' % format_value(bound), cumulative))
+        samples.append(('_sum', '', totals[-1]))
+        samples.append(('_count', '', cumulative))
+        return samples
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def register(cls, name, *args, **kwargs):
+    """The metric `name`, created on first use (so modules can be reloaded and share metrics)."""
+    with _lock_:
+        for metric in _registry_:
+            if metric.name == name:
+                return metric
+        metric = cls(name, *args, **kwargs)
+        _registry_.append(metric)
+        return metric
+
+def counter(name, help):
+    return register(Counter, name, help)
+
+def gauge(name, help, function=None):
+    return register(Gauge, name, help, function)
+
+def histogram(name, help, buckets=_LATENCY_BUCKETS_):
+    return register(Histogram, name, help, buckets)
+
+def size_histogram(name, help):
+    return register(Histogram, name, help, _SIZE_BUCKETS_)
+
+def stats_gauges(prefix, stats, keys=('size', 'hits', 'misses', 'hit_rate')):
+    """Gauges over the entries of a stats() dict, e.g. of an LRUCache."""
+    for key in keys:
+        gauge('%s_%s' % (prefix, key), '%s of %s' % (key.replace('_', ' '), prefix.replace('_', ' ')),
+              lambda key=key: stats().get(key, 0))
+
+def resident_memory():
+    """Resident set size of the process in bytes."""
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def render():
+    """The whole registry in the Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in list(_registry_)) + '\n'
+
+
+def serve(port, host='127.0.0.1'):
+    """Serves /metrics from a background thread; returns the server."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # only daemons pay for the import
+    from socketserver import ThreadingMixIn
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class MetricsServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = MetricsServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    sys.stderr.write('Metrics at http://%s:%d/metrics\n' % (host, port))
+    return server
+
+
+gauge('process_resident_memory_bytes', 'Resident memory size in bytes', resident_memory)
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+
+"""
+Binary model bundles: `<model>.bundle/` replaces the pickled `<model>.meta` and the DyNet
+`<model>.dy` text dump.
+
+    meta.json     scalar/small Meta attributes (as Python literals) and the block index
+    <name>.keys   sorted utf-8 string table of a str -> int vocabulary (numpy, fixed width)
+    <name>.ids    int64 values of that vocabulary, aligned with the keys
+    params.f32    raw float32 parameter blocks, memory-mapped at load time
+
+Large vocabularies (the word2vec `w2i`) stay memory-mapped behind a read-only mapping
+instead of being rebuilt as a Python dict; small ones are materialized.
+
+Convert existing models with:
+
+    python -m utils.modelBundle models/
+"""
+
+import io
+import os
+import ast
+import sys
+import json
+import pickle
+import argparse
+import numpy as np
+from collections import Counter
+
+_MATERIALIZE_ = 4096  # vocabularies up to this size are loaded as plain dicts
+
+# False makes load_meta/load_parameters use the pickle + populate path (for benchmarking)
+ENABLED = True
+
+
+class Meta(object):
+    """Attribute bag standing in for the Meta classes of the tools."""
+    pass
+
+
+class Vocabulary(object):
+    """Read-only str -> int mapping over a sorted, memory-mapped string table."""
+
+    def __init__(self, keys, ids, default=None):
+        self.keys_ = keys
+        self.ids = ids
+        self.default = default  # value of missing keys for [] (Counter semantics), KeyError if None
+
+    def index(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        i = int(np.searchsorted(self.keys_, key))
+        if i < len(self.keys_) and self.keys_[i] == key:
+            return i
+        return -1
+
+    def get(self, key, default=None):
+        i = self.index(key)
+        return int(self.ids[i]) if i >= 0 else default
+
+    def __getitem__(self, key):
+        i = self.index(key)
+        if i >= 0:
+            return int(self.ids[i])
+        if self.default is None:
+            raise KeyError(key)
+        return self.default
+
+    def __contains__(self, key):
+        return self.index(key) >= 0
+
+    def __len__(self):
+        return len(self.keys_)
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        return (key.decode('utf-8') for key in self.keys_)
+
+    def values(self):
+        return (int(i) for i in self.ids)
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+
+def bundle_path(model):
+    return '%s.bundle' %model
+
+def has_bundle(model):
+    return ENABLED and os.path.exists(os.path.join(bundle_path(model), 'meta.json'))
+
+def is_vocabulary(value):
+    return isinstance(value, dict) and len(value) > 0 and \
+        all(isinstance(k, (str, bytes, type(u''))) and isinstance(v, int) for k,v in value.items())
+
+def encode_key(key):
+    return key if isinstance(key, bytes) else key.encode('utf-8')
+
+
+class MetaUnpickler(pickle.Unpickler):
+    """Resolves the Meta class whatever script pickled it (it is usually `__main__.Meta`)."""
+
+    def find_class(self, module, name):
+        if name == 'Meta':
+            return Meta
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+def read_pickled_meta(model):
+    with open('%s.meta' %model, 'rb') as fp:
+        return MetaUnpickler(fp).load()
+
+def snapshot_parameters(params):
+    """float32 copies of the parameters and lookup parameters of a DyNet ParameterCollection."""
+    return dict((kind, [np.array(p.as_array(), dtype=np.float32) for p in plist])
+                for kind, plist in [('params', params.parameters_list()), ('lookups', params.lookup_parameters_list())])
+
+def save_bundle(model, meta, params):
+    """Writes the bundle of `meta` and a DyNet ParameterCollection next to `model`."""
+    write_bundle(model, meta, snapshot_parameters(params))
+
+def write_bundle(model, meta, arrays):
+    """Writes the bundle of `meta` and parameter arrays (see snapshot_parameters) next to `model`."""
+    path = bundle_path(model)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    header = {'attrs': {}, 'vocabs': {}, 'params': [], 'lookups': []}
+    for name, value in sorted(vars(meta).items()):
+        if is_vocabulary(value):
+            keys = [encode_key(k) for k in value]
+            order = np.argsort(np.array(keys, dtype=bytes), kind='mergesort')
+            np.save(os.path.join(path, '%s.keys' %name), np.array(keys, dtype=bytes)[order], allow_pickle=False)
+            np.save(os.path.join(path, '%s.ids' %name), np.array(list(value.values()), dtype=np.int64)[order], allow_pickle=False)
+            header['vocabs'][name] = 'counter' if isinstance(value, Counter) else 'dict'
+        else:
+            header['attrs'][name] = repr(value)
+            ast.literal_eval(header['attrs'][name])  # non-literal attributes cannot be bundled
+
+    offset = 0
+    with open(os.path.join(path, 'params.f32'), 'wb') as fp:
+        for kind in ('params', 'lookups'):
+            for array in arrays[kind]:
+                block = np.ascontiguousarray(array, dtype=np.float32)
+                fp.write(block.tobytes())
+                header[kind].append([offset, list(block.shape)])
+                offset += block.size
+    with io.open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as fp:
+        fp.write(json.dumps(header, indent=1, ensure_ascii=False))
+
+def read_header(model):
+    with io.open(os.path.join(bundle_path(model), 'meta.json'), encoding='utf-8') as fp:
+        return json.load(fp)
+
+def load_bundle_meta(model):
+    path = bundle_path(model)
+    header = read_header(model)
+    meta = Meta()
+    for name, value in header['attrs'].items():
+        setattr(meta, name, ast.literal_eval(value))
+    for name, kind in header['vocabs'].items():
+        keys = np.load(os.path.join(path, '%s.keys.npy' %name), mmap_mode='r')
+        ids = np.load(os.path.join(path, '%s.ids.npy' %name), mmap_mode='r')
+        if len(keys) > _MATERIALIZE_:
+            vocab = Vocabulary(keys, ids, 0 if kind == 'counter' else None)
+        else:
+            items = zip((key.decode('utf-8') for key in keys), (int(i) for i in ids))
+            vocab = Counter(dict(items)) if kind == 'counter' else dict(items)
+        setattr(meta, name, vocab)
+    return meta
+
+def load_meta(model):
+    """Meta of `model`: from its bundle if there is one, else from the pickle."""
+    if has_bundle(model):
+        return load_bundle_meta(model)
+    return read_pickled_meta(model)
+
+def load_parameters(params, model):
+    """Fills a DyNet ParameterCollection from the bundle of `model`, else populates it from `.dy`."""
+    if not has_bundle(model):
+        params.populate('%s.dy' %model)
+        return
+    header = read_header(model)
+    blocks = np.memmap(os.path.join(bundle_path(model), 'params.f32'), dtype=np.float32, mode='r')
+    arrays = dict((kind, [blocks[offset:offset+int(np.prod(shape))].reshape(shape) for offset, shape in header[kind]])
+                  for kind in ('params', 'lookups'))
+    try:
+        restore_parameters(params, arrays)
+    except ValueError:
+        raise ValueError('%s does not match the model architecture' %bundle_path(model))
+
+def restore_parameters(params, arrays):
+    """Sets the parameters of a DyNet ParameterCollection from arrays (see snapshot_parameters)."""
+    plists = [params.parameters_list(), params.lookup_parameters_list()]
+    for kind, plist in zip(['params', 'lookups'], plists):
+        if len(plist) != len(arrays[kind]):
+            raise ValueError('%d %s given for %d' % (len(arrays[kind]), kind, len(plist)))
+        for p, value in zip(plist, arrays[kind]):
+            if kind == 'params':
+                p.set_value(value)
+            else:
+                p.init_from_array(value)
+
+
+def model_class(model):
+    """Tool class of a model prefix under models/, from its directory name."""
+    kind = os.path.basename(os.path.dirname(os.path.abspath(model)))
+    if kind in ('tagger', 'ner'):
+        from tools.tagger import Tagger
+        return Tagger
+    if kind == 'parser':
+        from tools.parser import Parser
+        return Parser
+    if kind == 'onto':
+        from tools.subsumptionExtractor import SubsumptionLearning
+        return SubsumptionLearning
+    raise ValueError('unknown model type: %s' %model)
+
+def convert(model):
+    global ENABLED
+    enabled, ENABLED = ENABLED, False
+    try:
+        tool = model_class(model)(model=model)
+    finally:
+        ENABLED = enabled
+    save_bundle(model, tool.meta, tool.model)
+
+def find_models(root):
+    for dirpath, dirnames, filenames in sorted(os.walk(root)):
+        for fname in sorted(filenames):
+            if fname.endswith('.meta') and os.path.exists(os.path.join(dirpath, fname[:-5]+'.dy')):
+                yield os.path.join(dirpath, fname[:-5])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert pickled meta + DyNet models to binary bundles")
+    parser.add_argument('paths', nargs='+', help='Model prefixes or directories to search for *.meta/*.dy pairs')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        models = find_models(path) if os.path.isdir(path) else [path]
+        for model in models:
+            sys.stderr.write('Converting %s ...\n' %model)
+            convert(model)
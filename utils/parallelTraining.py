@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+"""
+Data-parallel training with periodic parameter averaging.
+
+`workers` forked processes each train a replica of the model on a disjoint shard of
+the shuffled training data and, every `sync_every` updates, average their parameters
+through one shared-memory float32 buffer. Worker 0 evaluates and checkpoints through
+its TrainingSchedule and decides for all workers when to stop. The trainers use it as:
+
+    def train(data, par=None):
+        schedule = make_schedule() if par is None else par.schedule(make_schedule)
+        for epoch in range(args.iter):
+            shard = shuffled(data) if par is None else par.shard(data, epoch)
+            for batch in batches(shard):
+                ...
+                if schedule.step(len(batch)): break
+            if schedule.stopped or schedule.epoch_end(): break
+        schedule.close()
+
+    DataParallel(model.model, args.workers, args.sync_every, args.seed).run(partial(train, data))
+
+Every epoch all workers shuffle with the same seed and take equally long shards (up to
+`workers`-1 items are left out of an epoch), so they reach each averaging point together
+and a run is reproducible for a given seed and worker count. After `run` the parent's
+model holds the final averaged parameters. DyNet's own random state (--dynet-seed) is
+inherited from the parent and is the same in every worker.
+"""
+
+import random
+import multiprocessing
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from utils.modelBundle import snapshot_parameters, restore_parameters
+
+
+class DataParallel(object):
+    def __init__(self, params, workers, sync_every=100, seed=None):
+        self.params = params
+        self.workers = workers
+        self.sync_every = sync_every
+        self.seed = seed or 0
+        self.rank = None  # set in the workers
+        arrays = snapshot_parameters(params)
+        self.shapes = dict((kind, [a.shape for a in arrays[kind]]) for kind in ('params', 'lookups'))
+        self.size = sum(a.size for kind in ('params', 'lookups') for a in arrays[kind])
+        ctx = multiprocessing.get_context('fork')  # replicas are copies of the parent's model
+        self.buffer = ctx.RawArray('f', self.size)
+        self.lock = ctx.Lock()
+        self.barrier = ctx.Barrier(workers)
+        self.stop = ctx.RawValue('b', 0)
+        self.ctx = ctx
+
+    def flat(self):
+        return np.frombuffer(self.buffer, dtype=np.float32)
+
+    def unflatten(self, flat):
+        arrays, offset = {}, 0
+        for kind in ('params', 'lookups'):
+            arrays[kind] = []
+            for shape in self.shapes[kind]:
+                size = int(np.prod(shape))
+                arrays[kind].append(flat[offset:offset+size].reshape(shape))
+                offset += size
+        return arrays
+
+    def shard(self, items, epoch):
+        """This worker's share of `items` for `epoch`."""
+        order = list(range(len(items)))
+        random.Random(self.seed*1000003 + epoch).shuffle(order)
+        return [items[i] for i in order[self.rank::self.workers][:len(items)//self.workers]]
+
+    def average(self):
+        """Replaces every replica's parameters by their mean (all workers must call it)."""
+        arrays = snapshot_parameters(self.params)
+        local = np.concatenate([a.ravel() for kind in ('params', 'lookups') for a in arrays[kind]])
+        local /= self.workers
+        with self.lock:
+            self.flat()[:] += local
+        self.barrier.wait()
+        restore_parameters(self.params, self.unflatten(self.flat().copy()))
+        self.barrier.wait()
+
+    def agree(self, stop):
+        """Worker 0's `stop` decision, seen by all workers; also resets the averaging buffer."""
+        if self.rank == 0:
+            self.flat()[:] = 0
+            self.stop.value = int(bool(stop))
+        self.barrier.wait()
+        return bool(self.stop.value)
+
+    def schedule(self, make_schedule):
+        """A schedule for this worker; only worker 0 builds (and evaluates with) the real one."""
+        return ParallelSchedule(self, make_schedule() if self.rank == 0 else None)
+
+    def worker(self, rank, target):
+        self.rank = rank
+        random.seed(self.seed*1000003 + rank)
+        np.random.seed((self.seed*1000003 + rank) % 2**32)
+        target(self)
+
+    def run(self, target):
+        """Calls target(self) in each worker; the parent then takes worker 0's final parameters."""
+        self.flat()[:] = 0
+        procs = [self.ctx.Process(target=self.worker, args=(rank, target)) for rank in range(self.workers)]
+        for proc in procs:
+            proc.start()
+        pending = dict((proc.sentinel, proc) for proc in procs)
+        while pending:
+            for sentinel in wait(list(pending)):
+                proc = pending.pop(sentinel)
+                proc.join()
+                if proc.exitcode != 0:  # the others would wait at the next barrier forever
+                    for other in pending.values():
+                        other.terminate()
+                    raise RuntimeError('training worker %d failed (exit code %s)' % (procs.index(proc), proc.exitcode))
+        restore_parameters(self.params, self.unflatten(self.flat().copy()))
+
+
+class ParallelSchedule(object):
+    """TrainingSchedule interface over all workers: averages every `sync_every` steps, then asks worker 0."""
+
+    def __init__(self, par, schedule):
+        self.par = par
+        self.schedule = schedule
+        self.steps = 0
+        self.pending = 0  # items trained since the last averaging, in this worker
+        self.stopped = False
+
+    def step(self, n=1):
+        self.steps += 1
+        self.pending += n
+        if self.steps % self.par.sync_every == 0:
+            self.sync(lambda schedule, n: schedule.step(n))
+        return self.stopped
+
+    def epoch_end(self):
+        # all workers took the same number of steps, so they agree on whether to average
+        self.sync(lambda schedule, n: schedule.step(n) or schedule.epoch_end(), self.steps % self.par.sync_every)
+        return self.stopped
+
+    def sync(self, decide, average=True):
+        if average:
+            self.par.average()
+        n, self.pending = self.pending*self.par.workers, 0
+        self.stopped = self.par.agree(decide(self.schedule, n) if self.schedule is not None else False)
+
+    def close(self):
+        if self.par.rank == 0:  # hand the final parameters to the parent
+            best = self.schedule.close()
+            arrays = snapshot_parameters(self.par.params)
+            self.par.flat()[:] = np.concatenate([a.ravel() for kind in ('params', 'lookups') for a in arrays[kind]])
+            return best
+
+
+def add_arguments(parser, workers=True):
+    """Adds the data-parallel training options to an ArgumentParser (`workers=False` if it has --workers)."""
+    if workers:
+        parser.add_argument('--workers', type=int, default=1, help='Training processes, each with a model replica')
+    parser.add_argument('--sync-every', dest='sync_every', type=int, default=100, help='Updates between parameter averaging')
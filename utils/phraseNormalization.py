@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+
+"""
+Phrase normalization for subsumption learning: stopword filtering, lemmatization,
+vocabulary lookup and the weighted phrase embedding, memoized per distinct phrase.
+"""
+
+import numpy as np
+from collections import namedtuple
+
+from utils.lruCache import LRUCache
+
+phrase = namedtuple('phrase', ['lemmas', 'ids', 'known', 'vector'])
+
+
+def phrase_weights(n):
+    """Weights of the averaged phrase embedding: 0.6 on the head (last) word, 0.4 shared by the rest."""
+    if n == 1:
+        return np.array([0.6], dtype=np.float32)
+    weights = np.full(n, 0.4/(n-1), dtype=np.float32)
+    weights[-1] = 0.6
+    return weights / n
+
+def cosine_similarity(u, v):
+    """1 - cosine distance, as scipy.spatial.distance.cosine would give it."""
+    return float(np.dot(u, v) / np.sqrt(np.dot(u, u) * np.dot(v, v)))
+
+def lookup_ids(lemmas, w2i, unk):
+    """Maps lemmas to embedding rows; `known` is False if an OOV word follows the last hit on the head word."""
+    ids = list()
+    known = True
+    for lemma in lemmas:
+        index = w2i.get(lemma)
+        if index is None:
+            known = False
+            ids.append(unk)
+        else:
+            if lemma == lemmas[-1]: known = True
+            ids.append(index)
+    return ids, known
+
+
+class PhraseNormalizer(object):
+    def __init__(self, w2i, unk, stopwords, lemmatize, embed, maxsize=100000):
+        self.w2i = w2i
+        self.unk = unk
+        self.stop = stopwords
+        self.lemmatize = lemmatize
+        self.embed = embed  # ids -> (len(ids), w_dim) array of embedding rows
+        self.cache = LRUCache(maxsize)
+
+    def normalize(self, text):
+        entry = self.cache.get(text)
+        if entry is None:
+            lemmas = [self.lemmatize(w) for w in text.split() if w not in self.stop]
+            ids, known = lookup_ids(lemmas, self.w2i, self.unk)
+            vector = phrase_weights(len(ids)).dot(self.embed(ids)) if ids else None
+            entry = phrase(lemmas, ids, known, vector)
+            self.cache.put(text, entry)
+        return entry
+
+    def clear(self):
+        """Drops memoized phrases, e.g. after the embeddings have been updated."""
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
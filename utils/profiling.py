@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+"""
+Per-stage timers and counters, off by default.
+
+Instrumented code wraps its stages in `with timer('parser.decode'):` and bumps counters
+with `count('parser.transitions', n)`; while profiling is disabled `timer` hands out a
+shared no-op context manager, so the hooks cost one call each. Profiling is enabled
+with `enable()` or, for the GUI and the command line tools, with the CLEARNLP_PROFILE
+environment variable:
+
+    CLEARNLP_PROFILE=1 python3 clearEarthNLP.py           # stage breakdown on exit
+    CLEARNLP_PROFILE=/tmp/run python3 -m tools.parser ...  # + /tmp/run.trace.json, /tmp/run.pstats
+
+The trace is Chrome trace-event JSON (chrome://tracing, Perfetto); the pstats file is
+a cProfile dump of the whole run.
+"""
+
+import os
+import sys
+import json
+import atexit
+import timeit
+import functools
+import threading
+from collections import defaultdict
+
+ENABLED = False
+_clock_ = timeit.default_timer
+
+
+class Stats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.origin = _clock_()
+        self.times = defaultdict(lambda: [0, 0.0, 0.0])  # stage -> [calls, total, max]
+        self.counters = defaultdict(int)
+        self.events = None  # trace events, if tracing
+
+    def add(self, stage, start, elapsed):
+        entry = self.times[stage]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+        if self.events is not None:
+            self.events.append((stage, start, elapsed, threading.current_thread().ident))
+
+
+stats = Stats()
+profile = None  # cProfile.Profile of the run, if requested
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Timer(object):
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = _clock_()
+        return self
+
+    def __exit__(self, *exc):
+        stats.add(self.stage, self.start, _clock_()-self.start)
+        return False
+
+
+_NULL_ = NullTimer()
+
+def timer(stage):
+    """Context manager timing `stage` (a no-op unless profiling is enabled)."""
+    return Timer(stage) if ENABLED else _NULL_
+
+def timed(stage):
+    """Decorator timing every call of a function as `stage`."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with Timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, n=1):
+    if ENABLED:
+        stats.counters[name] += n
+
+def enable(trace=False, cprofile=False):
+    """Starts collecting stage times; `trace` keeps every interval, `cprofile` profiles all calls."""
+    global ENABLED, profile
+    ENABLED = True
+    stats.reset()
+    if trace:
+        stats.events = []
+    if cprofile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+
+def disable():
+    global ENABLED
+    ENABLED = False
+    if profile is not None:
+        profile.disable()
+
+def report(stream=sys.stderr):
+    """Writes the per-stage breakdown, slowest stages first (times include nested stages)."""
+    wall = _clock_() - stats.origin
+    stream.write("%-28s %8s %10s %10s %10s %7s\n" % ('stage', 'calls', 'total s', 'mean ms', 'max ms', '% wall'))
+    for stage, (calls, total, longest) in sorted(stats.times.items(), key=lambda x: -x[1][1]):
+        stream.write("%-28s %8d %10.3f %10.3f %10.3f %6.1f%%\n" % (stage, calls, total, 1e3*total/calls,
+                     1e3*longest, 100.*total/wall if wall else 0.0))
+    for name, value in sorted(stats.counters.items()):
+        stream.write("%-28s %8d\n" % (name, value))
+
+def dump_trace(fname):
+    """Writes the recorded intervals as Chrome trace-event JSON."""
+    pid = os.getpid()
+    events = [{'name': stage, 'cat': stage.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+               'ts': 1e6*(start-stats.origin), 'dur': 1e6*elapsed}
+              for stage, start, elapsed, tid in stats.events or []]
+    with open(fname, 'w') as fp:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+def dump_pstats(fname):
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(fname)
+
+def finish(prefix=None):
+    """Reports the breakdown and, given a path prefix, writes `prefix`.trace.json and `prefix`.pstats."""
+    disable()
+    report()
+    if prefix:
+        dump_trace('%s.trace.json' %prefix)
+        dump_pstats('%s.pstats' %prefix)
+        sys.stderr.write("Profile written to %s.trace.json and %s.pstats\n" % (prefix, prefix))
+
+
+_setting_ = os.environ.get('CLEARNLP_PROFILE')
+if _setting_:
+    _prefix_ = None if _setting_ == '1' else _setting_
+    enable(trace=bool(_prefix_), cprofile=bool(_prefix_))
+    atexit.register(finish, _prefix_)
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+"""
+Content-addressed cache of stage results (tags, parses, relation predictions).
+
+Keys hash a model fingerprint, the stage name and the input tokens (or phrase pair), so
+a repeated caption or disclaimer is decoded once per model. Results live in an in-memory
+LRU tier and, optionally, in an sqlite file that survives restarts and is shared by all
+stages of a process:
+
+    from utils.resultCache import shared_cache, configure
+    configure(path='results.sqlite')  # add the on-disk tier
+    shared_cache().stats()
+"""
+
+import os
+import json
+import atexit
+import pickle
+import sqlite3
+import hashlib
+import threading
+
+from utils.lruCache import LRUCache
+from utils.metrics import stats_gauges
+
+_MISSING_ = object()
+_COMMIT_EVERY_ = 256  # puts between sqlite commits
+_CACHE_ = None
+
+
+def model_fingerprint(model):
+    """Identifies a saved model by the names, sizes and modification times of its files."""
+    digest = hashlib.sha1(os.path.abspath(model).encode('utf-8'))
+    base, prefix = os.path.split(os.path.abspath(model))
+    paths = []
+    for name in sorted(os.listdir(base or '.')):
+        if not name.startswith(prefix):
+            continue
+        path = os.path.join(base, name)
+        if os.path.isdir(path):  # binary bundle
+            paths.extend(sorted(os.path.join(path, f) for f in os.listdir(path)))
+        else:
+            paths.append(path)
+    for path in paths:
+        st = os.stat(path)
+        digest.update(('%s:%d:%d;' % (os.path.basename(path), st.st_size, int(st.st_mtime))).encode('utf-8'))
+    return digest.hexdigest()
+
+def result_key(fingerprint, stage, tokens):
+    """Key of the result of `stage` for a token sequence (or phrase pair) under a model fingerprint."""
+    content = json.dumps([fingerprint, stage, list(tokens)], ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """LRU memory tier in front of an optional sqlite tier; values must be picklable."""
+
+    def __init__(self, maxsize=100000, path=None):
+        self.memory = LRUCache(maxsize)
+        self.path = path
+        self.db = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)')
+            self.db.commit()
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING_)
+        if value is not _MISSING_:
+            return value
+        if self.db is None:
+            return default
+        with self.lock:
+            row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.disk_misses += 1
+            return default
+        self.disk_hits += 1
+        value = pickle.loads(bytes(row[0]))
+        self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.db is None:
+            return
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?)',
+                            (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))))
+            self.pending += 1
+            if self.pending >= _COMMIT_EVERY_:
+                self.db.commit()
+                self.pending = 0
+
+    def map(self, keys, items, compute):
+        """
+        Results of `items` in order; `compute` is called once with the list of distinct
+        items that are not cached and must return their results in the same order.
+        """
+        results = [self.get(key, _MISSING_) for key in keys]
+        missed = {}
+        for i, (key, result) in enumerate(zip(keys, results)):
+            if result is _MISSING_ and key not in missed:
+                missed[key] = i
+        if missed:
+            positions = sorted(missed.values())
+            for i, result in zip(positions, compute([items[i] for i in positions])):
+                self.put(keys[i], result)
+                results[i] = result
+            for i, key in enumerate(keys):
+                if results[i] is _MISSING_:
+                    results[i] = results[missed[key]]
+            self.flush()
+        return results
+
+    def flush(self):
+        if self.db is not None and self.pending:
+            with self.lock:
+                self.db.commit()
+                self.pending = 0
+
+    def clear(self):
+        self.memory.clear()
+        if self.db is not None:
+            with self.lock:
+                self.db.execute('DELETE FROM results')
+                self.db.commit()
+                self.pending = 0
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def stats(self):
+        stats = {'memory': self.memory.stats()}
+        if self.db is not None:
+            with self.lock:
+                size = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            lookups = self.disk_hits + self.disk_misses
+            stats['disk'] = {'path': self.path,
+                             'size': size,
+                             'hits': self.disk_hits,
+                             'misses': self.disk_misses,
+                             'hit_rate': float(self.disk_hits) / lookups if lookups else 0.0}
+        return stats
+
+
+def configure(maxsize=100000, path=None):
+    """Replaces the process-wide cache (e.g. to add the sqlite tier at `path`)."""
+    global _CACHE_
+    _CACHE_ = ResultCache(maxsize, path)
+    atexit.register(_CACHE_.close)
+    return _CACHE_
+
+def shared_cache():
+    """The process-wide cache; the sqlite tier is enabled by the CLEARNLP_RESULT_CACHE path."""
+    if _CACHE_ is None:
+        configure(path=os.environ.get('CLEARNLP_RESULT_CACHE'))
+    return _CACHE_
+
+stats_gauges('result_cache_memory', lambda: shared_cache().stats()['memory'])
+stats_gauges('result_cache_disk', lambda: shared_cache().stats().get('disk', {}))
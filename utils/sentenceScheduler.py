@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+"""
+Length-bucketed batching of sentence streams for the neural stages.
+
+Sentences are buffered in windows, sorted by length, grouped into buckets of similar
+length whose padded size stays under a token budget, and handed to a batch function
+(Tagger.tag_batch, parser.parse_batch, ...). Results come back in input order.
+"""
+
+import time
+
+from utils.metrics import gauge, histogram, size_histogram
+
+_queued_ = gauge('scheduler_queued_sentences', 'Sentences waiting for their batch')
+_batch_sizes_ = size_histogram('scheduler_batch_sentences', 'Sentences per dispatched batch')
+_queue_delay_ = histogram('scheduler_queue_delay_seconds', 'Time from arrival to dispatch of a sentence')
+
+class BucketScheduler(object):
+    def __init__(self, process_batch, window=512, max_tokens=2048, bucket_width=8):
+        self.process_batch = process_batch  # list of sentences -> list of results
+        self.window = window
+        self.max_tokens = max_tokens
+        self.bucket_width = bucket_width
+        self.reset()
+
+    def reset(self):
+        self.sentences = 0
+        self.batches = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.total_delay = 0.
+        self.max_delay = 0.
+
+    def batches_of(self, lengths):
+        """Index lists of the buckets for one window, shortest sentences first."""
+        batches, batch, longest = [], [], 0
+        for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+            length = max(lengths[i], 1)
+            same_bucket = batch and (length-1)//self.bucket_width == (longest-1)//self.bucket_width
+            if batch and (not same_bucket or (len(batch)+1)*length > self.max_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+            longest = length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def flush(self, window, arrivals):
+        lengths = [len(sentence) for sentence in window]
+        results = [None]*len(window)
+        for batch in self.batches_of(lengths):
+            dispatched = time.time()
+            for i, result in zip(batch, self.process_batch([window[i] for i in batch])):
+                results[i] = result
+            _queued_.dec(len(batch))
+            _batch_sizes_.observe(len(batch))
+            longest = max(lengths[i] for i in batch)
+            self.batches += 1
+            self.tokens += sum(lengths[i] for i in batch)
+            self.padded_tokens += longest*len(batch)
+            for i in batch:
+                delay = dispatched - arrivals[i]
+                self.total_delay += delay
+                self.max_delay = max(self.max_delay, delay)
+                _queue_delay_.observe(delay)
+        self.sentences += len(window)
+        return results
+
+    def run(self, sentences):
+        """Yields the result for every sentence of the (possibly lazy) stream, in order."""
+        window, arrivals = [], []
+        for sentence in sentences:
+            window.append(sentence)
+            arrivals.append(time.time())
+            _queued_.inc()
+            if len(window) >= self.window:
+                for result in self.flush(window, arrivals):
+                    yield result
+                window, arrivals = [], []
+        if window:
+            for result in self.flush(window, arrivals):
+                yield result
+
+    def stats(self):
+        """Padding efficiency is real/padded tokens; queue delay is arrival to dispatch, in seconds."""
+        return {'sentences': self.sentences,
+                'batches': self.batches,
+                'tokens': self.tokens,
+                'padding_efficiency': float(self.tokens) / self.padded_tokens if self.padded_tokens else 1.0,
+                'mean_queue_delay': self.total_delay / self.sentences if self.sentences else 0.0,
+                'max_queue_delay': self.max_delay}
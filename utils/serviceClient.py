@@ -0,0 +1,431 @@
+#!/usr/bin/python3
+
+"""
+Clients of the framed daemon protocol (utils.serviceProtocol), blocking and asyncio.
+
+Both keep a pool of persistent connections, split large inputs into batches of
+`batch_size` pairs pipelined over the pooled connections, and resend the unanswered
+requests on a new connection when one fails or times out (requests are read-only, so
+resending is safe):
+
+    with ServiceClient('localhost', 5000) as client:
+        results = client.score_pairs(pairs)        # [(first, second, relation, confidence, similarity) or None]
+        result = client.score('sea ice', 'ice')    # from any thread, batched with concurrent calls
+
+    async with AsyncServiceClient('localhost', 5000) as client:
+        results = await client.score_pairs(pairs)
+        result = await client.score('sea ice', 'ice')
+
+Single `score` calls wait up to `max_delay` seconds for other calls to share a request.
+"""
+
+import json
+import time
+import socket
+import asyncio
+import itertools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from utils.serviceProtocol import MAGIC, MAX_FRAME, ProtocolError, encode_frame, recv_frame
+
+_HEADER_SIZE_ = 4
+
+
+class ServiceError(Exception):
+    """The server could not serve a request (not retried)."""
+    pass
+
+
+def results_of(response):
+    if 'error' in response:
+        raise ServiceError(response['error'])
+    return [tuple(r) if r is not None else None for r in response['results']]
+
+def batches(pairs, batch_size):
+    pairs = [list(pair) for pair in pairs]
+    return [pairs[i:i+batch_size] for i in range(0, len(pairs), batch_size)]
+
+
+class Connection(object):
+    def __init__(self, address, timeout):
+        self.sock = socket.create_connection(address, timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(MAGIC)
+        self.ids = itertools.count()
+
+    def exchange(self, requests, window=8, responses=None):
+        """
+        Sends `requests` with up to `window` of them unanswered; returns the responses in
+        order. Responses are appended to `responses` as they arrive, so a caller keeps
+        them when the connection fails part way.
+        """
+        responses = [] if responses is None else responses
+        done = len(responses)
+        for request in requests:
+            request['id'] = next(self.ids)
+        received, sent = 0, 0
+        while received < len(requests):
+            ahead = requests[sent:received+window]
+            if ahead:
+                self.sock.sendall(b''.join(map(encode_frame, ahead)))
+                sent += len(ahead)
+            response = recv_frame(self.sock)
+            if response is None:
+                raise ProtocolError('connection closed by the server')
+            if response.get('id') != requests[received]['id']:
+                raise ProtocolError('response %s to request %s' % (response.get('id'), requests[received]['id']))
+            responses.append(response)
+            received += 1
+        return responses[done:]
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool(object):
+    """At most `size` connections to `address`; idle ones are reused."""
+
+    def __init__(self, address, size=4, timeout=30.):
+        self.address = address
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self.slots.acquire()
+        try:
+            with self.lock:
+                conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                conn = Connection(self.address, self.timeout)
+            try:
+                yield conn
+            except BaseException:
+                conn.close()  # the stream may hold unread responses
+                raise
+            with self.lock:
+                self.idle.append(conn)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Batcher(object):
+    """Gathers single items submitted from many threads into calls of `function(items)`."""
+
+    def __init__(self, function, batch_size, max_delay):
+        self.function = function
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending = []
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, item):
+        future = Future()
+        with self.cond:
+            if self.closed:
+                raise ValueError('batcher is closed')
+            self.pending.append((item, future))
+            self.cond.notify()
+        return future
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                deadline = time.time() + self.max_delay
+                while len(self.pending) < self.batch_size and not self.closed:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            try:
+                results = self.function([item for item, future in batch])
+            except Exception as e:
+                for item, future in batch:
+                    future.set_exception(e)
+                continue
+            for (item, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+
+class ServiceClient(object):
+    def __init__(self, host='127.0.0.1', port=None, pool_size=4, timeout=30., retries=2, batch_size=512,
+                 max_delay=0.005, window=8):
+        self.pool = ConnectionPool((host, port), pool_size, timeout)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.window = window
+        self.batchers = {}
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def call(self, requests):
+        """Responses to `requests`, in order; up to `pool_size` pooled connections share them."""
+        lanes = min(self.pool_size, len(requests))
+        if lanes <= 1:
+            return self.exchange(requests)
+        size = -(-len(requests) // lanes)
+        parts = [requests[i:i+size] for i in range(0, len(requests), size)]
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.pool_size)
+        return [response for part in self.executor.map(self.exchange, parts) for response in part]
+
+    def exchange(self, requests):
+        """
+        Responses to `requests`, pipelined on one pooled connection. When the connection
+        fails, the answered requests are kept and only the others are resent on a new one;
+        `retries` bounds the failures in a row without progress.
+        """
+        responses, failures = [], 0
+        while len(responses) < len(requests):
+            answered = len(responses)
+            try:
+                with self.pool.connection() as conn:
+                    conn.exchange([dict(request) for request in requests[answered:]], self.window, responses)
+            except (OSError, ProtocolError):  # including socket.timeout
+                failures = 1 if len(responses) > answered else failures+1
+                if failures > self.retries:
+                    raise
+                time.sleep(0.05 * 2**(failures-1))
+        return responses
+
+    def score_pairs(self, pairs, op='pairs'):
+        """
+        Results of `pairs`: op 'pairs' scores both directions and orders each pair by the
+        more confident one, 'hyp' scores (subtype, supertype) as given.
+        """
+        responses = self.call([{'op': op, 'pairs': batch} for batch in batches(pairs, self.batch_size)])
+        return [result for response in responses for result in results_of(response)]
+
+    def submit(self, first, second, op='pairs'):
+        """Future of one pair's result, sent together with other pending pairs."""
+        with self.lock:
+            if op not in self.batchers:
+                self.batchers[op] = Batcher(lambda pairs: self.score_pairs(pairs, op), self.batch_size, self.max_delay)
+            batcher = self.batchers[op]
+        return batcher.submit((first, second))
+
+    def score(self, first, second, op='pairs'):
+        return self.submit(first, second, op).result()
+
+    def stats(self):
+        response, = self.call([{'op': 'stats'}])
+        if 'error' in response:
+            raise ServiceError(response['error'])
+        return response['text']
+
+    def ping(self):
+        self.call([{'op': 'ping'}])
+
+    def close(self):
+        with self.lock:
+            batchers, self.batchers = list(self.batchers.values()), {}
+            executor, self.executor = self.executor, None
+        for batcher in batchers:
+            batcher.close()
+        if executor is not None:
+            executor.shutdown()
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class AsyncConnection(object):
+    """A connection whose reader task hands responses to the waiting requests by id."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.waiting = {}
+        self.closed = False
+        self.task = asyncio.ensure_future(self.read())
+
+    @classmethod
+    async def open(cls, address, timeout):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), timeout)
+        writer.write(MAGIC)
+        return cls(reader, writer)
+
+    async def read(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(_HEADER_SIZE_)
+                size = int.from_bytes(header, 'big')
+                if size > MAX_FRAME:
+                    raise ProtocolError('frame of %d bytes exceeds the limit' % size)
+                response = json.loads((await self.reader.readexactly(size)).decode('utf-8'))
+                future = self.waiting.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, OSError, ValueError, ProtocolError) as e:
+            error = ConnectionError('connection lost: %s' % e)
+        except asyncio.CancelledError:
+            error = ConnectionError('connection closed')
+        self.closed = True
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(error)
+        self.waiting.clear()
+
+    async def request(self, message, timeout):
+        if self.closed:
+            raise ConnectionError('connection closed')
+        message['id'] = next(self.ids)
+        future = asyncio.get_event_loop().create_future()
+        self.waiting[message['id']] = future
+        try:
+            self.writer.write(encode_frame(message))
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.waiting.pop(message['id'], None)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.task.cancel()
+        self.writer.close()
+
+
+class AsyncConnectionPool(object):
+    """Up to `size` connections opened on demand; requests are spread over them round robin."""
+
+    def __init__(self, address, size=2, timeout=30.):
+        self.address = address
+        self.timeout = timeout
+        self.conns = [None]*size
+        self.turn = itertools.cycle(range(size))
+        self.lock = None
+
+    async def get(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            i = next(self.turn)
+            if self.conns[i] is None or self.conns[i].closed:
+                self.conns[i] = await AsyncConnection.open(self.address, self.timeout)
+            return self.conns[i]
+
+    def close(self):
+        for conn in filter(None, self.conns):
+            conn.close()
+        self.conns = [None]*len(self.conns)
+
+
+class AsyncServiceClient(object):
+    def __init__(self, host='127.0.0.1', port=None, pool_size=2, timeout=30., retries=2, batch_size=512, max_delay=0.005):
+        self.pool = AsyncConnectionPool((host, port), pool_size, timeout)
+        self.timeout = timeout
+        self.retries = retries
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending = {}
+        self.batches = set()
+
+    async def call(self, message):
+        for attempt in range(self.retries+1):
+            conn = None
+            try:
+                conn = await self.pool.get()
+                return await conn.request(dict(message), self.timeout)
+            except (OSError, asyncio.TimeoutError):  # ConnectionError is an OSError
+                if conn is not None:
+                    conn.close()  # a late response would be out of step
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(0.05 * 2**attempt)
+
+    async def score_pairs(self, pairs, op='pairs'):
+        """See ServiceClient.score_pairs; the batches are in flight together."""
+        responses = await asyncio.gather(*[self.call({'op': op, 'pairs': batch}) for batch in batches(pairs, self.batch_size)])
+        return [result for response in responses for result in results_of(response)]
+
+    def score(self, first, second, op='pairs'):
+        """Awaitable result of one pair, sent together with the pairs requested meanwhile."""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        pending = self.pending.setdefault(op, [])
+        pending.append(((first, second), future))
+        if len(pending) >= self.batch_size:
+            self.flush(op)
+        elif len(pending) == 1:
+            loop.call_later(self.max_delay, self.flush, op)
+        return future
+
+    def flush(self, op):
+        batch = self.pending.pop(op, [])
+        if batch:
+            task = asyncio.ensure_future(self.run_batch(batch, op))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def run_batch(self, batch, op):
+        try:
+            results = await self.score_pairs([pair for pair, future in batch], op)
+        except Exception as e:
+            for pair, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (pair, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def stats(self):
+        response = await self.call({'op': 'stats'})
+        if 'error' in response:
+            raise ServiceError(response['error'])
+        return response['text']
+
+    async def ping(self):
+        await self.call({'op': 'ping'})
+
+    async def close(self):
+        for op in list(self.pending):
+            self.flush(op)
+        if self.batches:
+            await asyncio.wait(list(self.batches))
+        self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+
+"""
+Framed protocol of the NLP daemons: persistent connections and pipelined requests.
+
+A client opens the connection with the MAGIC line. After it every request and response
+is a frame, a 4-byte big-endian length followed by a utf-8 JSON object. Requests carry
+an id and are answered in order, so a client may send many requests before reading
+the responses, and the connection stays open for the next ones:
+
+    {"id": 7, "op": "pairs", "pairs": [["sea ice", "ice"], ...]}
+        -> {"id": 7, "results": [["sea ice", "ice", "Hypernym", 0.93, 0.71], null, ...]}
+    {"id": 8, "op": "stats"}  -> {"id": 8, "text": "<metrics>"}
+    {"id": 9, "op": "bogus"}  -> {"id": 9, "error": "unknown op: bogus"}
+
+Connections that do not start with MAGIC get the old one-shot exchange (TSV pairs in,
+TSV out, close) through the `legacy` handler, which runs outside the server lock and
+takes it only around its model calls, so an idle client does not hold up the others. StandInServer speaks the protocol with a
+rule-based scorer, for tests of clients without a model.
+"""
+
+import json
+import time
+import socket
+import struct
+import threading
+from socketserver import BaseRequestHandler, TCPServer, ThreadingMixIn
+
+MAGIC = b'CLNP/1\n'
+MAX_FRAME = 64 << 20
+_HEADER_ = struct.Struct('>I')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def plain(value):
+    """JSON-serializable copy of a result (tuples to lists, numpy scalars to Python numbers)."""
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (tuple, list)):
+        return [plain(v) for v in value]
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def encode_frame(message):
+    payload = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    return _HEADER_.pack(len(payload)) + payload
+
+def recv_exactly(sock, n):
+    """`n` bytes from `sock`; None at a clean end of stream before the first byte."""
+    chunks, size = [], 0
+    while size < n:
+        chunk = sock.recv(min(n - size, 1 << 20))
+        if not chunk:
+            if size:
+                raise ProtocolError('connection closed inside a frame')
+            return None
+        chunks.append(chunk)
+        size += len(chunk)
+    return b''.join(chunks)
+
+def send_frame(sock, message):
+    sock.sendall(encode_frame(message))
+
+def recv_frame(sock):
+    """The next message, or None when the peer closed the connection."""
+    header = recv_exactly(sock, _HEADER_.size)
+    if header is None:
+        return None
+    size, = _HEADER_.unpack(header)
+    if size > MAX_FRAME:
+        raise ProtocolError('frame of %d bytes exceeds the limit' % size)
+    payload = recv_exactly(sock, size)
+    if payload is None:
+        raise ProtocolError('connection closed inside a frame')
+    return json.loads(payload.decode('utf-8'))
+
+def uses_protocol(sock):
+    """Peeks at the first bytes of a new connection: True if they are MAGIC."""
+    head = sock.recv(len(MAGIC), socket.MSG_PEEK)
+    if head and len(head) < len(MAGIC) and MAGIC.startswith(head):
+        head = sock.recv(len(MAGIC), socket.MSG_PEEK | socket.MSG_WAITALL)
+    if head == MAGIC:
+        recv_exactly(sock, len(MAGIC))
+        return True
+    return False
+
+
+class ServiceHandler(BaseRequestHandler):
+    def handle(self):
+        server, sock = self.server, self.request
+        if not uses_protocol(sock):
+            if server.legacy is not None:
+                server.legacy(self.client_address[0], self.client_address[1], sock)
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                request = recv_frame(sock)
+            except (ProtocolError, ValueError, OSError):
+                return
+            if request is None:
+                return
+            try:
+                send_frame(sock, server.respond(request))
+            except OSError:
+                return
+
+
+class ServiceServer(ThreadingMixIn, TCPServer):
+    """
+    One thread per connection; `handlers` maps an op to function(request) -> response
+    fields. Handlers run under `lock` since the models are not thread-safe; `legacy`
+    must take the same lock around its model calls.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handlers, legacy=None, lock=None):
+        self.handlers = handlers
+        self.legacy = legacy
+        self.lock = lock if lock is not None else threading.Lock()
+        TCPServer.__init__(self, address, ServiceHandler)
+
+    def respond(self, request):
+        response = {'id': request.get('id')}
+        handler = self.handlers.get(request.get('op'))
+        if handler is None:
+            response['error'] = 'unknown op: %s' % request.get('op')
+            return response
+        try:
+            with self.lock:
+                response.update(handler(request))
+        except Exception as e:
+            response['error'] = '%s: %s' % (type(e).__name__, e)
+        return response
+
+    def start(self):
+        """Serves from a background thread; returns the server."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+def pair_handlers(score_pairs, score_hyps=None, stats=None):
+    """Handlers of the relation daemon: `pairs` (both directions), `hyp` (given direction), `stats`."""
+    handlers = {'ping': lambda request: {},
+                'pairs': lambda request: {'results': plain(score_pairs([tuple(p) for p in request['pairs']]))}}
+    if score_hyps is not None:
+        handlers['hyp'] = lambda request: {'results': plain(score_hyps([tuple(p) for p in request['pairs']]))}
+    if stats is not None:
+        handlers['stats'] = lambda request: {'text': stats()}
+    return handlers
+
+
+class StandInServer(ServiceServer):
+    """
+    Local server with the daemon's protocol and a rule-based scorer: (first, second) is a
+    Hypernym if the last word of `first` is `second`. `delay` slows every request down and
+    every `drop_every`-th request is answered by closing the connection, to test timeouts
+    and retries.
+    """
+
+    def __init__(self, port=0, delay=0., drop_every=0):
+        self.delay = delay
+        self.drop_every = drop_every
+        self.requests = 0
+        self.counting = threading.Lock()
+        ServiceServer.__init__(self, ('127.0.0.1', port),
+                               pair_handlers(self.score_pairs, self.score_hyps, lambda: 'standin_requests %d\n' % self.requests),
+                               legacy=self.legacy_client)
+
+    def score_hyps(self, pairs):
+        results = []
+        for first, second in pairs:
+            if not first.split() or not second.split():
+                results.append(None)
+            elif first.split()[-1] == second and first != second:
+                results.append((first, second, 'Hypernym', 0.9, 0.5))
+            else:
+                results.append((first, second, 'Unrelated', 0.6, 0.1))
+        return results
+
+    def score_pairs(self, pairs):
+        results = []
+        for (first, second), forward, backward in zip(pairs, self.score_hyps(pairs), self.score_hyps([(s, f) for f, s in pairs])):
+            results.append(backward if forward is not None and backward[3] > forward[3] else forward)
+        return results
+
+    def respond(self, request):
+        with self.counting:
+            self.requests += 1
+            number = self.requests
+        if self.drop_every and number % self.drop_every == 0:
+            raise ConnectionAbortedError('dropped request %d' % number)
+        if self.delay:
+            time.sleep(self.delay)
+        return ServiceServer.respond(self, request)
+
+    def legacy_client(self, ip, port, sock):
+        data = sock.recv(102400)
+        while data and not data.endswith(b'\n'):  # waits for the last line to be complete
+            chunk = sock.recv(102400)
+            if not chunk:
+                break
+            data += chunk
+        pairs = [tuple(line.split('\t')[:2]) for line in data.decode('utf-8').splitlines() if line.strip()]
+        with self.lock:
+            results = self.score_pairs(pairs)
+        sock.sendall(''.join('%s\t%s\t%s\t%s\t%s\n' % r for r in results if r).encode('utf-8'))
+        sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        return False
@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+
+"""
+Pipelined stages connected by bounded queues.
+
+Each stage runs in its own thread(s) or process(es) and hands its outputs to the next
+stage through a queue of at most `queue_size` items, so tokenization, the neural stages
+and output writing overlap and the slowest stage sets the throughput:
+
+    pipeline = Pipeline([Stage('tokenize', tokenize, workers=2),
+                         Stage('tag', make=load_tagger, batch_size=64, mode='process'),
+                         Stage('write', writer.write_batch, batch_size=256)])
+    for result in pipeline.run(lines):  # results in input order
+        pass
+    pipeline.report()
+
+A stage function maps one item to one result or, with `batch_size` > 1, a list of
+items to a list of results (Tagger.tag_batch, parser.parse_batch). `make` builds the
+function inside the worker, e.g. to load a model in the process that uses it; DyNet
+stages must run as processes since the computation graph is global to a process.
+Stages marked `ordered` see their inputs in input order (e.g. a writer) and have one
+worker. The first error stops all stages and is raised by `run` as a PipelineError
+carrying the stage name and traceback.
+"""
+
+import sys
+import queue
+import timeit
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+
+_END_ = '__end_of_stream__'
+_POLL_ = 0.1  # seconds between checks for an aborted pipeline while blocked
+
+
+class PipelineError(Exception):
+    def __init__(self, stage, trace):
+        Exception.__init__(self, 'stage %s failed:\n%s' % (stage, trace))
+        self.stage = stage
+        self.trace = trace
+
+
+class Stage(object):
+    def __init__(self, name, function=None, make=None, workers=1, batch_size=1, mode='thread', ordered=False):
+        if (function is None) == (make is None):
+            raise ValueError('stage %s needs either a function or a make' % name)
+        if ordered and workers != 1:
+            raise ValueError('ordered stage %s must have one worker' % name)
+        if mode not in ('thread', 'process'):
+            raise ValueError('unknown stage mode: %s' % mode)
+        self.name = name
+        self.function = function
+        self.make = make
+        self.workers = workers
+        self.batch_size = batch_size
+        self.mode = mode
+        self.ordered = ordered
+
+
+class Reorder(object):
+    """Releases (seq, value) pairs in sequence order."""
+
+    def __init__(self):
+        self.next = 0
+        self.pending = {}
+
+    def push(self, seq, value):
+        self.pending[seq] = value
+        ready = []
+        while self.next in self.pending:
+            ready.append((self.next, self.pending.pop(self.next)))
+            self.next += 1
+        return ready
+
+
+class Pipeline(object):
+    def __init__(self, stages, queue_size=64):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.times = {}
+
+    def make_queue(self, stage):
+        """Input queue of `stage`: a process queue if it or its producer runs in processes."""
+        i = self.stages.index(stage) if stage is not None else len(self.stages)
+        modes = set(s.mode for s in self.stages[max(i-1, 0):i+1])
+        if 'process' in modes:
+            return multiprocessing.get_context('fork').Queue(self.queue_size)
+        return queue.Queue(self.queue_size)
+
+    def run(self, items):
+        """Feeds `items` through the stages; yields the results in input order."""
+        ctx = multiprocessing.get_context('fork')
+        self.abort = ctx.Event()
+        self.errors = ctx.Queue()
+        self.stats_queue = ctx.Queue()
+        self.times = dict((stage.name, []) for stage in self.stages)
+        self.completed = False
+        queues = [self.make_queue(stage) for stage in self.stages] + [self.make_queue(None)]
+        self.started = timeit.default_timer()
+        workers = []
+        for i, stage in enumerate(self.stages):
+            n_producers = 1 if i == 0 else self.stages[i-1].workers
+            n_consumers = self.stages[i+1].workers if i+1 < len(self.stages) else 1
+            for _ in range(stage.workers):
+                args = (stage, queues[i], queues[i+1], n_producers, n_consumers)
+                if stage.mode == 'process':
+                    worker = ctx.Process(target=self.work, args=args)
+                else:
+                    worker = threading.Thread(target=self.work, args=args)
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+        feeder = threading.Thread(target=self.feed, args=(items, queues[0], self.stages[0].workers))
+        feeder.daemon = True
+        feeder.start()
+        try:
+            for value in self.drain(queues[-1], self.stages[-1].workers):
+                yield value
+        finally:
+            self.finish(workers, feeder, queues)
+
+    def feed(self, items, out, n_consumers):
+        try:
+            for seq, item in enumerate(items):
+                if not self.put(out, (seq, item)):
+                    return
+            for _ in range(n_consumers):
+                if not self.put(out, _END_):
+                    return
+        except Exception:
+            self.fail('input', traceback.format_exc())
+
+    def drain(self, inp, n_producers):
+        reorder, ends = Reorder(), 0
+        self.completed = False
+        while ends < n_producers:
+            message = self.get(inp)
+            if message is None:
+                break
+            if message == _END_:
+                ends += 1
+                continue
+            for seq, value in reorder.push(*message):
+                yield value
+        self.raise_error()
+        self.completed = True
+
+    def put(self, q, message):
+        """Blocks while `q` is full (backpressure); False if the pipeline was aborted."""
+        while not self.abort.is_set():
+            try:
+                q.put(message, timeout=_POLL_)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, q):
+        """The next message of `q`; None if the pipeline was aborted."""
+        while not self.abort.is_set():
+            try:
+                return q.get(timeout=_POLL_)
+            except queue.Empty:
+                pass
+        return None
+
+    def fail(self, stage, trace):
+        self.errors.put((stage, trace))
+        self.abort.set()
+
+    def raise_error(self):
+        if self.abort.is_set():
+            try:
+                stage, trace = self.errors.get(timeout=1)
+            except queue.Empty:
+                stage, trace = 'unknown', ''
+            raise PipelineError(stage, trace)
+
+    def work(self, stage, inp, out, n_producers, n_consumers):
+        busy = wait_in = wait_out = 0.
+        n_items = n_batches = 0
+        clock = timeit.default_timer
+        try:
+            function = stage.function if stage.make is None else stage.make()
+            reorder = Reorder() if stage.ordered else None
+            ends, pending = 0, deque()
+            while ends < n_producers or pending:
+                # a batch: block for the first message, then take what is already queued
+                start = clock()
+                batch = []
+                while len(batch) < stage.batch_size and (pending or ends < n_producers):
+                    if pending:
+                        batch.append(pending.popleft())
+                        continue
+                    if batch:
+                        try:
+                            message = inp.get_nowait()
+                        except queue.Empty:
+                            break
+                    else:
+                        message = self.get(inp)
+                        if message is None:
+                            return
+                    if message == _END_:
+                        ends += 1
+                    elif reorder is not None:
+                        pending.extend(reorder.push(*message))
+                    else:
+                        batch.append(message)
+                wait_in += clock() - start
+                if not batch:
+                    continue
+                start = clock()
+                if stage.batch_size > 1:
+                    results = function([item for seq, item in batch])
+                else:
+                    results = [function(item) for seq, item in batch]
+                busy += clock() - start
+                n_items += len(batch)
+                n_batches += 1
+                start = clock()
+                for (seq, item), result in zip(batch, results):
+                    if not self.put(out, (seq, result)):
+                        return
+                wait_out += clock() - start
+            for _ in range(n_consumers):
+                if not self.put(out, _END_):
+                    return
+        except Exception:
+            self.fail(stage.name, traceback.format_exc())
+        finally:
+            self.stats_queue.put((stage.name, busy, wait_in, wait_out, n_items, n_batches))
+
+    def finish(self, workers, feeder, queues):
+        if not self.completed:
+            self.abort.set()  # the consumer stopped early: stop the stages
+        for worker in workers:
+            worker.join(timeout=5)
+            if isinstance(worker, multiprocessing.process.BaseProcess) and worker.is_alive():
+                worker.terminate()
+        feeder.join(timeout=5)
+        for q in queues:
+            if hasattr(q, 'cancel_join_thread'):
+                q.cancel_join_thread()
+        self.wall = timeit.default_timer() - self.started
+        while True:
+            try:
+                name, busy, wait_in, wait_out, n_items, n_batches = self.stats_queue.get(timeout=0.5)
+            except queue.Empty:
+                break
+            self.times[name].append((busy, wait_in, wait_out, n_items, n_batches))
+            if sum(len(t) for t in self.times.values()) == len(workers):
+                break
+
+    def stats(self):
+        """
+        Per stage: items, batches, busy/starved/blocked seconds summed over its workers and
+        utilization (busy time over wall time x workers); the busiest stage limits throughput.
+        """
+        stats = {}
+        for stage in self.stages:
+            times = self.times.get(stage.name, [])
+            busy, wait_in, wait_out = [sum(t[k] for t in times) for k in range(3)]
+            stats[stage.name] = {'workers': stage.workers,
+                                 'items': sum(t[3] for t in times),
+                                 'batches': sum(t[4] for t in times),
+                                 'busy': busy,
+                                 'starved': wait_in,
+                                 'blocked': wait_out,
+                                 'utilization': busy / (self.wall*stage.workers) if getattr(self, 'wall', 0) else 0.0}
+        return stats
+
+    def report(self, stream=sys.stderr):
+        stats = self.stats()
+        stream.write("%-12s %7s %9s %9s %10s %10s %10s %6s\n" % ('stage', 'workers', 'items', 'batches',
+                     'busy s', 'starved s', 'blocked s', 'util'))
+        for stage in self.stages:
+            s = stats[stage.name]
+            stream.write("%-12s %7d %9d %9d %10.2f %10.2f %10.2f %5.0f%%\n" % (stage.name, s['workers'], s['items'],
+                         s['batches'], s['busy'], s['starved'], s['blocked'], 100*s['utilization']))
+        stream.write("wall %.2f s\n" % self.wall)
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+"""
+Evaluation scheduling, early stopping and background checkpoints shared by the trainers.
+
+By default the dev set is scored once per epoch. With `every` (training items) or
+`interval` (seconds) it is scored during the epoch instead; with `sample` a fixed random
+subset of the dev set is scored first and the full pass only runs when the subset score
+improves. A checkpoint is written whenever the full score improves, and training stops
+after `patience` evaluations without improvement:
+
+    schedule = from_args(args, evaluate, dev, tagger.model, tagger.meta)
+    for epoch in range(args.iter):
+        for batch in batches:
+            ...
+            if schedule.step(len(batch)): break
+        if schedule.epoch_end(): break
+    schedule.close()
+
+Checkpoints are binary bundles (utils.modelBundle): the parameters are copied in the
+training thread and written to disk by a background thread, so training never waits on
+I/O. A newer snapshot replaces one that has not been written yet.
+"""
+
+import sys
+import random
+import timeit
+import threading
+
+from utils.modelBundle import snapshot_parameters, write_bundle
+
+_SAMPLE_SEED_ = 37  # the dev subset is the same across runs
+
+
+class AsyncCheckpointer(object):
+    def __init__(self, prefix, meta):
+        self.prefix = prefix
+        self.meta = meta
+        self.pending = None
+        self.closed = False
+        self.written = 0
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, params):
+        """Snapshots a DyNet ParameterCollection and queues it for writing."""
+        arrays = snapshot_parameters(params)
+        with self.cond:
+            self.pending = arrays
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                arrays, self.pending = self.pending, None
+            try:
+                write_bundle(self.prefix, self.meta, arrays)
+                self.written += 1
+            except Exception as e:
+                sys.stderr.write('Checkpoint of %s failed: %s\n' % (self.prefix, e))
+
+    def close(self):
+        """Writes the last queued snapshot and stops the writer."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+
+class TrainingSchedule(object):
+    """
+    `evaluate(items)` scores a list of dev items (higher is better); `params` is the
+    ParameterCollection saved through `checkpoint` (an AsyncCheckpointer or None).
+    """
+
+    def __init__(self, evaluate, dev, params=None, every=0, interval=0., sample=0, patience=0,
+                 checkpoint=None, stream=sys.stderr):
+        self.evaluate = evaluate
+        self.dev = dev
+        self.params = params
+        self.every = every
+        self.interval = interval
+        self.subset = random.Random(_SAMPLE_SEED_).sample(dev, sample) if 0 < sample < len(dev) else None
+        self.patience = patience
+        self.checkpoint = checkpoint
+        self.stream = stream
+        self.best = float('-inf')
+        self.best_sample = float('-inf')
+        self.bad = 0  # evaluations since the last improvement
+        self.evaluations = 0
+        self.stopped = False
+        self.seen = self.last_seen = 0
+        self.last_time = timeit.default_timer()
+
+    def step(self, n=1):
+        """Counts `n` trained items and evaluates when due; True once training should stop."""
+        self.seen += n
+        if (self.every and self.seen - self.last_seen >= self.every) or \
+           (self.interval and timeit.default_timer() - self.last_time >= self.interval):
+            self.run()
+        return self.stopped
+
+    def epoch_end(self):
+        """Evaluates if no in-epoch schedule is set; True once training should stop."""
+        if not (self.every or self.interval):
+            self.run()
+        return self.stopped
+
+    def run(self):
+        self.last_seen, self.evaluations = self.seen, self.evaluations + 1
+        if self.subset is not None:
+            score = self.evaluate(self.subset)
+            self.stream.write('Eval %d (%d items) sample score: %s\n' % (self.evaluations, self.seen, score))
+            if score <= self.best_sample:
+                self.worse()
+                return
+            self.best_sample = score
+        score = self.evaluate(self.dev)
+        self.stream.write('Eval %d (%d items) dev score: %s\n' % (self.evaluations, self.seen, score))
+        if score > self.best:
+            self.best, self.bad = score, 0
+            self.stream.write('SAVE POINT %d\n' % self.evaluations)
+            if self.checkpoint is not None:
+                self.checkpoint.save(self.params)
+            self.stream.flush()
+            self.last_time = timeit.default_timer()
+        else:
+            self.worse()
+
+    def worse(self):
+        self.bad += 1
+        if self.patience and self.bad >= self.patience:
+            self.stream.write('Early stopping: no improvement in %d evaluations (best %s)\n' % (self.bad, self.best))
+            self.stopped = True
+        self.stream.flush()
+        self.last_time = timeit.default_timer()
+
+    def close(self):
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+        return self.best
+
+
+def add_arguments(parser):
+    """Adds the evaluation/early stopping options to an ArgumentParser."""
+    parser.add_argument('--eval-every', dest='eval_every', type=int, default=0, help='Evaluate every N training items (default: once per epoch)')
+    parser.add_argument('--eval-interval', dest='eval_interval', type=float, default=0., help='Evaluate every N seconds of training')
+    parser.add_argument('--eval-sample', dest='eval_sample', type=int, default=0, help='Dev items scored before a full dev pass (0 = always full)')
+    parser.add_argument('--patience', type=int, default=0, help='Stop after N evaluations without improvement (0 = never)')
+
+def from_args(args, evaluate, dev, params, meta, prefix=None):
+    """A TrainingSchedule configured by add_arguments' options; checkpoints go to `prefix` (default --save-model)."""
+    prefix = prefix or args.save_model
+    checkpoint = AsyncCheckpointer(prefix, meta) if prefix else None
+    return TrainingSchedule(evaluate, dev, params, args.eval_every, args.eval_interval,
+                            args.eval_sample, args.patience, checkpoint)
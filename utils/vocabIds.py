@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+"""
+Word and character ids computed once per sentence instead of once per token and epoch.
+
+The character frequency threshold (characters seen <= 5 times map to `unk`) is folded
+into the character vocabulary when the encoder is built, so encoding a word is one dict
+lookup per character.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+
+class SentenceIds(namedtuple('SentenceIds', ['words', 'chars', 'offsets'])):
+    """
+    int32 word ids (n,), the char ids of all words with bos/eos around each word, and
+    offsets (n+1,) into them.
+    """
+    __slots__ = ()
+
+    def word_chars(self, i):
+        return self.chars[self.offsets[i]:self.offsets[i+1]]
+
+
+def char_vocabulary(c2i, cc, threshold=5):
+    """c2i restricted to the characters seen more than `threshold` times."""
+    return dict((c, i) for c, i in c2i.items() if cc.get(c, 0) > threshold)
+
+
+class VocabEncoder(object):
+    def __init__(self, w2i, c2i, cc, lowercase=True, threshold=5):
+        self.w2i = w2i
+        self.lowercase = lowercase  # fall back to the lowercased word
+        self.chars = char_vocabulary(c2i, cc, threshold)
+        self.bos, self.eos, self.unk = c2i["bos"], c2i["eos"], c2i["unk"]
+
+    def word_id(self, word):
+        if self.lowercase:
+            return self.w2i.get(word, self.w2i.get(word.lower(), 0))
+        return self.w2i.get(word, 0)
+
+    def encode(self, words):
+        chars, unk = self.chars, self.unk
+        char_ids, offsets = [], [0]
+        for word in words:
+            char_ids.append(self.bos)
+            char_ids.extend([chars.get(c, unk) for c in word])
+            char_ids.append(self.eos)
+            offsets.append(len(char_ids))
+        return SentenceIds(np.array([self.word_id(w) for w in words], dtype=np.int32),
+                           np.array(char_ids, dtype=np.int32), np.array(offsets, dtype=np.int32))
+
+    def encode_all(self, sentences):
+        return [self.encode(words) for words in sentences]
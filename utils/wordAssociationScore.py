@@ -6,6 +6,8 @@ from math import log
 import nltk
 from collections import Counter
 
+from utils.profiling import timed
+
 def joint_probability(ngrams, prior, ntype):
     ngramJointProb = dict()
     for ngram in ngrams:
@@ -54,6 +56,7 @@ def extract_ngrams(text):
         [trigrams.update([" ".join(ngram)]) for ngram in nltk.ngrams(sentTokens, 3) ]
     return unigrams, bigrams, trigrams
 
+@timed('npmi')
 def get_npmi(text):
     unigramCounts, bigramCounts, trigramCounts = extract_ngrams(text)
     vocab = float(sum(unigramCounts.values()))